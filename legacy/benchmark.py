@@ -0,0 +1,420 @@
+﻿#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Mesures de performances du module stepregexp comparé au module re de python.
+
+Usage : python benchmark.py [-baseline répertoire] [fichier.json]
+
+Cinq séries de mesures sont réalisées :
+- les expressions de customfilters sur des flux HTTP/HTML synthétiques (le
+  corpus est toujours le même : générateur aléatoire à graine fixe),
+  reconnaissance caractère par caractère comme dans les filtres et recherche
+  dans tout le flux ;
+- le cas pathologique a?^n a^n (voir la section Troubleshooting de
+  doc/Main.md) ;
+- l'automate paresseux à froid (premier passage, les états sont construits)
+  et à chaud (second passage), comparé à l'automate minimal précalculé ;
+- les piles de filtres de tcpsteg sur des réponses HTTP à gros corps HTML,
+  caractère par caractère (write()/read()) et par blocs (writeBlock()) ;
+- tools.rank() et tools.unrank() sur des listes de 2 à 64 éléments (nombre
+  d'entêtes HTTP ou d'attributs d'une balise).
+
+Pour chaque mesure sont donnés le débit (Mo/s), la latence par caractère
+(ns), le nombre d'états de l'automate déterministe et une estimation de sa
+taille en mémoire. Les résultats sont écrits au format JSON (sur la sortie
+standard ou dans le fichier donné) pour pouvoir être comparés d'une version à
+l'autre, un résumé lisible est écrit sur la sortie d'erreur.
+
+Python 2 n'offre pas de compteur d'allocations : pour les filtres, les
+buffers créés sont comptés directement lors d'un second passage (voir
+countBuffers()) : nombre de buffers par Mo et octets de buffer créés par
+octet reçu. Le nombre de défauts de page mineurs par Mo (getrusage) est
+aussi donné. Avec -baseline, les piles de filtres sont de plus mesurées avec
+les modules d'une version antérieure de legacy/ (par exemple extraite avec
+"git archive <révision> legacy"), dans un autre processus : les résultats
+sont préfixés par "baseline/".
+"""
+
+import sys
+# mesure des filtres d'une autre version (voir baseline()) : ses modules
+# remplacent ceux du répertoire du script
+if len(sys.argv) > 2 and sys.argv[1] == "-filters":
+    sys.path.insert(0,sys.argv[2])
+import os
+import subprocess
+import json
+import random
+import platform
+import resource
+import timeit
+import re as stdre
+import stepregexp as re
+import tools
+import customfilters
+from customfilters import REGEXP_HTTP_REQRESP, REGEXP_HTML_TAG
+from customfilters import HTTPDataExtractorFilter, HTTPHeaderPermutFilterIn, HTTPHeaderPermutFilterOut
+from customfilters import HTMLTagsPermutFilterIn, HTMLTagsPermutFilterOut
+from streamfilters import FILTER_PASS, SerialFilterGroup, AbstractWriter, FIFOBuffer
+from streamfilters import BinaryReader, BinaryWriter, PacketReader, PacketWriter
+
+REGEXP_HTTP_HOST = "Host: [^\r\n]+\r\n"
+
+# nombre de répétitions de chaque mesure (on garde la meilleure)
+REPEAT = 3
+# tailles du cas pathologique
+PATHOLOGICAL_SIZES = [5,10,15,18,20]
+# nombre de balises du corps HTML des réponses passées dans les filtres et
+# graine de leur générateur (la même pour toutes les versions mesurées)
+FILTER_TAGS = 1500
+FILTER_SEED = 2010
+# taille des blocs reçus par la boucle des sockets de tcpsteg
+RECV_SIZE = 4096
+# tailles des listes permutées et nombre de permutations par mesure
+PERMUTATION_SIZES = [2,4,8,16,32,64]
+PERMUTATIONS = 2000
+
+def httpCorpus(rand,n):
+    """ Retourne n couples requête/réponse HTTP. """
+    methods = ["GET","POST","HEAD","PUT"]
+    paths = ["/","/index.html","/img/logo.png","/search?q=covert+channel","/a/b/c#top"]
+    hosts = ["example.org","www.example.com","10.0.0.1:8080"]
+    agents = ["Mozilla/5.0 (X11; Linux x86_64)","curl/7.19.7","Wget/1.12"]
+    result = []
+    for i in xrange(n):
+        request = rand.choice(methods)+" "+rand.choice(paths)+" HTTP/1."+rand.choice("01")+"\r\n"
+        headers = ["Host: "+rand.choice(hosts)+"\r\n",
+                   "User-Agent: "+rand.choice(agents)+"\r\n",
+                   "Accept: */*\r\n",
+                   "Accept-Language: fr,en;q=0.5\r\n",
+                   "Connection: keep-alive\r\n"]
+        rand.shuffle(headers)
+        result.append(request+"".join(headers)+"\r\n")
+        body = "x"*rand.randint(0,200)
+        result.append("HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: "+str(len(body))+"\r\n\r\n"+body)
+    return "".join(result)
+
+def htmlCorpus(rand,n):
+    """ Retourne une page HTML de n balises. """
+    names = ["a","p","div","img","span","td"]
+    attribs = ["href","src","id","class","alt","title","width"]
+    words = ["covert","channel","python","filter","stream","lorem","ipsum"]
+    result = ["<html><body>"]
+    for i in xrange(n):
+        tag = "<"+rand.choice(names)
+        for j in xrange(rand.randint(0,4)):
+            value = " ".join([rand.choice(words) for k in xrange(rand.randint(0,3))])
+            if rand.random() < 0.5:
+                tag += " "+rand.choice(attribs)+'="'+value+'"'
+            else:
+                tag += " "+rand.choice(attribs)+" = '"+value+"'"
+        result.append(tag+">")
+        result.append(" ".join([rand.choice(words) for k in xrange(rand.randint(1,20))]))
+    result.append("</body></html>")
+    return "\n".join(result)
+
+def automatonSize(automaton):
+    """ Retourne le couple (nombre d'états,estimation de la taille en octets)
+        d'un automate déterministe (Automaton ou EagerAutomaton). """
+    if isinstance(automaton,re.EagerAutomaton):
+        size = automaton.table.itemsize*len(automaton.table)+len(automaton.finals)
+        return (automaton.nstates,size)
+    size = 0
+    for state in automaton.dstates.itervalues():
+        size += sys.getsizeof(state)+sys.getsizeof(state.__dict__)
+        size += sys.getsizeof(state.trans)+sys.getsizeof(state.ndstates)
+    return (len(automaton.dstates),size)
+
+def best(f):
+    """ Exécute REPEAT fois la fonction f et retourne la meilleure durée. """
+    result = None
+    for i in xrange(REPEAT):
+        start = timeit.default_timer()
+        f()
+        t = timeit.default_timer()-start
+        if result == None or t < result:
+            result = t
+    return result
+
+def measure(name,n,seconds,automaton=None,**extra):
+    """ Construit le résultat d'une mesure sur n caractères. """
+    result = {"name":name,"bytes":n,"seconds":seconds}
+    if seconds > 0:
+        result["mb_per_s"] = n/seconds/1e6
+    result["ns_per_byte"] = seconds*1e9/max(n,1)
+    if automaton != None:
+        result["states"],result["memory"] = automatonSize(automaton)
+    result.update(extra)
+    return result
+
+def stream(p,corpus):
+    """ Reconnaissance caractère par caractère comme dans les filtres :
+        l'expression est réinitialisée après chaque ACCEPT ou FAIL. Retourne
+        le nombre de chaînes reconnues. """
+    count = 0
+    for c in corpus:
+        x = p.next(c)
+        if x != re.PASS:
+            if x == re.ACCEPT:
+                count += 1
+            p.reset()
+    return count
+
+def streamFeed(p,corpus,skip=True):
+    """ Même traitement que stream() à l'aide de Pattern.feed(). Comme dans
+        les filtres (AbstractFilter.processBlock()), les caractères qui ne
+        peuvent pas commencer une chaîne sont sautés avec skip() après chaque
+        réinitialisation. Avec skip=False, feed() est appelée sur chacun
+        d'eux : un appel par caractère, le cas le plus défavorable. """
+    count = 0
+    i = 0
+    n = len(corpus)
+    while i < n:
+        if skip:
+            i = p.skip(corpus,i)
+            if i == n:
+                break
+        x,i = p.feed(corpus,i)
+        if x != re.PASS:
+            if x == re.ACCEPT:
+                count += 1
+            p.reset()
+    return count
+
+def benchPattern(name,s,corpus):
+    """ Mesures d'une expression sur un corpus. """
+    results = []
+    n = len(corpus)
+    # reconnaissance caractère par caractère : automate paresseux à froid
+    # (le premier passage construit les états) puis à chaud
+    start = timeit.default_timer()
+    p = re.compile(s)
+    compileTime = timeit.default_timer()-start
+    start = timeit.default_timer()
+    count = stream(p,corpus)
+    results.append(measure(name+"/stream/lazy-cold",n,timeit.default_timer()-start,p.automaton,compile_seconds=compileTime,matches=count))
+    p.reset()
+    results.append(measure(name+"/stream/lazy-warm",n,best(lambda: stream(p,corpus)),p.automaton,matches=count))
+    p.reset()
+    results.append(measure(name+"/stream/lazy-warm-feed",n,best(lambda: streamFeed(p,corpus)),p.automaton,matches=streamFeed(p,corpus)))
+    results.append(measure(name+"/stream/lazy-warm-feed-noskip",n,best(lambda: streamFeed(p,corpus,False)),p.automaton,matches=streamFeed(p,corpus,False)))
+    start = timeit.default_timer()
+    e = re.compile(s,True)
+    compileTime = timeit.default_timer()-start
+    results.append(measure(name+"/stream/eager",n,best(lambda: stream(e,corpus)),e.automaton,compile_seconds=compileTime,matches=stream(e,corpus)))
+    results.append(measure(name+"/stream/eager-feed",n,best(lambda: streamFeed(e,corpus)),e.automaton,matches=streamFeed(e,corpus)))
+    results.append(measure(name+"/stream/eager-feed-noskip",n,best(lambda: streamFeed(e,corpus,False)),e.automaton,matches=streamFeed(e,corpus,False)))
+    # recherche dans tout le flux
+    searcher = re.compileSearch(s)
+    start = timeit.default_timer()
+    count = len(searcher.feed(corpus)+searcher.flush())
+    results.append(measure(name+"/search/cold",n,timeit.default_timer()-start,searcher.automaton,matches=count,prefilter=searcher.automaton.prefilter != None))
+    def search():
+        searcher.reset()
+        searcher.feed(corpus)
+        searcher.flush()
+    results.append(measure(name+"/search/warm",n,best(search),searcher.automaton,matches=count))
+    prefilter = searcher.automaton.prefilter
+    searcher.automaton.prefilter = None
+    results.append(measure(name+"/search/warm-noprefilter",n,best(search),searcher.automaton,matches=count))
+    searcher.automaton.prefilter = prefilter
+    # module re de python (recherche, reconnaissance la plus à gauche mais
+    # pas toujours la plus longue)
+    r = stdre.compile(s)
+    results.append(measure(name+"/search/python-re",n,best(lambda: list(r.finditer(corpus))),matches=len(list(r.finditer(corpus)))))
+    return results
+
+def benchPathological():
+    """ Mesures du cas a?^n a^n reconnu sur a^n. """
+    results = []
+    for n in PATHOLOGICAL_SIZES:
+        s = "a?"*n+"a"*n
+        text = "a"*n
+        def step():
+            p = re.compile(s)
+            for c in text:
+                p.next(c)
+            return p.isAccepted()
+        p = re.compile(s)
+        p.feed(text)
+        results.append(measure("pathological/%d/stepregexp-lazy" % n,n,best(step),p.automaton,compile_included=True))
+        e = re.compile(s,True)
+        def eager():
+            e.reset()
+            return e.feed(text)
+        results.append(measure("pathological/%d/stepregexp-eager" % n,n,best(eager),e.automaton))
+        results.append(measure("pathological/%d/python-re" % n,n,best(lambda: stdre.match(s,text))))
+    return results
+
+def filterStacks(secret):
+    """ Retourne les piles de filtres d'encodage (serveur tcpsteg) et de
+        décodage (client tcpsteg) des réponses HTTP. Les bits cachés sont lus
+        dans la chaîne secret. """
+    reader = BinaryReader(PacketReader(FIFOBuffer(secret)))
+    writer = BinaryWriter(PacketWriter(FIFOBuffer()))
+    # les versions antérieures n'ont que SerialFilterGroup
+    group = getattr(customfilters,"HTTPFilterGroup",SerialFilterGroup)
+    return (group([HTTPDataExtractorFilter(HTMLTagsPermutFilterIn(reader)),HTTPHeaderPermutFilterIn(reader)]),
+            group([HTTPDataExtractorFilter(HTMLTagsPermutFilterOut(writer)),HTTPHeaderPermutFilterOut(writer)]))
+
+class BufferCounter:
+    """ Compteurs des buffers créés par une pile de filtres (voir
+        countBuffers()). """
+    def __init__(self):
+        self.buffers = 0
+        self.bytes = 0
+
+def countBuffers(f,counter):
+    """ Instrumente le filtre f et les filtres qu'il contient : chaque nouvel
+        objet affecté à leur attribut buffer (chaîne recopiée par +=,
+        bytearray créé par reset()...) est compté dans counter avec sa
+        taille. Un bytearray agrandi sur place n'est pas compté. """
+    cls = f.__class__
+    class Counting(cls):
+        def __setattr__(self,name,value):
+            if name == "buffer" and value is not self.__dict__.get(name):
+                counter.buffers += 1
+                counter.bytes += len(value)
+            self.__dict__[name] = value
+    f.__class__ = Counting
+    for g in getattr(f,"filters",[]):
+        countBuffers(g,counter)
+    if hasattr(f,"filter"):
+        countBuffers(f.filter,counter)
+
+def pumpChars(f,corpus):
+    """ Fait traverser le corpus au filtre f caractère par caractère et
+        retourne la sortie du filtre. """
+    result = []
+    for c in corpus:
+        if f.write(c) == FILTER_PASS:
+            result.append(f.read())
+            f.reset()
+    return "".join(result)
+
+def pumpBlocks(f,corpus):
+    """ Fait traverser le corpus au filtre f par blocs de RECV_SIZE
+        caractères (voir AbstractFilter.writeBlock()) et retourne la sortie
+        du filtre. """
+    result = bytearray()
+    for i in xrange(0,len(corpus),RECV_SIZE):
+        data = corpus[i:i+RECV_SIZE]
+        j = 0
+        while j < len(data):
+            k,x,outputs = f.writeBlock(data,j)
+            j += k
+            for s in outputs:
+                result += s
+    return str(result)
+
+def benchFilters():
+    """ Mesures des piles de filtres sur une réponse HTTP dont le corps est
+        envoyé avec Content-Length puis par chunks : encodage puis décodage
+        de la réponse encodée. Les buffers créés sont comptés lors d'un
+        second passage, par des piles instrumentées (voir countBuffers()). """
+    results = []
+    page = htmlCorpus(random.Random(FILTER_SEED),FILTER_TAGS)
+    corpus = "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: %d\r\n\r\n%s" % (len(page),page)
+    corpus += "HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nTransfer-Encoding: chunked\r\n\r\n%x\r\n%s\r\n0\r\n" % (len(page),page)
+    secret = "covert channel "*1000
+    for mode,pump in (("char",pumpChars),("block",pumpBlocks)):
+        data = corpus
+        for name,f,g in zip(("encode","decode"),filterStacks(secret),filterStacks(secret)):
+            faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+            start = timeit.default_timer()
+            output = pump(f,data)
+            seconds = timeit.default_timer()-start
+            faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt-faults
+            counter = BufferCounter()
+            countBuffers(g,counter)
+            pump(g,data)
+            results.append(measure("filters/%s/%s" % (name,mode),len(data),seconds,
+                                   page_faults_per_mb=faults*1e6/len(data),
+                                   buffers_per_mb=counter.buffers*1e6/len(data),
+                                   buffer_bytes_per_byte=float(counter.bytes)/len(data)))
+            data = output
+    return results
+
+def baseline(directory):
+    """ Mesure les piles de filtres (benchFilters()) avec les modules du
+        répertoire directory, dans un autre processus. Les noms des
+        résultats sont préfixés par "baseline/". """
+    p = subprocess.Popen([sys.executable,os.path.abspath(__file__),"-filters",directory],stdout=subprocess.PIPE)
+    output = p.communicate()[0]
+    if p.returncode != 0:
+        raise Exception("baseline measure failed in '"+directory+"'")
+    results = json.loads(output)
+    for r in results:
+        r["name"] = "baseline/"+r["name"]
+    return results
+
+def benchPermutations(rand):
+    """ Mesures de tools.rank() et tools.unrank() sur PERMUTATIONS
+        permutations aléatoires de listes de PERMUTATION_SIZES éléments
+        (chaînes semblables à des entêtes HTTP). """
+    results = []
+    for n in PERMUTATION_SIZES:
+        l = sorted("X-Header-%03d: value\r\n" % i for i in xrange(n))
+        ranks = [rand.randrange(tools.fact(n)) for i in xrange(PERMUTATIONS)]
+        perms = [tools.unrank(x,l) for x in ranks]
+        def unrankAll():
+            for x in ranks:
+                tools.unrank(x,l)
+        def rankAll():
+            for p in perms:
+                tools.rank(p)
+        for name,f in (("unrank",unrankAll),("rank",rankAll)):
+            seconds = best(f)
+            results.append(measure("permutations/%s/%d" % (name,n),n*PERMUTATIONS,seconds,us_per_call=seconds*1e6/PERMUTATIONS))
+    return results
+
+def summary(results,out):
+    """ Écrit un résumé lisible des résultats sur out. """
+    for r in results:
+        line = "%-45s %10.3f ms %10.1f ns/B" % (r["name"],r["seconds"]*1e3,r["ns_per_byte"])
+        if "mb_per_s" in r:
+            line += " %8.2f MB/s" % r["mb_per_s"]
+        if "states" in r:
+            line += " %6d states %9d B" % (r["states"],r["memory"])
+        if "page_faults_per_mb" in r:
+            line += " %8.0f faults/MB" % r["page_faults_per_mb"]
+        if "buffers_per_mb" in r:
+            line += " %9.0f buffers/MB %9.1f B/B" % (r["buffers_per_mb"],r["buffer_bytes_per_byte"])
+        if "us_per_call" in r:
+            line += " %8.2f us/call" % r["us_per_call"]
+        out.write(line+"\n")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "-filters":
+        json.dump(benchFilters(),sys.stdout)
+        sys.exit(0)
+    directory = None
+    if len(sys.argv) > 2 and sys.argv[1] == "-baseline":
+        directory = sys.argv[2]
+        del sys.argv[1:3]
+    rand = random.Random(2010)
+    http = httpCorpus(rand,300)
+    html = htmlCorpus(rand,1500)
+    results = []
+    results += benchPattern("http_reqresp",REGEXP_HTTP_REQRESP,http)
+    results += benchPattern("http_host",REGEXP_HTTP_HOST,http)
+    results += benchPattern("html_tag",REGEXP_HTML_TAG,html)
+    results += benchPathological()
+    results += benchFilters()
+    if directory != None:
+        results += baseline(directory)
+    results += benchPermutations(rand)
+    report = {"python":platform.python_version(),
+              "platform":platform.platform(),
+              "repeat":REPEAT,
+              "results":results}
+    summary(results,sys.stderr)
+    if len(sys.argv) > 1:
+        f = open(sys.argv[1],"w")
+        try:
+            json.dump(report,f,indent=1,sort_keys=True)
+        finally:
+            f.close()
+    else:
+        json.dump(report,sys.stdout,indent=1,sort_keys=True)
+        sys.stdout.write("\n")
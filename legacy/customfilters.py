@@ -6,6 +6,8 @@ import stepregexp as re
 import re as stdre
 import tools
 import string
+import os
+import hashlib
 
 
 REGEXP_URI = "(([^:/?#]+):)?(//([^/?#]*))?([^?#]*)(\?([^#]*))?(#(.*))?"
@@ -13,143 +15,441 @@ REGEXP_HTTP_REQUEST = "(GET|POST|PUT|DELETE|HEAD|TRACE|CONNECT|OPTIONS) "+REGEXP
 REGEXP_HTTP_RESPONSE = "HTTP/[0-9]\.[0-9] [1-5][0-1][0-9] [^\r\n]*\r\n"
 REGEXP_HTTP_REQRESP = "("+REGEXP_HTTP_REQUEST+"|"+REGEXP_HTTP_RESPONSE+")"
 
-class HTTPHeaderPermutFilterIn(AbstractTerminalFilterIn):
+# répertoire des automates précompilés des filtres (voir stepregexp.save())
+DFA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),"dfa")
+
+def compilePattern(s,name,captures=None):
+    """ Retourne une nouvelle expression compilée pour s. L'automate minimal
+        (l'automate à marques si captures donne les groupes capturés, voir
+        stepregexp.compileCaptures()) est partagé par tous les filtres et
+        chargé lors de sa première utilisation depuis le fichier
+        DFA_DIR/name.dfa. Si ce fichier manque ou ne correspond plus à
+        l'expression, l'automate est compilé en mémoire : le fichier n'est
+        jamais écrit ici (voir saveAutomata()). """
+    return re.compileShared(s,True,filename=os.path.join(DFA_DIR,name+".dfa"),captures=captures)
+
+def saveAutomata(directory=DFA_DIR):
+    """ Compile les expressions des filtres et enregistre leurs automates
+        dans le répertoire directory. À lancer explicitement (python
+        customfilters.py) après la modification d'une expression. """
+    re.save(re.compile(REGEXP_HTTP_REQRESP,True),os.path.join(directory,"http_reqresp.dfa"))
+    re.save(re.compileCaptures(REGEXP_HTML_TAG,HTML_TAG_GROUPS),os.path.join(directory,"html_tag.dfa"))
+
+def permutationBits(n):
+    """ Retourne le nombre de bits entiers codés par une permutation de n
+        éléments : floor(log2(n!)). """
+    return tools.fact(n).bit_length()-1
+
+def readRank(reader,n,fractional=False):
+    """ Lit sur reader le rang d'une permutation de n éléments et retourne
+        le couple (rang,nombre de bits lus).
+        Par défaut permutationBits(n) bits sont lus : les permutations de
+        rang supérieur ne sont jamais utilisées. Si fractional vaut True, les
+        n! rangs forment un code préfixe complet (code binaire tronqué) : les
+        2^(e+1)-n! premiers rangs sont codés sur e = permutationBits(n) bits,
+        les suivants sur e+1 bits. Une permutation transporte alors en
+        moyenne entre e et log2(n!) bits (2,5 bits au lieu de 2 pour 3
+        attributs, au plus 0,09 bit de moins que log2(n!)), chaque message
+        restant décodable seul. """
+    count = tools.fact(n)
+    e = count.bit_length()-1
+    x = reader.read(e)
+    if fractional:
+        short = (2 << e)-count
+        if x >= short:
+            x = ((x << 1) | reader.read(1))-short
+            e += 1
+    return (x,e)
+
+def writeRank(writer,x,n,fractional=False):
+    """ Ecrit sur writer le rang x d'une permutation de n éléments (voir
+        readRank()) et retourne le nombre de bits écrits. """
+    e = permutationBits(n)
+    if fractional:
+        short = (2 << e)-tools.fact(n)
+        if x >= short:
+            writer.write(x+short,e+1)
+            return e+1
+    writer.write(x,e)
+    return e
+
+# nombre d'ensembles d'entêtes mémorisés par chaque filtre de permutation
+HEADER_CACHE_SIZE = 256
+
+def analyzeHeaders(cache,headers):
+    """ Retourne le couple (entêtes triés, nombre de bits codés par leur
+        permutation) pour la liste d'entêtes headers. Un ensemble d'entêtes contenant des doublons
+        ne code rien : deux permutations qui échangent des doublons sont
+        identiques et ne pourraient pas être décodées. Les ensembles sans
+        doublon sont mémorisés dans cache (tools.LRUCache) : les navigateurs
+        envoient presque toujours les mêmes entêtes. """
+    key = frozenset(headers)
+    if len(key) != len(headers):
+        return (sorted(headers),0)
+    result = cache.get(key)
+    if result == None:
+        result = (sorted(headers),permutationBits(len(headers)))
+        cache.put(key,result)
+    return result
+
+# résultats de HTTPMessageParser.feed()
+HTTP_WAITING = 0
+""" Le message n'est pas terminé, tout le bloc a été consommé. """
+HTTP_HEADERS = 1
+""" Fin des entêtes : le message est terminé si le parser n'analyse pas le
+    corps des messages ou si sa longueur ne peut être déterminée. """
+HTTP_END = 2
+""" Fin du corps du message. """
+HTTP_ERROR = 3
+""" Le flux ne commence pas par une première ligne de requête ou de réponse,
+    ou le découpage du corps est invalide. """
+
+# étapes de l'analyse d'un message
+HTTP_PARSE_LINE = 0
+HTTP_PARSE_HEADERS = 1
+HTTP_PARSE_LENGTH = 2
+HTTP_PARSE_CHUNK_SIZE = 3
+HTTP_PARSE_CHUNK_DATA = 4
+HTTP_PARSE_CHUNK_CR = 5
+HTTP_PARSE_CHUNK_LF = 6
+HTTP_PARSE_DONE = 7
+
+class HTTPMessage:
+    """ Modèle d'un message HTTP/1.x construit par HTTPMessageParser. Les
+        filtres peuvent modifier la première ligne et les entêtes puis
+        reconstruire le message avec head(). """
+    def __init__(self):
+        # première ligne (requête ou réponse), "\r\n" compris
+        self.requestLine = ""
+        # lignes d'entête ("\r\n" compris) et leurs positions dans le message
+        # analysé
+        self.headers = []
+        self.offsets = []
+        # découpage du corps : valeur de la dernière entête Content-Length
+        # (None si elle est absente) et codage par chunks
+        self.length = None
+        self.chunked = False
+        # True lorsque la ligne vide qui termine les entêtes a été lue
+        self.complete = False
+    def head(self):
+        """ Retourne la première ligne et les entêtes du message, ligne vide
+            comprise. """
+        return self.requestLine+string.join(self.headers,"")+"\r\n"
+
+class AbstractHTTPListener:
+    """ Classe abstraite des abonnés d'un HTTPMessageParser. Chaque méthode
+        est appelée lorsque la partie correspondante du message a été
+        analysée. """
+    def requestLine(self,message):
+        """ La première ligne (message.requestLine) a été reconnue. """
+        pass
+    def header(self,message,i):
+        """ L'entête message.headers[i] a été lue. """
+        pass
+    def headersEnd(self,message):
+        """ Toutes les entêtes ont été lues. """
+        pass
+    def bodySegment(self,message,data):
+        """ Reçoit un segment (chaîne ou bytearray) du corps du message, sans
+            l'encodage par chunks. """
+        pass
+    def messageEnd(self,message):
+        """ Le corps du message a été entièrement lu. """
+        pass
+
+class HTTPMessageParser:
+    """ Analyseur incrémental de messages HTTP/1.x. Le flux est injecté par
+        blocs (feed()) et analysé une seule fois : la première ligne est
+        reconnue par l'automate de REGEXP_HTTP_REQRESP, les entêtes et le
+        corps sont découpés par recherche des fins de ligne, sans traitement
+        par caractère. Le parser construit le modèle du message courant
+        (self.message, HTTPMessage) et prévient ses abonnés
+        (AbstractHTTPListener). Si body vaut False, l'analyse s'arrête à la
+        fin des entêtes. """
+    def __init__(self,body=False):
+        self.body = body
+        self.pattern = compilePattern(REGEXP_HTTP_REQRESP,"http_reqresp")
+        self.listeners = []
+        self.reset()
+    def subscribe(self,listener):
+        """ Ajoute un abonné (AbstractHTTPListener) aux événements du
+            parser. """
+        self.listeners.append(listener)
+    def reset(self):
+        """ Prépare le parser pour un nouveau message. """
+        self.pattern.reset()
+        self.message = HTTPMessage()
+        self.step = HTTP_PARSE_LINE
+        self.result = HTTP_WAITING
+        # ligne en cours (entête ou taille de chunk)
+        self.line = ""
+        # position de la ligne en cours dans le message
+        self.offset = 0
+        # octets restant à lire dans le corps ou dans le chunk courant
+        self.remaining = 0
+    def skip(self,buf,start):
+        """ Retourne la position du premier caractère de buf (à partir de
+            start) qui peut commencer un message. N'a de sens que juste après
+            reset(). """
+        return self.pattern.skip(buf,start)
+    def feed(self,buf,start=0,end=None):
+        """ Analyse le bloc buf (chaîne ou bytearray) de la position start à
+            la position end (len(buf) par défaut). L'analyse s'arrête à la fin
+            du message ou à la première erreur. Retourne le couple (nombre de
+            caractères consommés, résultat) où le résultat vaut HTTP_WAITING
+            si tout le bloc a été consommé sans terminer le message,
+            HTTP_HEADERS, HTTP_END ou HTTP_ERROR sinon (le parser doit alors
+            être remis à zéro). """
+        if self.step == HTTP_PARSE_DONE:
+            return (0,self.result)
+        if end == None:
+            end = len(buf)
+        elif end < len(buf):
+            buf = buf[:end]
+        message = self.message
+        i = start
+        while i < end:
+            step = self.step
+            if step == HTTP_PARSE_LINE:
+                x,j = self.pattern.feed(buf,i)
+                message.requestLine += str(buf[i:j])
+                i = j
+                if x == re.FAIL:
+                    return self.finish(i-start,HTTP_ERROR)
+                if x == re.ACCEPT:
+                    self.step = HTTP_PARSE_HEADERS
+                    self.offset = len(message.requestLine)
+                    for l in self.listeners:
+                        l.requestLine(message)
+            elif step == HTTP_PARSE_HEADERS or step == HTTP_PARSE_CHUNK_SIZE:
+                j = buf.find("\n",i,end)
+                if j < 0:
+                    self.line += str(buf[i:end])
+                    i = end
+                    continue
+                self.line += str(buf[i:j+1])
+                i = j+1
+                line = self.line
+                # un "\n" isolé ne termine pas la ligne
+                if line[-2:] != "\r\n":
+                    continue
+                self.line = ""
+                if step == HTTP_PARSE_CHUNK_SIZE:
+                    x = self.chunkSize(line)
+                elif line == "\r\n":
+                    x = self.headersEnd()
+                else:
+                    x = self.header(line)
+                if x != HTTP_WAITING:
+                    return self.finish(i-start,x)
+            elif step == HTTP_PARSE_LENGTH or step == HTTP_PARSE_CHUNK_DATA:
+                j = min(end,i+self.remaining)
+                data = buf[i:j]
+                for l in self.listeners:
+                    l.bodySegment(message,data)
+                self.remaining -= j-i
+                i = j
+                if not self.remaining:
+                    if step == HTTP_PARSE_LENGTH:
+                        return self.finish(i-start,HTTP_END)
+                    self.step = HTTP_PARSE_CHUNK_CR
+            else:
+                # "\r\n" qui suit les données d'un chunk
+                c = buf[i:i+1]
+                i += 1
+                if step == HTTP_PARSE_CHUNK_CR:
+                    if c != "\r":
+                        return self.finish(i-start,HTTP_ERROR)
+                    self.step = HTTP_PARSE_CHUNK_LF
+                else:
+                    if c != "\n":
+                        return self.finish(i-start,HTTP_ERROR)
+                    self.step = HTTP_PARSE_CHUNK_SIZE
+        return (i-start,HTTP_WAITING)
+    def finish(self,n,result):
+        """ Termine l'analyse du message avec le résultat result et retourne
+            le couple (n,result) pour feed(). """
+        self.step = HTTP_PARSE_DONE
+        self.result = result
+        if result == HTTP_END:
+            for l in self.listeners:
+                l.messageEnd(self.message)
+        return (n,result)
+    def header(self,line):
+        """ Ajoute l'entête line au message et relève le découpage du
+            corps. """
+        message = self.message
+        if line == "Transfer-Encoding: chunked\r\n":
+            message.chunked = True
+        if line[:15] == "Content-Length:":
+            # une longueur invalide est ignorée : le corps du message n'est
+            # alors pas délimité, comme sans Content-Length
+            try:
+                message.length = int(line[15:])
+            except ValueError:
+                pass
+        message.headers.append(line)
+        message.offsets.append(self.offset)
+        self.offset += len(line)
+        for l in self.listeners:
+            l.header(message,len(message.headers)-1)
+        return HTTP_WAITING
+    def headersEnd(self):
+        """ Traite la ligne vide qui termine les entêtes. """
+        message = self.message
+        message.complete = True
+        for l in self.listeners:
+            l.headersEnd(message)
+        if self.body:
+            if message.chunked:
+                self.step = HTTP_PARSE_CHUNK_SIZE
+                return HTTP_WAITING
+            if message.length != None and message.length > 0:
+                self.step = HTTP_PARSE_LENGTH
+                self.remaining = message.length
+                return HTTP_WAITING
+        return HTTP_HEADERS
+    def chunkSize(self,line):
+        """ Traite la ligne qui donne la taille du chunk suivant. """
+        try:
+            n = int(line[:-2],16)
+        except ValueError:
+            return HTTP_ERROR
+        if n < 0:
+            return HTTP_ERROR
+        if n == 0:
+            return HTTP_END
+        self.step = HTTP_PARSE_CHUNK_DATA
+        self.remaining = n
+        return HTTP_WAITING
+
+def messageState(x):
+    """ Retourne l'état d'un filtre HTTP après le résultat x de
+        HTTPMessageParser.feed() : le filtre est passant lorsque le message
+        est terminé ou n'en est pas un. """
+    if x == HTTP_WAITING:
+        return FILTER_WAITING
+    return FILTER_PASS
+
+def processMessage(f,buf,start):
+    """ Implémentation de AbstractFilter.processBlock() pour les filtres HTTP
+        (f.parser est leur HTTPMessageParser) : le bloc est analysé par le
+        parser jusqu'à la fin du message au lieu d'être écrit caractère par
+        caractère. """
+    if f.state == FILTER_FLUSHED:
+        raise FilterException("Filter must be reset")
+    if f.state == FILTER_PASS:
+        raise FilterException("Filter is in pass state and must be read")
+    if f.state == FILTER_EMPTY:
+        i = f.skip(buf,start)
+        if i > start:
+            return (i-start,FILTER_EMPTY,[buf[start:i]])
+    if f.buffsize == MAX_SIZE_BUFFER:
+        raise FilterException("Filter is full")
+    n,x = f.parser.feed(buf,start,min(len(buf),start+MAX_SIZE_BUFFER-f.buffsize))
+    f.buffsize += n
+    f.buffer += buf[start:start+n]
+    f.state = messageState(x)
+    if f.state == FILTER_WAITING:
+        return (n,FILTER_WAITING,[])
+    s = f.read()
+    if f.stats != None:
+        f.stats.messages += 1
+        f.stats.covertBits += f.efficiency
+    f.reset()
+    return (n,FILTER_EMPTY,[s])
+
+class HTTPHeaderPermutFilterIn(AbstractTerminalFilterIn,AbstractHTTPListener):
     """ Cache des caractères en permutant les headers d'une requête http. """
-    def __init__(self,reader):
+    def __init__(self,reader,fractional=False):
         AbstractTerminalFilterIn.__init__(self,reader)
-        self.patternRequest = re.compile(REGEXP_HTTP_REQRESP)
-        self.intoheader = False
+        # codage des rangs (voir readRank())
+        self.fractional = fractional
+        self.parser = HTTPMessageParser()
+        self.parser.subscribe(self)
+        # headers classés par ordre alphabétique
         self.headers = []
-        self.currentHeader = ""
         self.efficiency = 0
-        self.requestline = ""
+        self.cache = tools.LRUCache(HEADER_CACHE_SIZE)
     def write(self,c):
         AbstractTerminalFilterIn.write(self,c)
-        # on regarde si l'on se trouve dans les headers http
         self.buffer += c
-        if self.intoheader:
-            self.currentHeader += c
-            # fin des headers, on calcule le nombre de caractères pouvant être
-            # stéganographiés
-            if self.buffer[-4:] == "\r\n\r\n":
-                # on classe les headers par ordre alphabetiques, ceci servira de
-                # référence
-                self.headers.sort()
-                # suppression des doublons (cas où deux headers seraient
-                # identiques ce qui fausserait le codage)
-                pred = None
-                headers = []
-                for h in self.headers:
-                    if pred != h:
-                        headers.append(h)
-                        pred = h
-                # calcul de l'efficacité
-                n = tools.fact(len(self.headers))
-                e = 0
-                while n > 1:
-                    n >>= 1
-                    e += 1
-                self.efficiency = e
-                self.state = FILTER_PASS
-                return self.state
-            elif self.buffer[-2:] == "\r\n":
-                # si l'on trouve une ligne de header, on l'ajoute à la liste
-                self.headers.append(self.currentHeader)
-                self.currentHeader = ""
-            self.state = FILTER_WAITING
-        # si ce n'est pas le cas, on cherche à détécter la première ligne d'une
-        # requête http
-        else:
-            x = self.patternRequest.next(c)
-            self.requestline += c
-            if x == re.PASS:
-                # reconnaissance partielle de la première ligne de requête
-                self.state = FILTER_WAITING
-            elif x == re.ACCEPT:
-                # si la première ligne de requête est identifiée, le filtre
-                # commence à enregistrer les entêtes
-                self.intoheader = True
-                self.state = FILTER_WAITING
-            else:
-                # si la première ligne n'est pas identifiée, on rejete le buffer
-                self.state = FILTER_PASS
+        self.state = messageState(self.parser.feed(c)[1])
         return self.state
+    def processBlock(self,buf,start):
+        return processMessage(self,buf,start)
+    def skip(self,buf,start):
+        # seuls les caractères qui peuvent commencer une première ligne de
+        # requête ou de réponse sont retenus
+        return self.parser.skip(buf,start)
     def reset(self):
         AbstractTerminalFilterIn.reset(self)
+        self.parser.reset()
         self.headers = []
-        self.currentHeader = ""
         self.efficiency = 0
-        self.intoheader = False
-        self.patternRequest.reset()
-        self.requestline = ""
     def read(self):
+        message = self.parser.message
+        if message.complete:
+            # les headers classés par ordre alphabetique servent de référence
+            # (calcul de l'efficacité, voir analyzeHeaders()). Ils sont
+            # relevés à la lecture : dans un HTTPFilterGroup, un filtre
+            # précédent a pu les modifier.
+            self.headers,self.efficiency = analyzeHeaders(self.cache,message.headers)
         AbstractTerminalFilterIn.read(self)
         if self.efficiency:
-            n = self.reader.read(self.efficiency)
-            # permutations des headers
-            headers = tools.unrank(n,self.headers)
-            return self.requestline + string.join(headers,"") + "\r\n"
+            head = len(message.head())
+            n,self.efficiency = readRank(self.reader,len(self.headers),self.fractional)
+            # permutations des headers (le corps éventuel suit les entêtes)
+            message.headers = tools.unrank(n,self.headers)
+            return message.head() + str(self.buffer[head:])
         else:
-            return self.buffer
+            return str(self.buffer)
 
-class HTTPHeaderPermutFilterOut(AbstractTerminalFilterOut):
+class HTTPHeaderPermutFilterOut(AbstractTerminalFilterOut,AbstractHTTPListener):
     """ Décode des caractères codés dans la permutation des entêtes http. """
-    def __init__(self,writer):
+    def __init__(self,writer,fractional=False):
         AbstractTerminalFilterOut.__init__(self,writer)
-        self.patternRequest = re.compile(REGEXP_HTTP_REQRESP)
-        self.intoheader = False
-        self.headers = []
-        self.currentHeader = ""
+        # codage des rangs (voir readRank())
+        self.fractional = fractional
+        self.parser = HTTPMessageParser()
+        self.parser.subscribe(self)
         self.efficiency = 0
-        self.requestline = ""
+        # headers dans l'ordre alphabétique
+        self.sortedHeaders = []
+        self.cache = tools.LRUCache(HEADER_CACHE_SIZE)
     def write(self,c):
         AbstractTerminalFilterOut.write(self,c)
         self.buffer += c
-        if self.intoheader:
-            self.currentHeader += c
-            if self.buffer[-4:] == "\r\n\r\n":
-                n = tools.fact(len(self.headers))
-                e = 0
-                while n > 1:
-                    n >>= 1
-                    e += 1
-                self.efficiency = e
-                self.state = FILTER_PASS
-                return self.state
-            elif self.buffer[-2:] == "\r\n":
-                self.headers.append(self.currentHeader)
-                self.currentHeader = ""
-            self.state = FILTER_WAITING
-        else:
-            x = self.patternRequest.next(c)
-            self.requestline += c
-            if x == re.PASS:
-                self.state = FILTER_WAITING
-            elif x == re.ACCEPT:
-                self.intoheader = True
-                self.state = FILTER_WAITING
-            else:
-                self.state = FILTER_PASS
+        self.state = messageState(self.parser.feed(c)[1])
         return self.state
+    def processBlock(self,buf,start):
+        return processMessage(self,buf,start)
+    def skip(self,buf,start):
+        return self.parser.skip(buf,start)
     def reset(self):
         AbstractTerminalFilterOut.reset(self)
-        self.headers = []
-        self.currentHeader = ""
+        self.parser.reset()
         self.efficiency = 0
-        self.intoheader = False
-        self.patternRequest.reset()
-        self.requestline = ""
+        self.sortedHeaders = []
     def read(self):
+        message = self.parser.message
+        if message.complete:
+            # voir HTTPHeaderPermutFilterIn.read()
+            self.sortedHeaders,self.efficiency = analyzeHeaders(self.cache,message.headers)
         AbstractTerminalFilterOut.read(self)
         if self.efficiency:
-            # décodage de la permutation
-            n = tools.rank(self.headers)
-            self.writer.write(n,self.efficiency)
+            # décodage de la permutation (l'ordre alphabétique des headers
+            # est déjà connu)
+            n = tools.rank(message.headers,self.sortedHeaders)
+            self.efficiency = writeRank(self.writer,n,len(self.sortedHeaders),self.fractional)
             # REM : pas besoin de refaire les permutations inverses sur les
             # headers pour que le serveur web comprenne la requête !
-        return self.buffer
+        return str(self.buffer)
 
-class HTTPHeaderHostChanger(AbstractFilter):
+# entête Host remplacée par HTTPHeaderHostChanger
+HTTP_HOST_HEADER = stdre.compile("Host: [^\r\n]+\r\n\\Z")
+
+class HTTPHeaderHostChanger(AbstractFilter,AbstractHTTPListener):
     """ Filtre qui modifie le header 'Host' des requêtes HTTP. Il permet de
         modifier cette entête pour indiquer le véritable hôte plutôt que
         l'adresse du client du tunnel (lorsqu'un navigateur se connecte sur
@@ -158,32 +458,37 @@ class HTTPHeaderHostChanger(AbstractFilter):
         """ Construit un filtre qui remplacera l'hôte par celui spécifié dans
             le filtre. """
         AbstractFilter.__init__(self)
-        self.pattern = re.compile("Host: [^\r\n]+\r\n")
+        self.parser = HTTPMessageParser()
+        self.parser.subscribe(self)
         self.found = False
         self.host = host
+    def skip(self,buf,start):
+        return self.parser.skip(buf,start)
     def reset(self):
         AbstractFilter.reset(self)
-        self.pattern.reset()
+        self.parser.reset()
         self.found = False
     def write(self,c):
         AbstractFilter.write(self,c)
         self.buffer += c
-        x = self.pattern.next(c)
-        if x == re.FAIL:
-            self.state = FILTER_PASS
-            return self.state
-        if x == re.PASS:
-            self.state = FILTER_WAITING
-            return self.state
-        self.state = FILTER_PASS
-        self.found = True
+        self.state = messageState(self.parser.feed(c)[1])
         return self.state
+    def processBlock(self,buf,start):
+        return processMessage(self,buf,start)
     def read(self):
+        message = self.parser.message
+        head = len(message.head())
+        if message.complete:
+            for i in range(len(message.headers)):
+                if HTTP_HOST_HEADER.match(message.headers[i]):
+                    message.headers[i] = "Host: "+self.host+"\r\n"
+                    self.found = True
         AbstractFilter.read(self)
         if self.found:
-            return "Host: "+self.host+"\r\n"
+            # le corps éventuel suit les entêtes
+            return message.head() + str(self.buffer[head:])
         else:
-            return self.buffer
+            return str(self.buffer)
         
 
 REGEXP_HTML_SP = "([\n\r\t ]+)"
@@ -192,17 +497,47 @@ REGEXP_HTML_NAME = "[A-Za-z0-9:_][A-Za-z0-9._:-]*"
 REGEXP_HTML_REF = "&(#[0-9]+|"+REGEXP_HTML_NAME+");"
 REGEXP_HTML_VALUE = "(\"([^<&\"]|"+REGEXP_HTML_REF+")*\"|'([^<&\']|"+REGEXP_HTML_REF+")*')"
 REGEXP_HTML_TAG = "<"+REGEXP_HTML_NAME+"("+REGEXP_HTML_SP+REGEXP_HTML_NAME+REGEXP_HTML_EQ+REGEXP_HTML_VALUE+")*"+REGEXP_HTML_SP+"?/?>"
+# groupes de REGEXP_HTML_TAG capturés par les filtres : un attribut précédé
+# d'espaces et ces espaces
+HTML_TAG_ATTRIB = 1
+HTML_TAG_ATTRIB_SP = 2
+HTML_TAG_GROUPS = (HTML_TAG_ATTRIB,HTML_TAG_ATTRIB_SP)
 
+def HTMLTagExtract(pattern,s):
+    """ Découpe la balise s que vient d'accepter pattern (REGEXP_HTML_TAG
+        compilée avec les groupes HTML_TAG_GROUPS) à l'aide de la position
+        de ses groupes, sans la relire. Retourne le même triplet que
+        tools.XMLTagExtract() : (liste des attributs,début de la balise,fin
+        de la balise). """
+    g = pattern.groups()
+    attribs = g[HTML_TAG_ATTRIB]
+    if not attribs:
+        return ([],"",s)
+    # chaque attribut commence après ses espaces
+    l = [s[sp[1]:a[1]] for a,sp in zip(attribs,g[HTML_TAG_ATTRIB_SP])]
+    return (l,s[:attribs[0][0]],s[attribs[-1][1]:].lstrip("\n\r\t "))
+
+# taille maximale (en octets, estimée) des structures de corps HTML mémorisées
+# par chaque filtre HTMLTagsPermutFilterIn (voir filterBody())
+BODY_CACHE_SIZE = 16*1024*1024
+# surcoût estimé (en octets) d'une balise dans une structure mémorisée
+BODY_CACHE_TAG_SIZE = 100
 
 class HTMLTagsPermutFilterIn(AbstractTerminalFilterIn):
     """ Cache des caractères en permutant les attributs des balises XML/HTML."""
-    def __init__(self,reader):
+    def __init__(self,reader,fractional=False):
         AbstractTerminalFilterIn.__init__(self,reader)
-        self.pattern = re.compile(REGEXP_HTML_TAG)
+        # codage des rangs (voir readRank())
+        self.fractional = fractional
+        self.pattern = compilePattern(REGEXP_HTML_TAG,"html_tag",HTML_TAG_GROUPS)
         self.attribs = []
         self.start = ""
         self.end = ""
         self.efficiency = 0
+        # structures des corps déjà vus, indexées par leur empreinte
+        self.bodyCache = tools.LRUCache(BODY_CACHE_SIZE)
+        # balises permutables relevées par parseBody() (None en dehors)
+        self.layout = None
     def write(self,c):
         AbstractTerminalFilterIn.write(self,c)
         self.buffer += c
@@ -210,8 +545,8 @@ class HTMLTagsPermutFilterIn(AbstractTerminalFilterIn):
         if x == re.PASS:
             self.state = FILTER_WAITING
         elif x == re.ACCEPT:
-            # On parse la balise obtenue pour récupérer les attributs
-            t = tools.XMLTagExtract(self.buffer)
+            # les attributs sont découpés à la position de leurs groupes
+            t = HTMLTagExtract(self.pattern,str(self.buffer))
             self.start = t[1]
             self.end = t[2]
             l = t[0]
@@ -224,16 +559,14 @@ class HTMLTagsPermutFilterIn(AbstractTerminalFilterIn):
                     if pred != h:
                         self.attribs.append(h)
                         pred = h
-                n = tools.fact(len(self.attribs))
-                e = 0
-                while n > 1:
-                    n >>= 1
-                    e += 1
-                self.efficiency = e
+                self.efficiency = permutationBits(len(self.attribs))
             self.state = FILTER_PASS
         else:
             self.state = FILTER_PASS
         return self.state
+    def skip(self,buf,start):
+        # le texte en dehors des balises traverse le filtre
+        return self.pattern.skip(buf,start)
     def reset(self):
         AbstractTerminalFilterIn.reset(self)
         self.pattern.reset()
@@ -241,21 +574,108 @@ class HTMLTagsPermutFilterIn(AbstractTerminalFilterIn):
         self.start = ""
         self.end = ""
         self.efficiency = 0
+    def filterBody(self,data,out):
+        """ Fait traverser au filtre le corps HTML data (voir filterBlock()).
+            Le corps est d'abord découpé (parseBody()) et sa structure
+            mémorisée sous son empreinte SHA-1 : un corps déjà vu n'est pas
+            analysé de nouveau, il ne reste qu'à permuter les attributs de
+            ses balises. Les bits lus et le résultat sont les mêmes qu'avec
+            filterBlock(). Le cache n'est pas utilisé lorsque le filtre est
+            tracé ou qu'il n'est pas vide. """
+        if self.tracer != None or self.state != FILTER_EMPTY:
+            return filterBlock(self,data,out)
+        t = time.time()
+        key = hashlib.sha1(data).digest()
+        entry = self.bodyCache.get(key)
+        if entry == None:
+            layout,messages,size = self.parseBody(data)
+            if layout == None:
+                # le corps se termine au milieu d'une balise
+                return filterBlock(self,data,out)
+            entry = (layout,messages)
+            self.bodyCache.put(key,entry,size)
+        layout,messages = entry
+        n = len(out)
+        bits = 0
+        for piece in layout:
+            if isinstance(piece,tuple):
+                start,attribs,end = piece
+                x,e = readRank(self.reader,len(attribs),self.fractional)
+                bits += e
+                out += start+" "+string.join(tools.unrank(x,attribs)," ")+" "+end
+            else:
+                out += piece
+        if self.stats != None:
+            self.stats.bytesIn += len(data)
+            self.stats.bytesOut += len(out)-n
+            self.stats.messages += messages
+            self.stats.covertBits += bits
+            self.stats.time += time.time()-t
+        return FILTER_EMPTY
+    def parseBody(self,data):
+        """ Retourne le triplet (structure,nombre de balises,taille estimée en
+            octets) du corps data : la structure est une liste de chaînes
+            transmises telles quelles et de triplets (début,attributs triés,
+            fin) pour les balises à permuter. Retourne (None,0,0) si data se
+            termine au milieu d'une balise (le filtre est alors remis à
+            zéro). """
+        stats = self.stats
+        # compteurs propres au découpage (seules les balises sont retenues)
+        self.stats = FilterStats()
+        self.layout = []
+        try:
+            pieces = []
+            text = bytearray()
+            size = 0
+            i = 0
+            n = len(data)
+            while i < n:
+                k,state,outputs = self.writeBlock(data,i)
+                i += k
+                if self.layout:
+                    # balise permutable (read() n'a rien produit)
+                    if text:
+                        pieces.append(str(text))
+                        size += len(text)
+                        text = bytearray()
+                    slot = self.layout.pop()
+                    pieces.append(slot)
+                    size += len(slot[0])+len(slot[2])+sum(map(len,slot[1]))+BODY_CACHE_TAG_SIZE
+                else:
+                    for s in outputs:
+                        text += s
+            if text:
+                pieces.append(str(text))
+                size += len(text)
+            if self.state == FILTER_WAITING:
+                self.reset()
+                return (None,0,0)
+            return (pieces,self.stats.messages,size)
+        finally:
+            self.layout = None
+            self.stats = stats
     def read(self):
         AbstractTerminalFilterIn.read(self)
+        if self.efficiency and self.layout != None:
+            # découpage d'un corps (voir parseBody()) : la balise est
+            # relevée, les bits seront lus par filterBody()
+            self.layout.append((self.start,self.attribs,self.end))
+            return ""
         if self.efficiency:
-            n = self.reader.read(self.efficiency)
+            n,self.efficiency = readRank(self.reader,len(self.attribs),self.fractional)
             # permutations des attributs
             attribs = tools.unrank(n,self.attribs)
             return self.start+" "+string.join(attribs," ")+" "+self.end
         else:
-            return self.buffer
+            return str(self.buffer)
 
 class HTMLTagsPermutFilterOut(AbstractTerminalFilterOut):
     """ Cache des caractères en permutant les attributs des balises XML/HTML."""
-    def __init__(self,reader):
+    def __init__(self,reader,fractional=False):
         AbstractTerminalFilterOut.__init__(self,reader)
-        self.pattern = re.compile(REGEXP_HTML_TAG)
+        # codage des rangs (voir readRank())
+        self.fractional = fractional
+        self.pattern = compilePattern(REGEXP_HTML_TAG,"html_tag",HTML_TAG_GROUPS)
         self.attribs = []
         self.start = ""
         self.end = ""
@@ -267,23 +687,22 @@ class HTMLTagsPermutFilterOut(AbstractTerminalFilterOut):
         if x == re.PASS:
             self.state = FILTER_WAITING
         elif x == re.ACCEPT:
-            # On parse la balise obtenue pour récupérer les attributs
-            t = tools.XMLTagExtract(self.buffer)
+            # les attributs sont découpés à la position de leurs groupes
+            t = HTMLTagExtract(self.pattern,str(self.buffer))
             self.start = t[1]
             self.end = t[2]
             self.attribs = t[0]
-            if self.attribs:
-                # calcul de l'efficacité
-                n = tools.fact(len(self.attribs))
-                e = 0
-                while n > 1:
-                    n >>= 1
-                    e += 1
-                self.efficiency = e
+            # calcul de l'efficacité (le filtre d'entrée supprime les
+            # doublons d'attributs des balises qu'il permute : une balise qui
+            # en contient encore n'a pas été permutée et ne code rien)
+            if self.attribs and len(set(self.attribs)) == len(self.attribs):
+                self.efficiency = permutationBits(len(self.attribs))
             self.state = FILTER_PASS
         else:
             self.state = FILTER_PASS
         return self.state
+    def skip(self,buf,start):
+        return self.pattern.skip(buf,start)
     def reset(self):
         AbstractTerminalFilterOut.reset(self)
         self.pattern.reset()
@@ -295,10 +714,10 @@ class HTMLTagsPermutFilterOut(AbstractTerminalFilterOut):
         AbstractTerminalFilterOut.read(self)
         if self.efficiency:
             n = tools.rank(self.attribs)
-            self.writer.write(n,self.efficiency)
-        return self.buffer
+            self.efficiency = writeRank(self.writer,n,len(self.attribs),self.fractional)
+        return str(self.buffer)
 
-class HTTPDataExtractorFilter(AbstractTerminalFilter):
+class HTTPDataExtractorFilter(AbstractTerminalFilter,AbstractHTTPListener):
     """ Ce filtre extrait la partie data d'une requête ou réponse HTTP, la
         forwarde à un filtre et réencapsule le résultat.
         chunksize spécifie la longueur des chunks que le filtre crée lorsqu'il
@@ -306,187 +725,138 @@ class HTTPDataExtractorFilter(AbstractTerminalFilter):
     def __init__(self,filter,newchunksize = 65535):
         AbstractTerminalFilter.__init__(self)
         self.filter = filter
-        self.patternRequest = re.compile(REGEXP_HTTP_REQRESP)
-        self.intoheader = False
-        self.headers = []
-        self.currentHeader = ""
-        self.intodata = False
-        self.length = 0
-        self.requestline = ""
-        self.data = ""
+        # le parser découpe aussi le corps (Content-Length ou chunks)
+        self.parser = HTTPMessageParser(True)
+        self.parser.subscribe(self)
+        self.data = bytearray()
         self.finish = False
-        # gestions des chunks
-        self.bchunked = False
-        self.chunklength = 0
-        self.chunksizeline = ""
-        self.endofchunk = 0
-        self.endofrequest = False
         self.newchunksize = newchunksize
-        # pour Content-Length
-        self.blength = False
     def write(self,c):
-        # fonctionnement similaire au filtre de permutation
-        # pour la détéction du header
         AbstractTerminalFilter.write(self,c)
         self.buffer += c
-        if self.intodata:
-            #on récupère les données
-            if self.bchunked:
-                # détection de "\r\n" se trouvant après le chunk
-                if self.endofchunk == 1:
-                    if c != "\r":
-                        self.state = FILTER_PASS
-                        return self.state
-                    self.endofchunk = 2
-                elif self.endofchunk == 2:
-                    if c != "\n":
-                        self.state = FILTER_PASS
-                        return self.state
-                    self.endofchunk = 0
-                # récupération des données du chunk
-                elif self.chunklength:
-                    self.chunklength -= 1
-                    self.data += c
-                    if not self.chunklength:
-                        self.endofchunk = 1
-                # lecture de la taille d'un chunk
-                else:
-                    self.chunksizeline += c
-                    # on récupère la ligne contenant la taille du chunk
-                    if self.chunksizeline[-2:] == "\r\n":
-                        try:
-                            self.chunklength = int(self.chunksizeline[:-2],16)
-                        except Exception, ex:
-                            self.state = FILTER_PASS
-                            return self.state
-                        self.chunksizeline = ""
-                        if self.chunklength == 0:
-                            self.finish = True
-                            self.state = FILTER_PASS
-            elif self.blength:
-                if self.length > 0:
-                    self.data += c
-                    self.length -= 1
-                    if self.length == 0:
-                        self.finish = True
-                        self.state = FILTER_PASS
-                        return self.state
-                else:
-                    self.state = FILTER_PASS
-                    return self.state
-            else:
-                # codage non supporté, on rejette le buffer
-                # la longueur des données ne peut être déterminée !
-                self.state = FILTER_PASS
-        elif self.intoheader:
-            self.currentHeader += c
-            if self.buffer[-4:] == "\r\n\r\n":
-                if self.blength or self.bchunked:
-                    self.intodata = True
-                else:
-                    self.state = FILTER_PASS
-                    return self.state
-            elif self.buffer[-2:] == "\r\n":
-                #on regarde si on a une entete Transfer-Encoding
-                if self.currentHeader == "Transfer-Encoding: chunked\r\n":
-                    self.bchunked = True
-                #on regarde si on a une entête Content-Length
-                if self.currentHeader[:15] == "Content-Length:":
-                    try:
-                        self.length = int(self.currentHeader[15:])
-                    except:
-                        self.state = FILTER_PASS
-                        return self.state
-                    if self.length > 0:
-                        self.blength = True
-                self.headers.append(self.currentHeader)
-                self.currentHeader = ""
-            self.state = FILTER_WAITING
-        else:
-            x = self.patternRequest.next(c)
-            self.requestline += c
-            if x == re.PASS:
-                self.state = FILTER_WAITING
-            elif x == re.ACCEPT:
-                self.intoheader = True
-                self.state = FILTER_WAITING
-            else:
-                self.state = FILTER_PASS
+        self.state = messageState(self.parser.feed(c)[1])
         return self.state
+    def processBlock(self,buf,start):
+        return processMessage(self,buf,start)
+    def bodySegment(self,message,data):
+        self.data += data
+    def messageEnd(self,message):
+        self.finish = True
+    def skip(self,buf,start):
+        return self.parser.skip(buf,start)
+    def enableStats(self,enabled=True):
+        AbstractTerminalFilter.enableStats(self,enabled)
+        self.filter.enableStats(enabled)
+    def snapshotStats(self,name=None):
+        if name == None:
+            name = self.__class__.__name__
+        result = AbstractTerminalFilter.snapshotStats(self,name)
+        return result + self.filter.snapshotStats(name+"/"+self.filter.__class__.__name__)
+    def setTracer(self,tracer):
+        AbstractTerminalFilter.setTracer(self,tracer)
+        self.filter.setTracer(tracer)
     def reset(self):
         AbstractTerminalFilter.reset(self)
-        self.patternRequest.reset()
-        self.intoheader = False
-        self.headers = []
-        self.currentHeader = ""
-        self.intodata = False
-        self.length = 0
-        self.requestline = ""
-        self.data = ""
+        self.parser.reset()
+        self.data = bytearray()
         self.finish = False
-        self.bchunked = False
-        self.chunklength = 0
-        self.chunksizeline = ""
-        self.endofchunk = 0
-        self.endofrequest = False
-        self.blength = False
+    def filterData(self,out):
+        """ Fait traverser les données du message au filtre interne (à l'aide
+            de sa méthode filterBody() s'il en a une) et ajoute le résultat au
+            bytearray out. Retourne l'état du filtre interne. """
+        if hasattr(self.filter,"filterBody"):
+            return self.filter.filterBody(self.data,out)
+        return filterBlock(self.filter,self.data,out)
     def read(self):
         AbstractTerminalFilter.read(self)
         if self.finish:
-            if self.bchunked:
+            message = self.parser.message
+            if message.chunked:
                 # passage des données dans le filtre
-                buffer = ""
-                for c in self.data:
-                    x = self.filter.write(c)
-                    if x == FILTER_PASS:
-                        buffer += self.filter.read()
-                        self.filter.reset()
-                if x == FILTER_PASS:
-                    # découpage en chunks
-                    self.buffer = self.requestline+string.join(self.headers,"")+"\r\n"
+                buffer = bytearray()
+                x = self.filterData(buffer)
+                if x != FILTER_WAITING:
+                    # découpage en chunks (le memoryview évite de recopier
+                    # chaque chunk avant de l'ajouter)
+                    self.buffer = bytearray(message.head())
+                    data = memoryview(buffer)
                     j = 0
-                    last = False
                     l = len(buffer)
-                    i = 0
-                    # premier chunk
                     while j < l:
-                        if (l-j) < self.newchunksize:
-                            self.buffer += tools.intToHex(l-j)+"\r\n"
-                            i += l-j
-                        else:
-                            self.buffer += tools.intToHex(self.newchunksize)+"\r\n"
-                            i += self.newchunksize
-                        while j < i:
-                            self.buffer += buffer[j]
-                            j += 1
+                        n = min(l-j,self.newchunksize)
+                        self.buffer += tools.intToHex(n)+"\r\n"
+                        self.buffer += data[j:j+n]
                         self.buffer += "\r\n"
-                    if j == l:
-                        self.buffer += "0\r\n"
+                        j += n
+                    self.buffer += "0\r\n"
                 else:
                     raise FilterException("HTTPDataExtractorFilter is blocked indefinitely because its internal filter has blocked")
-            elif self.blength:
-                self.buffer = ""
-                for c in self.data:
-                    # envoi des données dans le filtre
-                    x = self.filter.write(c)
-                    if x == FILTER_PASS:
-                        self.buffer += self.filter.read()
-                        self.filter.reset()
-                if self.length == 0:
-                    # dernier octet, on regarde si le filtre interne est
-                    # passant sinon on envoie une exception
-                    if x == FILTER_PASS:
-                        # si oui, on reconstruit la requête
-                        # modification de la longueur des données
-                        for i in range(len(self.headers)):
-                            if self.headers[i][:15] == "Content-Length:":
-                                self.headers[i] = "Content-Length: "+str(len(self.buffer))+"\r\n"
-                        self.buffer = self.requestline+string.join(self.headers,"")+"\r\n"+self.buffer
-                    else:
-                        raise FilterException("HTTPDataExtractorFilter is blocked indefinitely because its internal filter has blocked")
             else:
-                raise FilterException("HTTPDataExtractorFilter cannot determinate encoding method to encode stream un read() method.")
-        return self.buffer
+                # envoi des données dans le filtre
+                self.buffer = bytearray()
+                x = self.filterData(self.buffer)
+                if x != FILTER_WAITING:
+                    # si le filtre interne est passant, on reconstruit la
+                    # requête avec la nouvelle longueur des données
+                    for i in range(len(message.headers)):
+                        if message.headers[i][:15] == "Content-Length:":
+                            message.headers[i] = "Content-Length: "+str(len(self.buffer))+"\r\n"
+                    self.buffer = message.head()+self.buffer
+                else:
+                    raise FilterException("HTTPDataExtractorFilter is blocked indefinitely because its internal filter has blocked")
+        return str(self.buffer)
+
+class HTTPFilterGroup(AbstractFilterGroup):
+    """ Groupe série de filtres HTTP (filtres dont le découpage est fait par
+        un HTTPMessageParser : HTTPHeaderPermutFilterIn/Out,
+        HTTPHeaderHostChanger, HTTPDataExtractorFilter) qui partagent un
+        seul parser. Dans un SerialFilterGroup, chaque filtre analyse de
+        nouveau le message produit par le précédent (et parcourt son corps à
+        la recherche d'un début de message) : ici chaque message est analysé
+        une seule fois. Les filtres sont ensuite lus dans l'ordre de la
+        liste, chacun reçoit le message produit par le précédent et le
+        modèle du message (self.parser.message) tel que celui-ci l'a
+        modifié. Le résultat est celui du SerialFilterGroup des mêmes
+        filtres. Les compteurs des filtres internes ne relèvent que les
+        messages et les bits cachés. """
+    def __init__(self,filters=[]):
+        AbstractFilterGroup.__init__(self,filters)
+        body = False
+        for f in filters:
+            body = body or f.parser.body
+        self.parser = HTTPMessageParser(body)
+        for f in filters:
+            f.parser = self.parser
+            self.parser.subscribe(f)
+    def write(self,c):
+        AbstractFilterGroup.write(self,c)
+        self.buffer += c
+        self.state = messageState(self.parser.feed(c)[1])
+        return self.state
+    def processBlock(self,buf,start):
+        return processMessage(self,buf,start)
+    def skip(self,buf,start):
+        return self.parser.skip(buf,start)
+    def reset(self):
+        AbstractFilterGroup.reset(self)
+        self.parser.reset()
+        self.efficiency = 0
+    def read(self):
+        AbstractFilterGroup.read(self)
+        s = self.buffer
+        efficiency = 0
+        for f in self.filters:
+            # le filtre reçoit le message d'un bloc, déjà analysé
+            f.buffer = bytearray(s)
+            f.buffsize = len(s)
+            f.state = FILTER_PASS
+            s = f.read()
+            if f.stats != None:
+                f.stats.messages += 1
+                f.stats.covertBits += f.efficiency
+            efficiency += f.efficiency
+        self.efficiency = efficiency
+        return str(s)
 
 ###s = "GET / HTTP/1.1\r\nHost: truc\r\nContent-Length: 82\r\n\r\n<html reg='lol' test='machin' r='14' v='14' v='154' v='614' v='145' yu='4' uy='4'>"
 ##s = "GET / HTTP/1.1\r\nHost: truc\r\nContent-Length: 82\r\nTransfer-Encoding: chunked\r\n\r\n32\r\n<html reg='lol' test='machin' r='14' v='14' v='154\r\n20\r\n' v='614' v='145' yu='4' uy='4'>\r\n0\r\nertert"
@@ -514,3 +884,5 @@ class HTTPDataExtractorFilter(AbstractTerminalFilter):
 ##print x
 ##print repr(s)
 
+if __name__=='__main__':
+    saveAutomata()
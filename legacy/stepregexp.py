@@ -34,11 +34,19 @@ bien servie ici :)
 
 L'algorithme d'auto-déterminisation de l'automate s'inspire du code donné par
 Russ Cox dans son article 'Regular Expression Matching Can Be Simple And Fast'.
-Ceci permet une exécution très rapide (beaucoup plus que le module de python
-non-déterministe).
+Le temps de reconnaissance reste ainsi linéaire, même pour les expressions
+qui font exploser le module de python non-déterministe (voir benchmark.py).
 """
 
-__all__ = ["Pattern","compile","RegexpException"]
+import os
+import sys
+import mmap
+import marshal
+import threading
+import tempfile
+from array import array
+
+__all__ = ["Pattern","EagerPattern","CapturePattern","compile","compileSet","compileShared","compileSearch","compileCaptures","Searcher","Prefilter","save","load","RegexpException"]
 
 # Les automates à état finis sont stockés sous forme de graphe avec des
 # listes de pointeurs
@@ -63,6 +71,13 @@ __all__ = ["Pattern","compile","RegexpException"]
 # - le bit 10 indique que l'état est final (masque 0x00000200)
 # - le bit 11 est réservé pour signaler une transition Epsilon dans les
 #   automates non-déterministes (masque 0x00000400)
+# - le bit 12 signale une transition valable pour un ensemble de caractères
+#   (masque 0x00000800). L'ensemble est stocké dans l'état sous forme d'un
+#   entier de 256 bits (le bit i correspond à l'octet i).
+#
+# Les octets qui se comportent de la même façon dans toutes les transitions
+# d'un automate forment une classe d'octets. Les automates déterministes ont
+# une transition par classe et non une transition par octet.
 #
 
 # Flags utilisés pour décoder un token
@@ -71,81 +86,494 @@ BYTE_MASK = 0x000000FF # 255
 FLAG_ANY = 0x00000100 # 256
 FLAG_FINAL = 0x00000200 # 512
 FLAG_EPSILON = 0x00000400 # 1024
+FLAG_CLASS = 0x00000800 # 2048
 
 # Classes pour la représentation des automates non-déterministes
 
 class NDState:
     """ Représente un état d'un automate à états finis non déterministe. """
-    def __init__(self,next1,next2,t):
+    def __init__(self,next1,next2,t,cls=0):
         self.next1 = next1
         self.next2 = next2
         self.t = t
-        # marque qui sera utilisée pour déterminiser l'automate
-        self.markid = id(None)
+        # ensemble des octets reconnus pour une transition FLAG_CLASS
+        self.cls = cls
+        # numéro de l'état, attribué une fois l'automate construit (voir
+        # numberStates())
+        self.id = 0
+        # numéro de l'expression à laquelle appartient l'état dans un
+        # ensemble d'expressions (voir compileSet()) : 0 par défaut (une
+        # expression seule), None seulement pour les états epsilon qui
+        # relient les expressions d'un ensemble (voir parseSet()) et
+        # n'appartiennent à aucune
+        self.pid = 0
+        # marque de groupe d'un état epsilon (voir Group) : 2*i à l'entrée
+        # du groupe i et 2*i+1 à sa sortie, None si l'état n'en porte pas
+        self.tag = None
 
 # Classes pour la représentation des automates déterministes
 
 class DState:
     """ Représente un état d'un automate à états finis déterministe. """
-    def __init__(self,ndstates,final=False):
-        self.trans = [None]*256
+    def __init__(self,ndstates,final=False,nclasses=256,key=None):
+        # une transition par classe d'octets
+        self.trans = [None]*nclasses
         self.final = final
-        # états de l'automate non déterministe associé
+        # True si la reconnaissance par bloc (Pattern.feed()) s'arrête dans
+        # cet état : état final ou état puits
+        self.stop = final
+        # états de l'automate non déterministe associé et ensemble de leurs
+        # numéros
         self.ndstates = ndstates
-        # pointeurs gauche et droit pour classer ces états dans un arbre
-        # ceci sera utilisé dans la déterminisation de l'automate
-        self.g = None
-        self.d = None
+        self.key = key
+        # numéros des expressions qui reconnaissent une chaîne dans cet état
+        # (matches) et de celles qui n'ont pas encore échoué (alive)
+        self.matches = tuple(sorted(set([s.pid for s in ndstates if s.t & FLAG_FINAL])))
+        self.alive = frozenset([s.pid for s in ndstates if s.pid != None])
+        # True si aucune transition ne sort de cet état (toutes mènent à
+        # l'état puits)
+        self.terminal = True
+        for s in ndstates:
+            if not (s.t & (FLAG_EPSILON | FLAG_FINAL)):
+                self.terminal = False
+                break
 
 PASS = 0
 FAIL = 1
 ACCEPT = 2
 
+# Si moins de MIN_BYTES_PER_STATE caractères par état ont été reconnus entre
+# deux vidages du cache d'un automate, celui-ci passe en simulation de
+# l'automate non-déterministe (voir Automaton)
+MIN_BYTES_PER_STATE = 10
+
+def numberStates(beginState):
+    """ Numérote les états d'un automate non-déterministe à partir de son état
+        initial et retourne la liste de ses états (l'indice d'un état dans la
+        liste correspond à son numéro). """
+    l = [beginState]
+    seen = set([id(beginState)])
+    for s in l:
+        for n in (s.next1,s.next2):
+            if n != None and not id(n) in seen:
+                seen.add(id(n))
+                l.append(n)
+    for i in xrange(len(l)):
+        l[i].id = i
+    return l
+
+def byteClasses(nfa):
+    """ Calcule les classes d'octets d'un automate non-déterministe (liste de
+        ses états). Deux octets sont dans la même classe s'ils sont reconnus
+        par exactement les mêmes transitions. Cette fonction retourne la liste
+        donnant le numéro de classe de chacun des 256 octets. """
+    sets = set()
+    for s in nfa:
+        if not (s.t & (FLAG_EPSILON | FLAG_FINAL | FLAG_ANY)):
+            if s.t & FLAG_CLASS:
+                sets.add(s.cls)
+            else:
+                sets.add(1 << (s.t & BYTE_MASK))
+    classes = [0]*256
+    # chaque ensemble coupe en deux les classes existantes
+    for x in sets:
+        number = {}
+        for c in range(256):
+            classes[c] = number.setdefault((classes[c],(x >> c) & 1),len(number))
+    return classes
+
 def eclosure(ndstates):
     """ Epsilon-closure d'un ensemble d'états.
-        Cette fonction renvoie un couple (l,b) où l est
-        l'epsilon-closure de la liste d'états states et b indique si cet
+        Cette fonction renvoie un triplet (l,b,k) où l est
+        l'epsilon-closure de la liste d'états states, b indique si cet
         ensemble possède au moins un état final (True) ou si il n'y a
-        aucun état final (False). """
+        aucun état final (False) et k est l'ensemble (frozenset) des numéros
+        des états de la closure. """
+    # numéros des états déjà présents dans la closure
+    seen = set()
     # liste des états de la closure
-    l = ndstates
-    b = False
+    l = []
     for s in ndstates:
+        if not s.id in seen:
+            seen.add(s.id)
+            l.append(s)
+    b = False
+    for s in l:
         # si l'état courant est final, on indique que toute la closure sera
         # équivalente à un état final
         if s.t & FLAG_FINAL:
             b = True
         # sinon on visite les "fils" de l'état courant (si celui-ci est un état
-        # epsilon)
+        # epsilon) qui ne sont pas encore dans la closure
         elif s.t & FLAG_EPSILON:
-            # pour chaque fils, on regarde s'il est marqué. La marque est un
-            # pointeur sur la liste des états de l'epsilon-closure. Ceci permet
-            # de savoir si l'état se trouve déjà dans la liste !
-            if (s.next1.markid != id(l)):
-                s.next1.markid = id(l)
+            if not s.next1.id in seen:
+                seen.add(s.next1.id)
                 l.append(s.next1)
-            if (s.next2 != None) and (s.next2.markid != id(l)):
-                s.next2.markid = id(l)
+            if (s.next2 != None) and not s.next2.id in seen:
+                seen.add(s.next2.id)
                 l.append(s.next2)
-    return (l,b)
+    return (l,b,frozenset(seen))
 
-class Pattern:
-    """ Représente une expression régulière compilée """
-    def __init__(self,beginState):
-        """ Constructeur privé ! beginState correspond à l'état initial de
-            l'automate non-déterministe associé. """
+def taggedClosure(state,captured,seen):
+    """ Retourne la liste des couples (état,marques) des états non epsilon
+        accessibles depuis state par des transitions epsilon, par ordre de
+        priorité (la transition next1 d'un état epsilon est prioritaire sur
+        next2, comme dans une machine de Pike). marques est le tuple des
+        marques des groupes de l'ensemble captured rencontrées sur le chemin
+        le plus prioritaire. Les états dont le numéro est dans seen sont
+        ignorés, ceux qui sont atteints y sont ajoutés. """
+    l = []
+    stack = [(state,())]
+    while stack:
+        state,tags = stack.pop()
+        if state.id in seen:
+            continue
+        seen.add(state.id)
+        if state.t & FLAG_EPSILON:
+            if state.tag != None and (state.tag >> 1) in captured:
+                tags = tags+(state.tag,)
+            if state.next2 != None:
+                stack.append((state.next2,tags))
+            stack.append((state.next1,tags))
+        else:
+            l.append((state,tags))
+    return l
+
+def taggedStep(threads,c,captured):
+    """ Fait avancer sur l'octet c la liste threads de fils classés par
+        priorité. Un fil est un triplet (état non epsilon,registre,marques en
+        attente) : les marques en attente ont été rencontrées dans
+        l'epsilon-closure qui a mené à l'état, elles ne sont ajoutées au
+        registre que si le fil avance (une transition qui ne fait que
+        prolonger une répétition ne coûte donc rien). Si c vaut None, les
+        fils n'avancent pas et seule leur epsilon-closure est calculée.
+        Retourne le couple (fils atteints,opérations) : les registres des
+        fils atteints sont numérotés dans l'ordre de leur première
+        apparition et le i-ème est le couple (ancien registre,marques
+        ajoutées) des opérations. Un état atteint par plusieurs fils ne
+        garde que le plus prioritaire. """
+    seen = set()
+    registers = {}
+    ops = []
+    result = []
+    for s,r,pending in threads:
+        if c != None:
+            if s.t & (FLAG_EPSILON | FLAG_FINAL):
+                continue
+            if not ((s.t & FLAG_ANY) or ((s.t & FLAG_CLASS) and (s.cls >> c) & 1) or (not (s.t & FLAG_CLASS) and (s.t & BYTE_MASK) == c)):
+                continue
+            s = s.next1
+        l = taggedClosure(s,captured,seen)
+        if not l:
+            continue
+        k = registers.get((r,pending))
+        if k == None:
+            k = registers[(r,pending)] = len(ops)
+            ops.append((r,pending))
+        for t,tags in l:
+            result.append((t,k,tags))
+    return (result,tuple(ops))
+
+def applyTags(registers,ops,pos):
+    """ Retourne les nouveaux registres obtenus en appliquant les opérations
+        ops (voir taggedStep()) aux registres, les marques ajoutées portant la
+        position pos. Un registre est l'historique des marques d'un fil : une
+        liste chaînée de triplets (marque,position,suite), de la plus récente
+        à la plus ancienne. """
+    l = []
+    for r,tags in ops:
+        h = registers[r]
+        for tag in tags:
+            h = (tag,pos,h)
+        l.append(h)
+    return l
+
+# Nombre maximum de littéraux d'un préfiltre
+MAX_LITERALS = 16
+
+def literals(e):
+    """ Calcule les littéraux de l'arbre syntaxique e utilisables par un
+        préfiltre (voir Regexp.prefixes()) : retourne l'ensemble des
+        chaînes par lesquelles toute chaîne reconnue commence, débarrassé
+        des chaînes dont un préfixe est déjà présent, ou None s'il n'en
+        existe pas d'utile (ensemble inconnu ou contenant la chaîne vide). """
+    p = e.prefixes()
+    if p == None or "" in p[0]:
+        return None
+    l = []
+    for x in sorted(p[0],key=lambda x: (len(x),x)):
+        for y in l:
+            if x.startswith(y):
+                break
+        else:
+            l.append(x)
+    return l
+
+class Prefilter:
+    """ Recherche rapide (str.find) des positions où une reconnaissance peut
+        commencer : toute chaîne reconnue commence par l'un des littéraux du
+        préfiltre. """
+    def __init__(self,literals):
+        self.literals = literals
+        self.maxlen = max([len(x) for x in literals])
+    def candidates(self,buffer,start=0):
+        """ Générateur des positions croissantes (à partir de start) du bloc
+            buffer (str ou bytearray) où commence l'un des littéraux. Les
+            positions de fin de bloc où commence le début d'un littéral sont
+            aussi retournées : le littéral peut se poursuivre dans le bloc
+            suivant. """
+        n = len(buffer)
+        # prochaine occurrence de chaque littéral (n si aucune)
+        nexts = []
+        for x in self.literals:
+            i = buffer.find(x,start)
+            if i < 0:
+                i = n
+            nexts.append(i)
+        tail = max(start,n-self.maxlen+1)
+        i = min(nexts)
+        while i < tail:
+            yield i
+            for j in range(len(nexts)):
+                if nexts[j] == i:
+                    k = buffer.find(self.literals[j],i+1)
+                    if k < 0:
+                        k = n
+                    nexts[j] = k
+            i = min(nexts)
+        for i in xrange(tail,n):
+            rest = str(buffer[i:])
+            for x in self.literals:
+                if x.startswith(rest) or rest.startswith(x):
+                    yield i
+                    break
+
+def skipFailures(starts,buffer,start):
+    """ Retourne la première position (à partir de start) du bloc buffer
+        où se trouve l'un des octets de la chaîne starts, len(buffer) s'il
+        n'y en a pas. Si les octets sont trop nombreux (plus de MAX_LITERALS)
+        pour qu'une recherche soit avantageuse, start est retourné. """
+    if len(starts) > MAX_LITERALS:
+        return start
+    if starts:
+        for i in Prefilter(list(starts)).candidates(buffer,start):
+            return i
+    return len(buffer)
+
+class Automaton:
+    """ Automate déterministe construit au fur et à mesure de la
+        reconnaissance à partir d'un automate non-déterministe. Un automate
+        peut être partagé par plusieurs expressions compilées (Pattern) et
+        par plusieurs threads : les états calculés par l'une profitent à
+        toutes les autres.
+
+        Le nombre d'états conservés peut être borné (maxStates). Lorsque la
+        borne est atteinte, tous les états sont oubliés (sauf l'état initial
+        et l'état puits) et le cache est reconstruit au fil de la
+        reconnaissance. Si les vidages sont trop fréquents (moins de
+        MIN_BYTES_PER_STATE caractères par état entre deux vidages
+        successifs),
+        l'automate n'est plus mis en cache : chaque transition est calculée
+        par simulation de l'automate non-déterministe, en temps linéaire.
+        Les compteurs flushes, simulated et bytes permettent de choisir la
+        borne. """
+    def __init__(self,beginState,maxStates=None):
+        """ beginState correspond à l'état initial de l'automate
+            non-déterministe associé et maxStates au nombre maximum d'états
+            déterministes conservés (None : pas de limite). """
         self.ndstates = beginState
+        # expression (ou tuple d'expressions) dont l'automate est issu,
+        # renseignée par les fonctions de compilation (voir save())
+        self.source = None
+        # préfiltre (Prefilter) renseigné par les fonctions de compilation,
+        # None si aucun littéral n'a pu être extrait
+        self.prefilter = None
+        # numérotation des états non-déterministes
+        self.nfa = numberStates(beginState)
+        # classes d'octets : numéro de classe de chaque octet (classes), de
+        # chaque caractère (charClasses) et un octet représentant chaque
+        # classe (representatives)
+        self.classes = byteClasses(self.nfa)
+        self.charClasses = dict((chr(c),self.classes[c]) for c in range(256))
+        self.nclasses = max(self.classes)+1
+        self.representatives = [0]*self.nclasses
+        for c in range(255,-1,-1):
+            self.representatives[self.classes[c]] = c
         # initialisation du premier état déterministe
-        initialClosure,final = eclosure([beginState])
-        initialClosure.sort()
-        self.beginState = DState(initialClosure,final)
-        self.currentState = self.beginState
-        # sommet de l'arbre binaire pour classer les états déterministes
-        self.allDStates = self.beginState
+        initialClosure,final,key = eclosure([beginState])
+        self.beginState = DState(initialClosure,final,self.nclasses,key)
+        # états déterministes indexés par l'ensemble des numéros des états
+        # non-déterministes qui les composent
+        self.dstates = {key:self.beginState}
+        # état puits : les transitions qui échouent pointent vers cet état ce
+        # qui évite de les recalculer à chaque passage
+        self.deadState = DState([],False,self.nclasses,frozenset())
+        self.deadState.stop = True
+        # états déterministes indexés par l'ensemble des numéros des états
+        # non-déterministes dont ils sont l'epsilon-closure
+        self.kernels = {}
+        # la construction de nouveaux états est protégée par un mutex. La
+        # lecture d'une transition déjà calculée ne l'est pas : un état n'est
+        # chaîné qu'une fois entièrement construit.
+        self.lock = threading.Lock()
+        # taille du cache
+        self.maxStates = maxStates
+        # transitions des états oubliés et des états non conservés : elles
+        # sont toujours vides et ne sont jamais modifiées
+        self.staleTrans = [None]*self.nclasses
+        # True si les transitions sont calculées par simulation
+        self.fallback = False
+        # compteurs : nombre de vidages du cache, de transitions calculées
+        # par simulation et de caractères reconnus (mis à jour par les
+        # expressions compilées, seulement si maxStates est donné)
+        self.flushes = 0
+        self.simulated = 0
+        self.bytes = 0
+        # nombre de caractères reconnus lors du dernier vidage
+        self.flushBytes = 0
+        # octets qui ne font pas échouer l'état initial (voir firstBytes())
+        self.starts = None
+    def step(self,state,k):
+        """ Retourne la liste des états non-déterministes atteints depuis
+            l'état déterministe state avec les octets de la classe k. """
+        # tous les octets de la classe sont équivalents, on en teste un
+        c = self.representatives[k]
+        # on utilise l'epsilon closure de l'état déterministe courant pour
+        # calculer un nouvel ensemble d'états
+        l = []
+        for s in state.ndstates:
+            # si la transition est bonne (les états epsilon et finaux
+            # n'ont pas de transition sur un caractère)
+            if not (s.t & (FLAG_EPSILON | FLAG_FINAL)):
+                if (s.t & FLAG_ANY) or ((s.t & FLAG_CLASS) and (s.cls >> c) & 1) or (not (s.t & FLAG_CLASS) and (s.t & BYTE_MASK) == c):
+                    l.append(s.next1)
+        return l
+    def computeNext(self,state,k):
+        """ Calcule l'état déterministe atteint depuis state avec les octets
+            de la classe k à l'aide de l'automate non-déterministe associé. La
+            transition est mémorisée dans state (sauf si state a été oublié
+            lors d'un vidage du cache). Si aucune transition n'est possible,
+            l'état puits est retourné. """
+        if self.fallback:
+            # simulation : aucune structure partagée n'est modifiée
+            return self.findDState(self.step(state,k))
+        self.lock.acquire()
+        try:
+            # la transition a pu être calculée par une autre thread
+            node = state.trans[k]
+            if node != None:
+                return node
+            node = self.findDState(self.step(state,k))
+            # on chaîne l'état trouvé ou crée avec l'état déterministe courant
+            if state.trans is not self.staleTrans:
+                state.trans[k] = node
+            return node
+        finally:
+            self.lock.release()
+    def flush(self):
+        """ Vide le cache des états déterministes. Les états oubliés restent
+            utilisables par les expressions compilées qui s'y trouvent mais
+            leurs transitions sont recalculées vers les nouveaux états. Si le
+            cache a été vidé trop tôt, l'automate passe en simulation. Cette
+            méthode doit être appelée avec le verrou. """
+        for node in self.dstates.itervalues():
+            node.trans = self.staleTrans
+        self.beginState.trans = [None]*self.nclasses
+        self.dstates = {self.beginState.key:self.beginState}
+        self.kernels = {}
+        self.flushes += 1
+        # le premier remplissage du cache n'est pas significatif
+        if self.flushes > 1 and self.bytes - self.flushBytes < MIN_BYTES_PER_STATE*self.maxStates:
+            self.fallback = True
+        self.flushBytes = self.bytes
+    def computeAll(self,state):
+        """ Calcule toutes les transitions de l'état déterministe state et
+            retourne la liste des états atteints pour chaque classe d'octets.
+            Les états non-déterministes ne sont parcourus qu'une fois (et non
+            une fois par classe comme avec computeNext). """
+        self.lock.acquire()
+        try:
+            l = [[] for k in range(self.nclasses)]
+            for s in state.ndstates:
+                if not (s.t & (FLAG_EPSILON | FLAG_FINAL)):
+                    if s.t & FLAG_ANY:
+                        x = (1 << 256) - 1
+                    elif s.t & FLAG_CLASS:
+                        x = s.cls
+                    else:
+                        x = 1 << (s.t & BYTE_MASK)
+                    for k in range(self.nclasses):
+                        if (x >> self.representatives[k]) & 1:
+                            l[k].append(s.next1)
+            for k in range(self.nclasses):
+                if state.trans[k] == None:
+                    state.trans[k] = self.findDState(l[k])
+            return state.trans
+        finally:
+            self.lock.release()
+    def firstBytes(self):
+        """ Retourne la chaîne des octets avec lesquels une chaîne reconnue
+            peut commencer (ceux qui ne mènent pas à l'état puits depuis
+            l'état initial). """
+        if self.starts == None:
+            trans = self.computeAll(self.beginState)
+            self.starts = "".join([chr(c) for c in range(256) if not trans[self.classes[c]] is self.deadState])
+        return self.starts
+    def findDState(self,l):
+        """ Retourne l'état déterministe correspondant à l'epsilon-closure de
+            la liste d'états non-déterministes l. L'état est créé s'il
+            n'existe pas encore. Si l est vide, l'état puits est retourné. """
+        # si la liste est vide, aucune transition n'a pu être trouvée le
+        # caractère n'est donc pas reconnu
+        if not l:
+            return self.deadState
+        if self.fallback:
+            # état de passage, jamais conservé ni chaîné
+            self.simulated += 1
+            l,b,key = eclosure(l)
+            node = DState(l,b,0,key)
+            node.trans = self.staleTrans
+            return node
+        # le même ensemble d'états de départ donne toujours le même état
+        # déterministe : on évite ainsi de recalculer l'epsilon-closure
+        kernel = frozenset([x.id for x in l])
+        node = self.kernels.get(kernel)
+        if node != None:
+            return node
+        # on étend cet ensemble à son epsilon closure et on recherche l'état
+        # déterministe correspondant
+        l,b,key = eclosure(l)
+        node = self.dstates.get(key)
+        if node == None:
+            if self.maxStates != None and len(self.dstates) >= self.maxStates:
+                self.flush()
+                if self.fallback:
+                    return self.findDState(l)
+            node = DState(l,b,self.nclasses,key)
+            self.dstates[key] = node
+        self.kernels[kernel] = node
+        return node
+
+class Pattern:
+    """ Représente une expression régulière compilée. Une instance ne contient
+        que l'état courant de la reconnaissance, l'automate peut être partagé
+        entre plusieurs instances (voir compileShared()). """
+    def __init__(self,automaton):
+        """ Constructeur privé ! automaton correspond à l'automate
+            déterministe (Automaton) associé. """
+        self.automaton = automaton
+        self.deadState = automaton.deadState
+        self.charClasses = automaton.charClasses
+        self.currentState = automaton.beginState
         self.loose = False
+        # les caractères ne sont comptés (voir Automaton.flush()) que si le
+        # cache est borné : next() ne coûte rien de plus sinon
+        self.bounded = automaton.maxStates != None
+        if self.bounded:
+            self.next = self.countedNext
     def reset(self):
         """ Remet l'expression régulière dans son été initial. """
-        self.currentState = self.beginState
+        self.currentState = self.automaton.beginState
         self.loose = False
     def next(self,c):
         """ Injecte un caractère dans l'expression régulière compilée.
@@ -157,69 +585,846 @@ class Pattern:
             l'expression compilée à l'aide de la méthode reset(). """
         if self.loose:
             return FAIL
-        c = ord(c)
-        # si un état déterministe existe pour le token, il suffit de le prendre
-        if self.currentState.trans[c] != None:
-            self.currentState = self.currentState.trans[c]
-            if self.currentState.final:
-                return ACCEPT
-            return PASS
-        # sinon, nous devons calculer l'état suivant en utilisant l'automate
-        # non-déterministe associé
-        # on utilise l'epsilon closure de l'état déterministe courant pour
-        # calculer un nouvel ensemble d'états
-        l = []
-        for s in self.currentState.ndstates:
-            # si la transition est bonne
-            if (s.t & ~FLAG_EPSILON) and ((s.t & FLAG_ANY) or (s.t & BYTE_MASK) == c):
-                l.append(s.next1)
-        # si la liste est vide, aucune transition n'a pu être trouvée le
-        # caractère n'est donc pas reconnu
-        if not l:
+        k = self.charClasses[c]
+        # si un état déterministe existe pour la classe du caractère, il
+        # suffit de le prendre sinon, nous devons le calculer
+        node = self.currentState.trans[k]
+        if node == None:
+            node = self.automaton.computeNext(self.currentState,k)
+        if node is self.deadState:
             self.loose = True
             return FAIL
-        # on étend cet ensemble à son epsilon closure
-        l,b = eclosure(l)
-        # l'ensemble doit être ordonné pour pouvoir être comparé
-        l.sort()
-        # on recherche l'existance de cet ensemble et de son état déterministe
-        # correspondant dans l'arbre
-        node = self.allDStates
-        # on doit récupérer le dernier noeud visité car on n'a pas de pointeur
-        # de pointeur en python...
-        lastnode = None
-        while node != None:
-            lastnode = node
-            comp = cmp(l,node.ndstates)
-            if comp < 0:
-                node = node.g
-            elif comp > 0:
-                node = node.d
-            else:
-                next = node
-                # très important, il faut remplacer l'ancienne liste par la
-                # nouvelle même si elles sont identiques. Ceci permet de
-                # conserver la dernière adresse mémoire et donc l'identifiant
-                # utilisé pour calculer l'epsilon-closure !!!
-                node.ndstates = l
-                break
-        else:
-            # si on n'a pas trouvé l'état, on en crée un nouvel
-            # on l'ajoute dans l'arbre binaire
-            node = DState(l,b)
-            if comp < 0:
-                lastnode.g = node
-            else:
-                lastnode.d = node
-        # on chaîne l'état trouvé ou crée avec l'état déterministe courant
-        self.currentState.trans[c] = node
         self.currentState = node
         if node.final:
             return ACCEPT
         return PASS
+    def countedNext(self,c):
+        """ next() d'une expression dont le cache est borné : le caractère
+            est compté dans automaton.bytes. """
+        if not self.loose:
+            self.automaton.bytes += 1
+        return Pattern.next(self,c)
+    def feed(self,buffer,start=0):
+        """ Injecte un bloc de caractères (str, bytearray ou memoryview) dans
+            l'expression régulière compilée à partir de la position start.
+            Cette méthode est équivalente à des appels successifs à next() mais
+            s'arrête au premier caractère qui donne le code ACCEPT ou FAIL.
+            Elle retourne un couple (x,i) où x est le code obtenu et i la
+            position qui suit le dernier caractère consommé. Si tout le bloc a
+            été consommé sans atteindre d'état final ni d'échec, le code PASS
+            est retourné avec i == len(buffer). Les états déterministes sont
+            partagés avec next(), les deux méthodes peuvent donc être
+            utilisées alternativement. """
+        if self.loose:
+            return (FAIL,start)
+        # les éléments d'un bytearray sont des entiers, ceux d'une chaîne ou
+        # d'un memoryview des caractères
+        if isinstance(buffer,bytearray):
+            classes = self.automaton.classes
+        else:
+            classes = self.charClasses
+        dead = self.deadState
+        state = self.currentState
+        for i in xrange(start,len(buffer)):
+            node = state.trans[classes[buffer[i]]]
+            if node is None:
+                node = self.automaton.computeNext(state,classes[buffer[i]])
+            # un seul test pour les deux cas d'arrêt
+            if node.stop:
+                if self.bounded:
+                    self.automaton.bytes += i+1-start
+                if node is dead:
+                    self.currentState = state
+                    self.loose = True
+                    return (FAIL,i+1)
+                self.currentState = node
+                return (ACCEPT,i+1)
+            state = node
+        self.currentState = state
+        if self.bounded:
+            self.automaton.bytes += len(buffer)-start
+        return (PASS,len(buffer))
+    def skip(self,buffer,start=0):
+        """ Retourne la position du premier caractère du bloc buffer (str ou
+            bytearray), à partir de start, avec lequel une chaîne reconnue
+            peut commencer (len(buffer) s'il n'y en a pas). Les caractères
+            qui précèdent feraient échouer l'expression dans son état
+            initial : cette méthode n'a de sens que juste après reset(). """
+        return skipFailures(self.automaton.firstBytes(),buffer,start)
     def isAccepted(self):
         """ Retourne True si l'état courant est un état final, False sinon. """
         return self.currentState.final and not self.loose
+    def matches(self):
+        """ Retourne le tuple (trié) des numéros des expressions qui
+            reconnaissent la chaîne injectée jusqu'ici. Une expression compilée
+            avec compile() porte le numéro 0, celles d'un ensemble compilé avec
+            compileSet() sont numérotées dans l'ordre de la liste. """
+        if self.loose:
+            return ()
+        return self.currentState.matches
+    def status(self,i):
+        """ Retourne le code (PASS, FAIL ou ACCEPT) qu'aurait retourné la
+            i-ème expression de l'ensemble si elle avait été compilée seule et
+            avait reçu les mêmes caractères. """
+        if self.loose:
+            return FAIL
+        if i in self.currentState.matches:
+            return ACCEPT
+        if i in self.currentState.alive:
+            return PASS
+        return FAIL
+
+class Searcher:
+    """ Recherche non ancrée d'une expression régulière dans un flux continu
+        (comme si l'expression était précédée de '.*'). Toutes les
+        reconnaissances sont signalées, sans chevauchement, par un couple
+        (début,fin) de positions dans le flux (la fin est exclue) : la plus à
+        gauche d'abord et, pour un même début, la plus longue. Les chaînes
+        vides ne sont jamais signalées. Le flux n'a jamais besoin d'être
+        réinitialisé ni réinjecté.
+
+        Une recherche est menée par un fil par position de départ possible,
+        chaque fil avançant dans l'automate déterministe (partagé comme pour
+        Pattern). Deux fils qui se trouvent dans le même état ont le même
+        avenir : seul le plus à gauche est conservé, sauf si le plus à droite
+        a déjà reconnu une chaîne ou si une reconnaissance antérieure peut
+        encore éliminer le plus à gauche. Le nombre de fils reste donc de
+        l'ordre du nombre d'états de l'automate tant que peu de
+        reconnaissances sont en attente (ce qui n'arrive qu'avec des
+        expressions comme 'a+b|a' sur une longue suite de 'a'). """
+    def __init__(self,automaton):
+        """ automaton correspond à l'automate déterministe (Automaton)
+            associé, par exemple compileShared(s).automaton. """
+        self.automaton = automaton
+        self.deadState = automaton.deadState
+        self.charClasses = automaton.charClasses
+        # voir Pattern.__init__()
+        self.bounded = automaton.maxStates != None
+        if self.bounded:
+            self.step = self.countedStep
+        self.reset()
+    def reset(self):
+        """ Oublie les recherches en cours et remet la position à 0. """
+        # position dans le flux du prochain caractère
+        self.pos = 0
+        # fils en cours triés par position de départ : listes
+        # [état (None si le fil est mort),début,fin de la plus longue
+        # reconnaissance (None si aucune)]
+        self.threads = []
+    def step(self,k,found,spawn=True):
+        """ Avance tous les fils sur un caractère de la classe k et ajoute à
+            la liste found les reconnaissances terminées. Si spawn vaut False,
+            aucune reconnaissance ne peut commencer sur ce caractère. """
+        p = self.pos
+        self.pos = p+1
+        dead = self.deadState
+        threads = self.threads
+        # un nouveau fil démarre à chaque position
+        if spawn:
+            threads.append([self.automaton.beginState,p,None])
+        kept = []
+        # états déjà occupés par un fil plus à gauche, associés à un booléen
+        # indiquant si une reconnaissance était en attente avant ce fil
+        seen = {}
+        pending = False
+        # les fils qui démarrent avant limit chevauchent une reconnaissance
+        # déjà signalée ou assurée
+        limit = 0
+        for t in threads:
+            state,start,end = t
+            if start < limit:
+                continue
+            if state != None:
+                node = state.trans[k]
+                if node == None:
+                    node = self.automaton.computeNext(state,k)
+                if node is dead:
+                    state = None
+                else:
+                    if node.final:
+                        end = p+1
+                    state = node
+                    if node.terminal:
+                        state = None
+                t[0] = state
+                t[2] = end
+            if state == None:
+                if end == None:
+                    continue
+                if not kept:
+                    # fil le plus à gauche et terminé : sa reconnaissance
+                    # est la bonne
+                    found.append((start,end))
+                    limit = end
+                    continue
+            elif not kept:
+                # le fil le plus à gauche signalera au moins sa
+                # reconnaissance actuelle
+                if end != None:
+                    limit = end
+                seen[state.key] = False
+            else:
+                x = seen.get(state.key)
+                if x == None:
+                    seen[state.key] = pending
+                elif end == None and not x:
+                    # même état qu'un fil plus à gauche qui ne peut être
+                    # éliminé par une reconnaissance antérieure
+                    continue
+            if kept and end != None:
+                pending = True
+            kept.append(t)
+        self.threads = kept
+    def countedStep(self,k,found,spawn=True):
+        """ step() d'une recherche dont le cache est borné : le caractère est
+            compté dans automaton.bytes. """
+        self.automaton.bytes += 1
+        Searcher.step(self,k,found,spawn)
+    def next(self,c):
+        """ Injecte un caractère dans la recherche et retourne la liste des
+            reconnaissances terminées par ce caractère (souvent vide). """
+        found = []
+        self.step(self.charClasses[c],found)
+        return found
+    def feed(self,buffer,start=0):
+        """ Injecte un bloc de caractères (str, bytearray ou memoryview) à
+            partir de la position start et retourne la liste des
+            reconnaissances terminées dans ce bloc. Si l'automate a un
+            préfiltre, les caractères qui ne peuvent pas commencer une
+            reconnaissance sont sautés tant qu'aucun fil n'est en cours. """
+        if isinstance(buffer,bytearray):
+            classes = self.automaton.classes
+        else:
+            classes = self.charClasses
+        found = []
+        prefilter = self.automaton.prefilter
+        if prefilter == None or not isinstance(buffer,(str,bytearray)):
+            for i in xrange(start,len(buffer)):
+                self.step(classes[buffer[i]],found)
+            return found
+        n = len(buffer)
+        candidates = prefilter.candidates(buffer,start)
+        candidate = next(candidates,n)
+        i = start
+        while i < n:
+            if not self.threads:
+                # aucun fil en cours : saut jusqu'au prochain candidat
+                self.pos += candidate-i
+                if self.bounded:
+                    self.automaton.bytes += candidate-i
+                i = candidate
+                if i == n:
+                    break
+            self.step(classes[buffer[i]],found,i == candidate)
+            i += 1
+            if candidate < i:
+                candidate = next(candidates,n)
+        return found
+    def flush(self):
+        """ Signale la fin du flux : retourne la liste des reconnaissances
+            encore en attente puis oublie les recherches en cours. """
+        found = []
+        limit = 0
+        for state,start,end in self.threads:
+            if end != None and start >= limit:
+                found.append((start,end))
+                limit = end
+        self.threads = []
+        return found
+
+def minimize(trans,final):
+    """ Minimise un automate déterministe complet à l'aide de l'algorithme de
+        Hopcroft. trans est la liste des lignes de transitions (la liste des
+        numéros d'états atteints pour chaque classe d'octets) et final la liste
+        des étiquettes des états : deux états d'étiquettes différentes (final
+        ou non, expressions reconnues...) ne sont jamais équivalents. Cette
+        fonction retourne la liste donnant pour chaque état le numéro de sa
+        classe d'équivalence. """
+    n = len(trans)
+    # les classes dont les colonnes de transitions sont identiques se
+    # comportent de la même façon, on ne garde qu'une colonne par groupe de
+    # classes. Pour chaque colonne on calcule les transitions inverses :
+    # inv[c][t] est la liste des états qui mènent à l'état t par la colonne c
+    inv = []
+    for column in set(zip(*trans)):
+        invc = {}
+        for s in xrange(n):
+            invc.setdefault(column[s],[]).append(s)
+        inv.append(invc)
+    # partition initiale : une classe par étiquette
+    partition = []
+    block = [0]*n
+    labels = {}
+    for i in xrange(n):
+        j = labels.get(final[i])
+        if j == None:
+            j = labels[final[i]] = len(partition)
+            partition.append(set())
+        partition[j].add(i)
+        block[i] = j
+    # ensemble des classes servant à séparer les autres (toutes sauf la plus
+    # grande des classes initiales)
+    waiting = range(len(partition))
+    waiting.remove(max(waiting,key=lambda i: len(partition[i])))
+    inwaiting = set(waiting)
+    while waiting:
+        i = waiting.pop()
+        inwaiting.discard(i)
+        a = partition[i]
+        for invc in inv:
+            # états qui mènent dans la classe a par la colonne courante,
+            # regroupés par classe
+            touched = {}
+            for t in a:
+                for s in invc.get(t,()):
+                    touched.setdefault(block[s],[]).append(s)
+            for j,members in touched.iteritems():
+                y = partition[j]
+                if len(members) == len(y):
+                    continue
+                # la classe y est coupée en deux
+                y1 = set(members)
+                k = len(partition)
+                partition[j] = y - y1
+                partition.append(y1)
+                for s in y1:
+                    block[s] = k
+                if j in inwaiting:
+                    waiting.append(k)
+                    inwaiting.add(k)
+                else:
+                    if len(y1) <= len(partition[j]):
+                        k = j
+                    waiting.append(k)
+                    inwaiting.add(k)
+    return block
+
+class EagerAutomaton:
+    """ Automate déterministe minimal entièrement calculé à la compilation.
+        Les transitions sont stockées dans une seule table contigüe indexée
+        par etat*nclasses+classe (voir Automaton pour les classes d'octets).
+        L'état 0 est l'état puits et l'état 1 l'état
+        initial. Cet automate ne change plus après sa construction, il peut
+        donc être partagé sans précaution particulière. """
+    def __init__(self,automaton=None):
+        """ automaton correspond à l'automate paresseux (Automaton) dont on
+            construit tous les états. Si automaton vaut None, l'automate est
+            vide et doit être rempli (voir load()). """
+        self.starts = None
+        self.steps = None
+        # numéros des groupes capturés (voir TaggedAutomaton), None si
+        # l'automate ne capture rien
+        self.captured = None
+        if automaton == None:
+            return
+        self.source = automaton.source
+        self.prefilter = automaton.prefilter
+        self.ndstates = automaton.ndstates
+        self.classes = automaton.classes
+        self.charClasses = automaton.charClasses
+        self.nclasses = w = automaton.nclasses
+        # construction de tous les états déterministes accessibles (l'état
+        # puits porte le numéro 0 et l'état initial le numéro 1)
+        dead = automaton.deadState
+        states = [dead,automaton.beginState]
+        index = {id(dead):0,id(automaton.beginState):1}
+        trans = [[0]*w]
+        i = 1
+        while i < len(states):
+            row = []
+            for node in automaton.computeAll(states[i]):
+                k = index.get(id(node))
+                if k == None:
+                    k = len(states)
+                    index[id(node)] = k
+                    states.append(node)
+                row.append(k)
+            trans.append(row)
+            i += 1
+        # minimisation de l'automate
+        block = minimize(trans,[(s.matches,s.alive) for s in states])
+        # numérotation des classes (puits = 0 et initial = 1)
+        number = {block[0]:0,block[1]:1}
+        representatives = [0,1]
+        for s in xrange(len(states)):
+            if not block[s] in number:
+                number[block[s]] = len(representatives)
+                representatives.append(s)
+        n = len(representatives)
+        if n <= 0x10000:
+            self.table = array('H',[0])*(n*w)
+        else:
+            self.table = array('I',[0])*(n*w)
+        self.finals = bytearray((n+7) >> 3)
+        # expressions reconnues et expressions encore vivantes de chaque état
+        self.matches = [states[s].matches for s in representatives]
+        self.alive = [states[s].alive for s in representatives]
+        for x in xrange(n):
+            row = trans[representatives[x]]
+            base = x*w
+            for k in range(w):
+                self.table[base+k] = number[block[row[k]]]
+            if states[representatives[x]].final:
+                self.finals[x >> 3] |= 1 << (x & 7)
+        self.nstates = n
+    def feedTable(self):
+        """ Retourne la table des transitions utilisée par EagerPattern.feed()
+            (construite lors du premier appel) : une liste indexée comme table
+            mais dont chaque élément est le numéro de l'état d'arrivée déjà
+            multiplié par nclasses, négatif si cet état est final. L'état
+            suivant ne coûte alors qu'une addition et un seul test (<= 0)
+            détecte l'état puits et les états finaux. """
+        if self.steps == None:
+            w = self.nclasses
+            ends = [0]*self.nstates
+            for s in xrange(self.nstates):
+                if self.finals[s >> 3] & (1 << (s & 7)):
+                    ends[s] = 1
+            steps = [0]*len(self.table)
+            i = 0
+            for s in self.table:
+                if ends[s]:
+                    steps[i] = -s*w
+                else:
+                    steps[i] = s*w
+                i += 1
+            self.steps = steps
+        return self.steps
+    def firstBytes(self):
+        """ Voir Automaton.firstBytes(). """
+        if self.starts == None:
+            w = self.nclasses
+            self.starts = "".join([chr(c) for c in range(256) if self.table[w+self.classes[c]]])
+        return self.starts
+
+# Nombre maximum d'états d'un automate à marques (voir TaggedAutomaton)
+MAX_TAGGED_STATES = 0x10000
+
+class TaggedAutomaton(EagerAutomaton):
+    """ Automate déterministe dont les transitions relèvent la position des
+        groupes capturés (automate à marques, d'après V. Laurikari). Un état
+        est une liste de fils de l'automate non-déterministe classés par
+        priorité (voir taggedStep()), chaque fil désignant le registre qui
+        contient l'historique de ses marques. Une transition calcule les
+        nouveaux registres à partir des anciens : la plupart des transitions
+        ne changent pas les registres (opérations None) et ne coûtent rien,
+        seules les frontières des groupes capturés ajoutent des marques. Les
+        positions sont donc connues dès l'acceptation, sans relire la chaîne
+        reconnue.
+        Les états sont numérotés comme ceux d'EagerAutomaton (puits = 0 et
+        initial = 1), l'automate est entièrement construit à la compilation
+        mais n'est pas minimisé. """
+    def __init__(self,beginState=None,captured=()):
+        """ beginState correspond à l'état initial de l'automate
+            non-déterministe et captured au tuple trié des numéros des
+            groupes capturés. Si beginState vaut None, l'automate est vide et
+            doit être rempli (voir load()). """
+        EagerAutomaton.__init__(self)
+        self.moves = None
+        if beginState == None:
+            return
+        self.source = None
+        self.prefilter = None
+        self.ndstates = beginState
+        self.captured = captured
+        nfa = numberStates(beginState)
+        # nombre de groupes (le groupe 0 correspond à toute la chaîne)
+        self.ngroups = max([(s.tag >> 1)+1 for s in nfa if s.tag != None]+[1])
+        self.classes = byteClasses(nfa)
+        self.charClasses = dict((chr(c),self.classes[c]) for c in range(256))
+        self.nclasses = w = max(self.classes)+1
+        representatives = [0]*w
+        for c in range(255,-1,-1):
+            representatives[self.classes[c]] = c
+        wanted = frozenset(captured)
+        # état initial : un seul registre, vide
+        begin,self.initOps = taggedStep([(beginState,0,())],None,wanted)
+        states = [[],begin]
+        index = {tuple([(t.id,r,tags) for t,r,tags in begin]):1}
+        table = [0]*w
+        self.ops = [None]*w
+        i = 1
+        while i < len(states):
+            for k in range(w):
+                l,ops = taggedStep(states[i],representatives[k],wanted)
+                if not l:
+                    table.append(0)
+                    self.ops.append(None)
+                    continue
+                key = tuple([(t.id,r,tags) for t,r,tags in l])
+                x = index.get(key)
+                if x == None:
+                    x = len(states)
+                    if x >= MAX_TAGGED_STATES:
+                        raise RegexpException("Too many states to capture groups")
+                    index[key] = x
+                    states.append(l)
+                table.append(x)
+                # registres inchangés : la transition ne coûte rien
+                for r in range(len(ops)):
+                    if ops[r] != (r,()):
+                        break
+                else:
+                    ops = None
+                self.ops.append(ops)
+            i += 1
+        n = len(states)
+        if n <= 0x10000:
+            self.table = array('H',table)
+        else:
+            self.table = array('I',table)
+        # fil final le plus prioritaire de chaque état : couple (registre,
+        # marques en attente), None si l'état n'est pas final
+        self.finalThreads = [None]*n
+        self.finals = bytearray((n+7) >> 3)
+        for x in xrange(n):
+            for t,r,tags in states[x]:
+                if t.t & FLAG_FINAL:
+                    self.finalThreads[x] = (r,tags)
+                    self.finals[x >> 3] |= 1 << (x & 7)
+                    break
+        self.matches = [(0,) if t != None else () for t in self.finalThreads]
+        self.alive = [frozenset([0]) if states[x] else frozenset() for x in xrange(n)]
+        self.nstates = n
+    def movesTable(self):
+        """ Retourne la table des transitions utilisée par CapturePattern
+            (construite lors du premier appel) : une liste indexée comme table
+            dont chaque élément est le numéro de l'état d'arrivée déjà
+            multiplié par nclasses si la transition ne mène ni à un état
+            final ni à l'état puits et ne change pas les registres. Les
+            autres transitions sont codées par -1-i où i est leur indice
+            dans table et ops. Un seul test (> 0) suffit alors pour le cas
+            courant. """
+        if self.moves == None:
+            w = self.nclasses
+            moves = [0]*len(self.table)
+            for i in xrange(len(self.table)):
+                s = self.table[i]
+                if s and self.ops[i] == None and self.finalThreads[s] == None:
+                    moves[i] = s*w
+                else:
+                    moves[i] = -1-i
+            self.moves = moves
+        return self.moves
+
+class EagerPattern:
+    """ Représente une expression régulière compilée dont l'automate
+        déterministe minimal (EagerAutomaton) est entièrement calculé à la
+        compilation. Cette classe fournit les mêmes méthodes que la classe
+        Pattern. """
+    def __init__(self,automaton):
+        """ Constructeur privé ! automaton correspond à l'automate
+            déterministe (EagerAutomaton) associé. """
+        self.automaton = automaton
+        self.table = automaton.table
+        self.finals = automaton.finals
+        self.charClasses = automaton.charClasses
+        self.nclasses = automaton.nclasses
+        self.steps = automaton.feedTable()
+        self.currentState = 1
+        self.loose = False
+    def reset(self):
+        """ Remet l'expression régulière dans son été initial. """
+        self.currentState = 1
+        self.loose = False
+    def next(self,c):
+        """ Injecte un caractère dans l'expression régulière compilée (voir
+            Pattern.next()). """
+        s = self.table[self.currentState*self.nclasses + self.charClasses[c]]
+        self.currentState = s
+        if not s:
+            self.loose = True
+            return FAIL
+        if self.finals[s >> 3] & (1 << (s & 7)):
+            return ACCEPT
+        return PASS
+    def feed(self,buffer,start=0):
+        """ Injecte un bloc de caractères dans l'expression régulière compilée
+            (voir Pattern.feed()). La boucle utilise la table de feedTable() :
+            un accès à la table et un test par caractère. """
+        if self.loose:
+            return (FAIL,start)
+        if buffer.__class__ is bytearray:
+            classes = self.automaton.classes
+        else:
+            classes = self.charClasses
+        steps = self.steps
+        w = self.nclasses
+        s = self.currentState*w
+        for i in xrange(start,len(buffer)):
+            s = steps[s+classes[buffer[i]]]
+            if s <= 0:
+                if s:
+                    self.currentState = -s//w
+                    return (ACCEPT,i+1)
+                self.currentState = 0
+                self.loose = True
+                return (FAIL,i+1)
+        self.currentState = s//w
+        return (PASS,len(buffer))
+    def skip(self,buffer,start=0):
+        """ Voir Pattern.skip(). """
+        return skipFailures(self.automaton.firstBytes(),buffer,start)
+    def isAccepted(self):
+        """ Retourne True si l'état courant est un état final, False sinon. """
+        s = self.currentState
+        return bool(self.finals[s >> 3] & (1 << (s & 7)))
+    def matches(self):
+        """ Voir Pattern.matches(). """
+        return self.automaton.matches[self.currentState]
+    def status(self,i):
+        """ Voir Pattern.status(). """
+        s = self.currentState
+        if i in self.automaton.matches[s]:
+            return ACCEPT
+        if i in self.automaton.alive[s]:
+            return PASS
+        return FAIL
+
+class CapturePattern(EagerPattern):
+    """ Expression régulière compilée avec compileCaptures() : elle
+        reconnait les mêmes chaînes qu'EagerPattern et relève au fil de la
+        reconnaissance la position de ses groupes capturés (voir
+        TaggedAutomaton et groups()). L'état courant est conservé multiplié
+        par le nombre de classes d'octets (voir
+        TaggedAutomaton.movesTable()). """
+    def __init__(self,automaton):
+        """ Constructeur privé ! automaton correspond à l'automate à marques
+            (TaggedAutomaton) associé. """
+        EagerPattern.__init__(self,automaton)
+        self.ops = automaton.ops
+        self.moves = automaton.movesTable()
+        self.reset()
+    def reset(self):
+        """ Remet l'expression régulière dans son été initial. """
+        self.currentState = self.nclasses
+        self.loose = False
+        # nombre de caractères injectés depuis reset()
+        self.pos = 0
+        self.registers = applyTags([None],self.automaton.initOps,0)
+    def next(self,c):
+        """ Injecte un caractère dans l'expression régulière compilée (voir
+            Pattern.next()). """
+        s = self.moves[self.currentState + self.charClasses[c]]
+        self.pos += 1
+        if s > 0:
+            self.currentState = s
+            return PASS
+        # transition qui change les registres ou mène à un état final ou à
+        # l'état puits
+        i = -1-s
+        ops = self.ops[i]
+        if ops != None:
+            self.registers = applyTags(self.registers,ops,self.pos-1)
+        s = self.table[i]
+        self.currentState = s*self.nclasses
+        if not s:
+            self.loose = True
+            return FAIL
+        if self.finals[s >> 3] & (1 << (s & 7)):
+            return ACCEPT
+        return PASS
+    def feed(self,buffer,start=0):
+        """ Injecte un bloc de caractères dans l'expression régulière compilée
+            (voir Pattern.feed()). """
+        if self.loose:
+            return (FAIL,start)
+        if buffer.__class__ is bytearray:
+            classes = self.automaton.classes
+        else:
+            classes = self.charClasses
+        moves = self.moves
+        w = self.nclasses
+        s = self.currentState
+        # position dans le flux du caractère buffer[0]
+        base = self.pos-start
+        for i in xrange(start,len(buffer)):
+            s = moves[s+classes[buffer[i]]]
+            if s <= 0:
+                # voir next()
+                j = -1-s
+                ops = self.ops[j]
+                if ops != None:
+                    self.registers = applyTags(self.registers,ops,base+i)
+                s = self.table[j]
+                if not s:
+                    self.currentState = 0
+                    self.pos = base+i+1
+                    self.loose = True
+                    return (FAIL,i+1)
+                if self.finals[s >> 3] & (1 << (s & 7)):
+                    self.currentState = s*w
+                    self.pos = base+i+1
+                    return (ACCEPT,i+1)
+                s *= w
+        self.currentState = s
+        self.pos = base+len(buffer)
+        return (PASS,len(buffer))
+    def isAccepted(self):
+        """ Retourne True si l'état courant est un état final, False sinon. """
+        s = self.currentState//self.nclasses
+        return bool(self.finals[s >> 3] & (1 << (s & 7)))
+    def matches(self):
+        """ Voir Pattern.matches(). """
+        return self.automaton.matches[self.currentState//self.nclasses]
+    def status(self,i):
+        """ Voir Pattern.status(). """
+        s = self.currentState//self.nclasses
+        if i in self.automaton.matches[s]:
+            return ACCEPT
+        if i in self.automaton.alive[s]:
+            return PASS
+        return FAIL
+    def groups(self):
+        """ Retourne la position des groupes dans la chaîne injectée depuis
+            reset(), si elle est reconnue (None sinon). Les groupes sont les
+            sous-expressions entre parenthèses, numérotées à partir de 1 dans
+            l'ordre de leur parenthèse ouvrante. Le résultat est une liste g
+            où g[i] est la liste des couples (début,fin) de toutes les
+            occurrences du groupe i (un groupe répété en a plusieurs, un
+            groupe optionnel aucune, un groupe non capturé jamais) et
+            g[0] == [(0,nombre de caractères injectés)]. Lorsque plusieurs
+            découpages sont possibles, les alternatives de gauche et les
+            répétitions les plus longues sont préférées, comme avec le
+            module re de python. """
+        thread = self.automaton.finalThreads[self.currentState//self.nclasses]
+        if self.loose or thread == None:
+            return None
+        n = self.automaton.ngroups
+        result = [[] for i in xrange(n)]
+        # l'historique est parcouru de la marque la plus récente à la plus
+        # ancienne : la sortie d'une occurrence précède son entrée (deux
+        # occurrences d'un même groupe ne peuvent pas s'imbriquer)
+        ends = [0]*n
+        h = applyTags(self.registers,(thread,),self.pos)[0]
+        while h != None:
+            tag,pos,h = h
+            if tag & 1:
+                ends[tag >> 1] = pos
+            else:
+                result[tag >> 1].append((pos,ends[tag >> 1]))
+        for i in self.automaton.captured:
+            result[i].reverse()
+        result[0].append((0,self.pos))
+        return result
+
+# Format des fichiers d'automates (voir save()) : l'en-tête MAGIC, la
+# longueur (4 octets, petit boutiste) des méta-données sérialisées avec le
+# module marshal puis, alignée sur la taille d'un élément, la table des
+# transitions brute dans l'ordre des octets de la machine qui l'a écrite. Les
+# méta-données d'un automate à marques contiennent aussi ses opérations.
+MAGIC = "SRDFA\x04"
+
+def save(p,filename):
+    """ Enregistre l'automate déterministe minimal d'une expression compilée
+        (Pattern ou EagerPattern) ou l'automate à marques d'une expression
+        compilée avec compileCaptures() dans le fichier filename. L'automate
+        d'une expression paresseuse est entièrement construit pour
+        l'occasion. """
+    automaton = p.automaton
+    if not isinstance(automaton,EagerAutomaton):
+        fresh = Automaton(automaton.ndstates)
+        fresh.source = automaton.source
+        fresh.prefilter = automaton.prefilter
+        automaton = EagerAutomaton(fresh)
+    table = automaton.table
+    literals = None
+    if automaton.prefilter != None:
+        literals = automaton.prefilter.literals
+    tags = None
+    if automaton.captured != None:
+        tags = (automaton.captured,automaton.ngroups,automaton.initOps,
+                automaton.ops,automaton.finalThreads)
+    meta = marshal.dumps((automaton.source,automaton.nstates,automaton.nclasses,
+                          table.typecode,sys.byteorder,
+                          str(bytearray(automaton.classes)),str(automaton.finals),
+                          automaton.matches,[tuple(x) for x in automaton.alive],
+                          literals,tags))
+    offset = len(MAGIC)+4+len(meta)
+    pad = (-offset) % table.itemsize
+    # écriture dans un fichier temporaire unique du même répertoire puis
+    # renommage pour qu'une lecture concurrente ne voie jamais un fichier
+    # incomplet et que deux écritures simultanées ne se mélangent pas
+    fd,tmp = tempfile.mkstemp(prefix=os.path.basename(filename)+".",
+                              dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        f = os.fdopen(fd,"wb")
+        try:
+            f.write(MAGIC)
+            f.write(array('B',[(len(meta) >> i) & 0xFF for i in (0,8,16,24)]).tostring())
+            f.write(meta)
+            f.write("\0"*pad)
+            f.write(table.tostring())
+        finally:
+            f.close()
+        if os.name != "posix" and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp,filename)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def load(filename):
+    """ Charge un automate enregistré avec save() et retourne une nouvelle
+        expression compilée (EagerPattern, ou CapturePattern pour un automate
+        à marques). Le fichier est projeté en mémoire et la table des
+        transitions en est copiée d'un bloc dans un array, sans passer par
+        une chaîne intermédiaire. La projection est ensuite fermée : un
+        array ne peut pas être construit sur une projection sans copie et
+        lire chaque transition dans la projection (module struct) coûterait
+        plus cher à chaque caractère qu'un accès à l'array. Les expressions
+        compilées recopient de toute façon la table sous la forme qui
+        convient à leur boucle (voir EagerAutomaton.feedTable() et
+        TaggedAutomaton.movesTable()). """
+    f = open(filename,"rb")
+    try:
+        m = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+    try:
+        if m[:len(MAGIC)] != MAGIC:
+            raise RegexpException("'"+filename+"' is not a compiled regular expression")
+        i = len(MAGIC)
+        size = 0
+        for k in range(4):
+            size |= ord(m[i+k]) << (8*k)
+        i += 4
+        (source,n,w,typecode,byteorder,classes,finals,matches,alive,literals,tags) = marshal.loads(m[i:i+size])
+        table = array(typecode)
+        i += size
+        i += (-i) % table.itemsize
+        if len(m) < i+n*w*table.itemsize:
+            raise RegexpException("'"+filename+"' is truncated")
+        # buffer() désigne la table dans la projection : elle n'est copiée
+        # qu'une fois, directement dans l'array
+        table.fromstring(buffer(m,i,n*w*table.itemsize))
+    finally:
+        m.close()
+    if byteorder != sys.byteorder:
+        table.byteswap()
+    if tags != None:
+        automaton = TaggedAutomaton()
+        (automaton.captured,automaton.ngroups,automaton.initOps,
+         automaton.ops,automaton.finalThreads) = tags
+    else:
+        automaton = EagerAutomaton()
+    automaton.source = source
+    automaton.prefilter = None
+    if literals != None:
+        automaton.prefilter = Prefilter(literals)
+    automaton.ndstates = None
+    automaton.classes = list(bytearray(classes))
+    automaton.charClasses = dict((chr(c),automaton.classes[c]) for c in range(256))
+    automaton.nclasses = w
+    automaton.table = table
+    automaton.finals = bytearray(finals)
+    automaton.matches = matches
+    automaton.alive = [frozenset(x) for x in alive]
+    automaton.nstates = n
+    if tags != None:
+        return CapturePattern(automaton)
+    return EagerPattern(automaton)
 
 class RegexpException(Exception):
     """ Exceptions pour les expressions régulières."""
@@ -273,9 +1478,12 @@ class Tokenizer:
         return current
 
 
-def compile(s):
-    """ Compile une expression régulière donnée sous forme de chaîne. """
+def parse(s):
+    """ Analyse une expression régulière donnée sous forme de chaîne et
+        retourne son arbre syntaxique (Regexp). """
     t = Tokenizer(s)
+    # nombre de groupes rencontrés
+    groups = [0]
     # Et une grammaire LL1 calculée à la main ! une !
     def E1():
         if t.get()=='[' or t.get()=='(' or t.get()=='.' or not (t.get() in SPECIAL_CHARS) and (t.get() != None):
@@ -318,8 +1526,12 @@ def compile(s):
             return And(expr1,expr2)
     def F1():
         if t.get()=='(':
+            # les groupes sont numérotés dans l'ordre de leur parenthèse
+            # ouvrante
+            groups[0] += 1
+            n = groups[0]
             t.next()
-            expr1 = E1()
+            expr1 = Group(E1(),n)
             if t.get()==')':
                 t.next()
                 expr2 = F2(expr1)
@@ -443,7 +1655,165 @@ def compile(s):
     expr = E1()
     if t.get() != None:
         raise RegexpException("Syntax error near '"+str(t.get())+"'")
-    return Pattern(expr.compile()[0])
+    return expr
+
+def compile(s,eager=False,maxStates=None):
+    """ Compile une expression régulière donnée sous forme de chaîne. Par
+        défaut, l'automate déterministe est construit au fur et à mesure de la
+        reconnaissance (Pattern), maxStates borne alors le nombre d'états
+        conservés (voir Automaton). Si eager vaut True, l'automate
+        déterministe minimal est entièrement construit à la compilation
+        (EagerPattern) et maxStates est ignoré. """
+    if eager:
+        maxStates = None
+    e = parse(s)
+    automaton = Automaton(e.compile()[0],maxStates)
+    automaton.source = s
+    automaton.prefilter = makePrefilter([e])
+    if eager:
+        return EagerPattern(EagerAutomaton(automaton))
+    return Pattern(automaton)
+
+def makePrefilter(l):
+    """ Retourne le préfiltre (Prefilter) commun aux arbres syntaxiques de la
+        liste l ou None si aucun littéral n'a pu être extrait. """
+    e = l[0]
+    for x in l[1:]:
+        e = Or(e,x)
+    l = literals(e)
+    if l == None:
+        return None
+    return Prefilter(l)
+
+def parseSet(l):
+    """ Construit l'union des automates non-déterministes d'une liste
+        d'expressions régulières et retourne son état initial. Chaque état
+        porte le numéro de son expression (voir compileSet()). """
+    if not l:
+        raise RegexpException("Empty set of regular expressions")
+    # une transition epsilon vers l'état initial de chaque expression
+    begin = None
+    for i in range(len(l)-1,-1,-1):
+        init = parse(l[i]).compile()[0]
+        for state in numberStates(init):
+            state.pid = i
+        if begin == None:
+            begin = init
+        else:
+            begin = NDState(init,begin,FLAG_EPSILON)
+            begin.pid = None
+    return begin
+
+def compileSearch(s,maxStates=None):
+    """ Compile une expression régulière pour la rechercher n'importe où dans
+        un flux (voir Searcher). """
+    e = parse(s)
+    automaton = Automaton(e.compile()[0],maxStates)
+    automaton.source = s
+    automaton.prefilter = makePrefilter([e])
+    return Searcher(automaton)
+
+def compileCaptures(s,groups=None):
+    """ Compile une expression régulière dont on veut connaitre la position
+        des groupes lors de l'acceptation (voir CapturePattern.groups()).
+        groups est la liste des numéros des groupes capturés, None pour les
+        capturer tous : seules les frontières de ces groupes coûtent quelque
+        chose lors de la reconnaissance. L'automate à marques
+        (TaggedAutomaton) est entièrement construit à la compilation. """
+    e = parse(s)
+    begin = e.compile()[0]
+    if groups == None:
+        groups = [x.tag >> 1 for x in numberStates(begin) if x.tag != None]
+    automaton = TaggedAutomaton(begin,tuple(sorted(set(groups))))
+    automaton.source = s
+    automaton.prefilter = makePrefilter([e])
+    return CapturePattern(automaton)
+
+def compileSet(l,eager=False,maxStates=None):
+    """ Compile un ensemble d'expressions régulières (liste de chaînes) en un
+        seul automate déterministe : chaque caractère n'est donc classé qu'une
+        fois pour toutes les expressions. L'expression compilée retourne
+        ACCEPT dès qu'une des expressions reconnait la chaîne et FAIL quand
+        toutes ont échoué. Les méthodes matches() et status() donnent le
+        résultat de chaque expression (numérotées dans l'ordre de la liste).
+        eager et maxStates ont le même sens que pour compile(). """
+    if eager:
+        maxStates = None
+    automaton = Automaton(parseSet(l),maxStates)
+    automaton.source = tuple(l)
+    automaton.prefilter = makePrefilter([parse(x) for x in l])
+    if eager:
+        return EagerPattern(EagerAutomaton(automaton))
+    return Pattern(automaton)
+
+def loadSource(s,filename,captured=None):
+    """ Retourne l'automate enregistré dans le fichier filename s'il existe,
+        est lisible et a été compilé à partir de l'expression s en capturant
+        les groupes captured (tuple trié, None pour un automate sans
+        marques), None sinon. """
+    try:
+        automaton = load(filename).automaton
+    except (IOError,OSError,EOFError,ValueError,TypeError,RegexpException):
+        return None
+    if automaton.source != s or automaton.captured != captured:
+        return None
+    return automaton
+
+# automates partagés par toutes les expressions compilées avec compileShared()
+# indexés par le triplet (expression,eager,groupes capturés)
+sharedAutomata = {}
+sharedLock = threading.Lock()
+
+def compileShared(s,eager=False,maxStates=None,filename=None,write=False,captures=None):
+    """ Compile une expression régulière comme compile() mais l'automate
+        associé est partagé par toutes les expressions compilées de la même
+        façon avec cette fonction (dans toutes les threads). Chaque appel
+        retourne une nouvelle expression compilée qui ne contient que son état
+        courant. Les états déterministes calculés par une expression profitent
+        donc à toutes les autres. Si s est une liste (ou un tuple) de chaînes,
+        l'ensemble est compilé avec compileSet(). La borne maxStates est celle
+        donnée lors de la création de l'automate partagé.
+        Si filename est donné (avec eager == True), l'automate est chargé
+        depuis ce fichier lors de la première utilisation s'il a été
+        enregistré pour la même expression. Sinon il est compilé en mémoire
+        et, seulement si write vaut True, enregistré dans ce fichier pour les
+        prochains démarrages (si possible).
+        Si captures est donné (liste de numéros de groupes), l'expression
+        est compilée avec compileCaptures() et eager est ignoré. """
+    if isinstance(s,(list,tuple)):
+        s = tuple(s)
+    if captures != None:
+        captures = tuple(sorted(set(captures)))
+        eager = True
+    sharedLock.acquire()
+    try:
+        automaton = sharedAutomata.get((s,eager,captures))
+        if automaton == None and eager and filename != None:
+            automaton = loadSource(s,filename,captures)
+        if automaton == None:
+            if captures != None:
+                p = compileCaptures(s,captures)
+            elif isinstance(s,tuple):
+                p = compileSet(s,eager,maxStates)
+            else:
+                p = compile(s,eager,maxStates)
+            automaton = p.automaton
+            if eager and filename != None and write:
+                try:
+                    save(p,filename)
+                except (IOError,OSError):
+                    # répertoire en lecture seule : l'automate compilé en
+                    # mémoire est utilisé, il sera recompilé au prochain
+                    # démarrage
+                    pass
+            sharedAutomata[(s,eager,captures)] = automaton
+    finally:
+        sharedLock.release()
+    if captures != None:
+        return CapturePattern(automaton)
+    if eager:
+        return EagerPattern(automaton)
+    return Pattern(automaton)
 
 # Classes pour construire l'arbre syntaxique des expressions régulières
 
@@ -454,6 +1824,24 @@ class Regexp:
             correpondant à un pointeur vers l'état initial et à un pointeur
             vers l'état final de l'automate crée. """
         pass
+    def prefixes(self):
+        """ Retourne un couple (l,exact) où l est un ensemble de chaînes tel
+            que toute chaîne reconnue commence par l'une d'elles, exact
+            indiquant si l est exactement l'ensemble des chaînes reconnues.
+            Retourne None si un tel ensemble de taille raisonnable n'existe
+            pas. """
+        return None
+
+def truncate(l):
+    """ Réduit un ensemble de préfixes à au plus MAX_LITERALS chaînes en
+        les raccourcissant. Retourne None si c'est impossible. """
+    n = max([len(x) for x in l])
+    while len(l) > MAX_LITERALS:
+        n -= 1
+        if n == 0:
+            return None
+        l = set([x[:n] for x in l])
+    return l
 
 # *
 class Repete(Regexp):
@@ -464,9 +1852,15 @@ class Repete(Regexp):
         final = NDState(None,None,FLAG_FINAL)
         init = NDState(init1,final,FLAG_EPSILON)
         final1.t = FLAG_EPSILON
-        final1.next1 = final
-        final1.next2 = init1
+        # la répétition est prioritaire sur la sortie (voir taggedClosure())
+        final1.next1 = init1
+        final1.next2 = final
         return (init,final)
+    def prefixes(self):
+        p = self.e.prefixes()
+        if p == None:
+            return None
+        return (p[0] | set([""]),False)
     def __str__(self):
         return self.e.__str__()+"*"
 # +
@@ -480,6 +1874,11 @@ class RepeteOnce(Regexp):
         final1.next1 = init1
         final1.next2 = final
         return (init1,final)
+    def prefixes(self):
+        p = self.e.prefixes()
+        if p == None:
+            return None
+        return (p[0],False)
     def __str__(self):
         return self.e.__str__()+"+"
 
@@ -495,6 +1894,18 @@ class Or(Regexp):
         final1.t = FLAG_EPSILON
         final1.next1 = final2
         return (init,final2)
+    def prefixes(self):
+        p1 = self.e1.prefixes()
+        p2 = self.e2.prefixes()
+        if p1 == None or p2 == None:
+            return None
+        l = p1[0] | p2[0]
+        if len(l) > MAX_LITERALS:
+            l = truncate(l)
+            if l == None:
+                return None
+            return (l,False)
+        return (l,p1[1] and p2[1])
     def __str__(self):
         return "("+self.e1.__str__()+"|"+self.e2.__str__()+")"
 
@@ -507,13 +1918,45 @@ class And(Regexp):
         init1,final1 = self.e1.compile()
         init2,final2 = self.e2.compile()
         final1.t = init2.t
+        final1.cls = init2.cls
+        final1.tag = init2.tag
         final1.next1 = init2.next1
         final1.next2 = init2.next2
         # l'état init2 pourrait être détruit
         return (init1,final2)
+    def prefixes(self):
+        p1 = self.e1.prefixes()
+        if p1 == None or not p1[1]:
+            return p1
+        p2 = self.e2.prefixes()
+        if p2 == None:
+            return (p1[0],False)
+        l = set([x+y for x in p1[0] for y in p2[0]])
+        if len(l) > MAX_LITERALS:
+            return (p1[0],False)
+        return (l,p2[1])
     def __str__(self):
         return self.e1.__str__()+self.e2.__str__()
 
+# ( ) : groupe dont on peut retrouver la position (voir CapturePattern)
+class Group(Regexp):
+    def __init__(self,e,n):
+        self.e = e
+        self.n = n
+    def compile(self):
+        init1,final1 = self.e.compile()
+        final = NDState(None,None,FLAG_FINAL)
+        init = NDState(init1,None,FLAG_EPSILON)
+        init.tag = 2*self.n
+        final1.t = FLAG_EPSILON
+        final1.next1 = final
+        final1.tag = 2*self.n+1
+        return (init,final)
+    def prefixes(self):
+        return self.e.prefixes()
+    def __str__(self):
+        return "("+self.e.__str__()+")"
+
 # ?
 class Option(Regexp):
     def __init__(self,e):
@@ -522,6 +1965,11 @@ class Option(Regexp):
         init1,final1 = self.e.compile()
         init = NDState(init1,final1,FLAG_EPSILON)
         return (init,final1)
+    def prefixes(self):
+        p = self.e.prefixes()
+        if p == None:
+            return None
+        return (p[0] | set([""]),p[1])
     def __str__(self):
         return self.e.__str__()+"?"
 
@@ -532,6 +1980,8 @@ class Token(Regexp):
     def compile(self):
         final = NDState(None,None,FLAG_FINAL)
         return (NDState(final,None,self.token),final)
+    def prefixes(self):
+        return (set([chr(self.token)]),True)
     def __str__(self):
         return chr(self.token)
 # .
@@ -548,21 +1998,23 @@ class TokenGroup(Regexp):
         self.list = list
         self.negate = negate
     def compile(self):
+        # ensemble des octets reconnus
+        x = 0
+        for i in self.list:
+            x |= 1 << ord(i)
         if self.negate:
-            l = [chr(i) for i in range(256) if not (chr(i) in self.list)]
-        else:
-            l = self.list
-        # création des états
+            x ^= (1 << 256) - 1
+        # création des états : une seule transition pour tout l'ensemble
         final = NDState(None,None,FLAG_FINAL)
-        init = NDState(final,None,ord(l[0]))
-        for i in l[1:]:
-            final.t = FLAG_EPSILON
-            final2 = NDState(None,None,FLAG_FINAL)
-            state = NDState(final2,None,ord(i))
-            init = NDState(state,init,FLAG_EPSILON)
-            final.next1 = final2
-            final = final2
-        return(init,final)
+        return (NDState(final,None,FLAG_CLASS,x),final)
+    def prefixes(self):
+        if self.negate:
+            l = set([chr(c) for c in range(256)]) - set(self.list)
+        else:
+            l = set(self.list)
+        if len(l) > MAX_LITERALS:
+            return None
+        return (l,True)
     def __str__(self):
         result = "["
         if self.negate:
@@ -584,13 +2036,19 @@ def printFSAND(a):
         if s.t & FLAG_FINAL:
             result += "Final state : "+str(s) + "\r\n"
         elif s.t & FLAG_EPSILON:
-            result += "State (Epsilon): "+str(s) + "\r\n"
+            if s.tag != None:
+                result += "State (Epsilon, tag "+str(s.tag)+"): "+str(s) + "\r\n"
+            else:
+                result += "State (Epsilon): "+str(s) + "\r\n"
             result += " Epsilon => " + str(s.next1) + "\r\n"
             if(s.next2):
                 result += " Epsilon => " + str(s.next2) + "\r\n"
         elif s.t & FLAG_ANY:
             result += "State (Any): "+ str(s) + "\r\n"
             result += " Any => " + str(s.next1) + "\r\n"
+        elif s.t & FLAG_CLASS:
+            result += "State (Class): "+ str(s) + "\r\n"
+            result += " [" + "".join([chr(c) for c in range(256) if (s.cls >> c) & 1]) + "] => " + str(s.next1) + "\r\n"
         else:
             result += "State ("+chr(s.t)+") : "+ str(s) + "\r\n"
             result += " "+chr(s.t)+" => "+str(s.next1) + "\r\n"
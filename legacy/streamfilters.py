@@ -1,7 +1,10 @@
 ﻿#!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import re
 import sys
+import time
+import binascii
 import threading
 import random
 
@@ -25,6 +28,9 @@ FILTER_FLUSHED = 3
 """ Etat final : le filtre a renvoyé ses donnés et doit être remis à zero
     avant d'effectuer une nouvelle opération. """
 
+""" Noms des états des filtres (utilisés par les traces). """
+FILTER_STATES = ["EMPTY","PASS","WAITING","FLUSHED"]
+
 class FilterException(Exception):
     """ Exceptions générées par les filtres """
     def __init__(self,message):
@@ -33,15 +39,113 @@ class FilterException(Exception):
 """ Nombre maximal d'octets qu'un filtre peut retenir (pour éviter qu'un bloquage ne sature la mémoire). """
 MAX_SIZE_BUFFER = 1000000 # environ 1 Mo....
 
+class FilterStats:
+    """ Compteurs d'activité d'un filtre (voir AbstractFilter.enableStats()).
+        Ils sont mis à jour par AbstractFilter.writeBlock() une fois par
+        appel, c'est à dire par point de passage et non par caractère : ils
+        peuvent rester activés en production. Les caractères écrits avec
+        write() hors de writeBlock() ne sont pas comptés. """
+    def __init__(self):
+        # octets consommés et produits par writeBlock()
+        self.bytesIn = 0
+        self.bytesOut = 0
+        # messages traités (filtre passant lu puis remis à zéro, pour un
+        # groupe : points de passage du groupe)
+        self.messages = 0
+        # octets consommés par les appels où le filtre retenait un message
+        # partiel (en entrée ou en sortie) et durée totale de ces attentes
+        self.waitingBytes = 0
+        self.waitingTime = 0.0
+        # bits cachés ou extraits (somme des efficacités des messages lus)
+        self.covertBits = 0
+        # remises à zéro d'un filtre qui retenait des caractères (message
+        # abandonné) et exceptions levées par writeBlock()
+        self.resets = 0
+        self.exceptions = 0
+        # temps passé dans writeBlock() (filtres internes compris)
+        self.time = 0.0
+        # début de l'attente en cours (None si le filtre n'attend pas)
+        self.waitingSince = None
+    def snapshot(self):
+        """ Retourne une copie des compteurs sous forme de dictionnaire. """
+        return {"bytesIn":self.bytesIn,"bytesOut":self.bytesOut,
+                "messages":self.messages,"waitingBytes":self.waitingBytes,
+                "waitingTime":self.waitingTime,"covertBits":self.covertBits,
+                "resets":self.resets,"exceptions":self.exceptions,
+                "time":self.time}
+
+
+""" Nombre d'événements conservés par défaut par un RingBufferTracer. """
+TRACER_CAPACITY = 4096
+
+class AbstractTracer:
+    """ Classe abstraite pour les traceurs. Un traceur installé sur une pile
+        de filtres (voir AbstractFilter.setTracer()) reçoit les changements
+        d'état des filtres, des transactions et de l'authentification. Sans
+        traceur, chaque point de trace ne coûte qu'un test d'attribut. """
+    def trace(self,source,event,detail=None):
+        """ Reçoit l'événement event (une chaîne) émis par l'objet source.
+            detail complète l'événement (tuple, nombre ou None). """
+        pass
+
+class RingBufferTracer(AbstractTracer):
+    """ Traceur qui conserve les capacity derniers événements horodatés dans
+        une liste circulaire. Les événements peuvent être lus (events()) ou
+        affichés (dump()) à tout moment. Aucun verrou n'est pris : un
+        événement reçu pendant une lecture peut ne pas y figurer. """
+    def __init__(self,capacity=TRACER_CAPACITY):
+        self.capacity = capacity
+        self.clear()
+    def trace(self,source,event,detail=None):
+        self.ring[self.count % self.capacity] = (time.time(),source,event,detail)
+        self.count += 1
+    def events(self):
+        """ Retourne la liste des événements conservés, du plus ancien au plus
+            récent, sous forme de tuples (date, source, événement, détail). """
+        count = self.count
+        if count <= self.capacity:
+            return self.ring[:count]
+        i = count % self.capacity
+        return self.ring[i:]+self.ring[:i]
+    def dump(self,out=sys.stderr):
+        """ Ecrit les événements conservés dans le fichier out, une ligne par
+            événement. """
+        events = self.events()
+        if len(events) < self.count:
+            print >> out, "(%d events lost)" % (self.count-len(events))
+        for t,source,event,detail in events:
+            if detail == None:
+                detail = ""
+            print >> out, "%.6f %s@%x %s %s" % (t,source.__class__.__name__,id(source),event,detail)
+    def clear(self):
+        """ Oublie tous les événements. """
+        self.ring = [None]*self.capacity
+        self.count = 0
+
+def setTracer(obj,tracer):
+    """ Installe tracer sur obj (filtre, reader ou writer) et sur les objets
+        qu'il utilise, si obj accepte un traceur. tracer peut valoir None
+        pour désactiver les traces. """
+    if hasattr(obj,"setTracer"):
+        obj.setTracer(tracer)
 
 class AbstractFilter:
     """ Classe abstraite représentant un filtre de transformation """
+    # traceur des changements d'état (None si les traces sont désactivées)
+    tracer = None
+    # nombre de bits cachés ou extraits par le message courant (redéfini par
+    # les filtres terminaux)
+    efficiency = 0
     def __init__(self):
         """ Construit un nouveau filtre. Ce constructeur est utilisé par les
-            classes héritées. """
+            classes héritées. Les caractères retenus par le filtre sont
+            accumulés dans un bytearray (self.buffer) : l'ajout d'un
+            caractère ne recopie pas ceux qui précèdent. """
         self.state = FILTER_EMPTY
-        self.buffer = ""
+        self.buffer = bytearray()
         self.buffsize = 0
+        # compteurs d'activité (None s'ils sont désactivés)
+        self.stats = None
     def write(self,c):
         """ Ecrit un caractère dans le filtre. Cette fonction retourne l'état du
             filtre après le traitement du caractère. Une exception est générée
@@ -54,6 +158,81 @@ class AbstractFilter:
         if self.buffsize == MAX_SIZE_BUFFER:
             raise FilterException("Filter is full")
         self.buffsize += 1
+    def writeBlock(self,buf,start=0):
+        """ Ecrit un bloc de caractères (chaîne ou bytearray) dans le filtre à partir de
+            la position start. Le filtre consomme les caractères jusqu'au
+            prochain point de passage : soit la fin d'une suite de caractères
+            transmis tels quels (voir skip()), soit le caractère qui rend le
+            filtre passant. Dans ce dernier cas le filtre est lu puis remis à
+            zéro. Retourne le triplet (nombre de caractères consommés, état
+            du filtre, liste des segments de sortie). L'état est
+            FILTER_WAITING si le bloc a été consommé sans atteindre de point
+            de passage, FILTER_EMPTY sinon.
+            Les segments sont des chaînes ou des bytearray.
+            Le traitement est fait par processBlock(), cette fonction met à
+            jour les compteurs d'activité et trace l'appel s'ils sont
+            activés. """
+        stats = self.stats
+        tracer = self.tracer
+        if stats == None and tracer == None:
+            return self.processBlock(buf,start)
+        state = self.state
+        t = time.time()
+        try:
+            n,x,outputs = self.processBlock(buf,start)
+        except Exception, ex:
+            if stats != None:
+                stats.exceptions += 1
+            if tracer != None:
+                tracer.trace(self,"exception",str(ex))
+            raise
+        if tracer != None:
+            tracer.trace(self,"block",(FILTER_STATES[state],FILTER_STATES[x],n))
+        if stats == None:
+            return (n,x,outputs)
+        now = time.time()
+        stats.time += now-t
+        stats.bytesIn += n
+        for s in outputs:
+            stats.bytesOut += len(s)
+        if x == FILTER_WAITING:
+            stats.waitingBytes += n
+            if stats.waitingSince == None:
+                stats.waitingSince = t
+        elif state == FILTER_WAITING and stats.waitingSince != None:
+            stats.waitingBytes += n
+            stats.waitingTime += now-stats.waitingSince
+            stats.waitingSince = None
+        return (n,x,outputs)
+    def processBlock(self,buf,start):
+        """ Traite un bloc de caractères pour writeBlock() et retourne le
+            même triplet. Cette implémentation adapte write() caractère par
+            caractère, les filtres peuvent la redéfinir pour traiter le bloc
+            d'un coup. """
+        if self.state == FILTER_EMPTY:
+            i = self.skip(buf,start)
+            if i > start:
+                return (i-start,FILTER_EMPTY,[buf[start:i]])
+        # les éléments d'un bytearray sont des entiers
+        ints = isinstance(buf,bytearray)
+        for i in xrange(start,len(buf)):
+            c = buf[i]
+            if ints:
+                c = chr(c)
+            if self.write(c) == FILTER_PASS:
+                s = self.read()
+                if self.stats != None:
+                    self.stats.messages += 1
+                    self.stats.covertBits += self.efficiency
+                self.reset()
+                return (i+1-start,FILTER_EMPTY,[s])
+        return (len(buf)-start,self.state,[])
+    def skip(self,buf,start):
+        """ Retourne la position du premier caractère de buf (à partir de
+            start) qui peut être modifié ou retenu par le filtre vide. Les
+            caractères qui précèdent le traversent sans modification. Par
+            défaut aucun caractère n'est sauté. """
+        return start
     def read(self):
         """ Cette fonction retourne les caractères traités par le filtre. Un
             filtre vide ne peut pas être lu, dans le cas contraire, une
@@ -64,13 +243,46 @@ class AbstractFilter:
         if self.state == FILTER_WAITING:
             raise FilterException("Waiting filter cannot be read")
         self.state = FILTER_FLUSHED
+        if self.tracer != None:
+            self.tracer.trace(self,"read",self.efficiency)
     def reset(self):
         """ Remet à zéro le filtre, son buffer est vidé et son état interne est
             remis tel qu'il était à la création du filtre. """
+        if self.stats != None and self.state in (FILTER_WAITING,FILTER_PASS):
+            self.stats.resets += 1
+            self.stats.waitingSince = None
+        if self.tracer != None and self.state != FILTER_EMPTY:
+            self.tracer.trace(self,"reset",FILTER_STATES[self.state])
         self.state = FILTER_EMPTY
-        self.buffer = ""
+        self.buffer = bytearray()
         self.buffsize = 0
-    
+    def enableStats(self,enabled=True):
+        """ Active (remet à zéro) ou désactive les compteurs d'activité du
+            filtre (voir FilterStats). """
+        if enabled:
+            self.stats = FilterStats()
+        else:
+            self.stats = None
+    def setTracer(self,tracer):
+        """ Installe le traceur tracer (None pour le désactiver) sur le
+            filtre. Les événements émis sont "block" (états avant et après
+            l'appel de writeBlock() et nombre de caractères consommés),
+            "read" (efficacité du message lu), "reset" (état quitté, sauf
+            pour un filtre vide) et "exception". """
+        self.tracer = tracer
+    def snapshotStats(self,name=None):
+        """ Retourne la liste des couples (nom, compteurs) du filtre et des
+            filtres qu'il contient, les compteurs étant une copie sous forme
+            de dictionnaire (voir FilterStats.snapshot()). Les noms sont
+            formés du nom de classe de chaque filtre préfixé par sa position
+            dans le groupe parent. Les filtres dont les compteurs sont
+            désactivés sont omis. """
+        if name == None:
+            name = self.__class__.__name__
+        if self.stats == None:
+            return []
+        return [(name,self.stats.snapshot())]
+
 class AbstractFilterGroup(AbstractFilter):
     """ Classe abstraite représentant un groupe de filtres devant être traités
         de manière cohérente. """
@@ -85,6 +297,27 @@ class AbstractFilterGroup(AbstractFilter):
         AbstractFilter.reset(self)
         for f in self.filters:
             f.reset()
+    def enableStats(self,enabled=True):
+        """ Active ou désactive les compteurs du groupe et de tous ses
+            filtres internes. """
+        AbstractFilter.enableStats(self,enabled)
+        for f in self.filters:
+            f.enableStats(enabled)
+    def setTracer(self,tracer):
+        """ Installe le traceur sur le groupe et ses filtres internes. """
+        AbstractFilter.setTracer(self,tracer)
+        for f in self.filters:
+            f.setTracer(tracer)
+    def snapshotStats(self,name=None):
+        """ Voir AbstractFilter.snapshotStats(), les filtres internes suivent
+            le groupe. """
+        if name == None:
+            name = self.__class__.__name__
+        result = AbstractFilter.snapshotStats(self,name)
+        for i in xrange(len(self.filters)):
+            f = self.filters[i]
+            result += f.snapshotStats("%s/%d:%s" % (name,i,f.__class__.__name__))
+        return result
 
 class AbstractTerminalFilter(AbstractFilter):
     """ Classe abstraite pour les filtres terminaux. Les filtres terminaux sont
@@ -98,6 +331,10 @@ class AbstractTerminalFilterIn(AbstractTerminalFilter):
     def __init__(self,reader):
         AbstractTerminalFilter.__init__(self)
         self.reader = reader
+    def setTracer(self,tracer):
+        """ Installe le traceur sur le filtre et sur son reader. """
+        AbstractTerminalFilter.setTracer(self,tracer)
+        setTracer(self.reader,tracer)
 
 class AbstractTerminalFilterOut(AbstractTerminalFilter):
     """ Classe abstraite pour les filtres terminaux de sortie, c'est à dire les
@@ -105,6 +342,25 @@ class AbstractTerminalFilterOut(AbstractTerminalFilter):
     def __init__(self,writer):
         AbstractTerminalFilter.__init__(self)
         self.writer = writer
+    def setTracer(self,tracer):
+        """ Installe le traceur sur le filtre et sur son writer. """
+        AbstractTerminalFilter.setTracer(self,tracer)
+        setTracer(self.writer,tracer)
+
+def filterBlock(f,buf,out):
+    """ Fait traverser tout le bloc buf au filtre f à l'aide de
+        AbstractFilter.writeBlock(). Les segments de sortie sont ajoutés au
+        bytearray out. Retourne l'état du filtre après le dernier
+        caractère. """
+    state = f.state
+    i = 0
+    n = len(buf)
+    while i < n:
+        k,state,l = f.writeBlock(buf,i)
+        i += k
+        for s in l:
+            out += s
+    return state
 
 class SerialFilterGroup(AbstractFilterGroup):
     """ Groupe de filtres dont le traitement doit être effectué en série. """
@@ -119,33 +375,64 @@ class SerialFilterGroup(AbstractFilterGroup):
             traitement (FILTER_WAITING), le groupe sera aussi considéré en cours
             de traitement (on doit attendre la fin du traitement). """
         AbstractFilterGroup.write(self,c)
-        #sys.stdout.write(c)
-        buffer_in = c
-        buffer_out = ""
-        for i in range(self.filters_number):
-            for x in buffer_in:
-                # si le filtre est passant, on transfert le buffer dans le
-                # filtre suivant
-                if self.filters[i].write(x) == FILTER_PASS:
-                    buffer_out += self.filters[i].read()
-                    # on fait un reset sur le filtre
-                    self.filters[i].reset()
-            buffer_in = buffer_out
-            buffer_out = ""
-        # On copie le dernier buffer dans le buffer du filtre
-        self.buffer += buffer_in
-        # Calcul de l'état final (le filtre est en état d'attente ssi un de
-        # ses filtre l'est)
+        # le caractère traverse les filtres comme un bloc d'un caractère, les
+        # sorties sont retenues dans le buffer du groupe jusqu'à ce qu'aucun
+        # filtre ne soit en attente
+        k,x,outputs = self.writeBlock(c)
+        if x == FILTER_WAITING:
+            return self.state
+        for s in outputs:
+            self.buffer += s
         self.state = FILTER_PASS
-        for f in self.filters:
-            if f.state == FILTER_WAITING:
-                self.state = FILTER_WAITING
-                return self.state
         return self.state
+    def processBlock(self,buf,start):
+        """ Traite un bloc de caractères à l'entrée du groupe de filtres
+            série (voir AbstractFilter.writeBlock()). Chaque segment produit
+            par un filtre est transmis en bloc au filtre suivant. Les sorties
+            du dernier filtre sont retenues dans le buffer du groupe tant
+            qu'un de ses filtres est en attente (point de passage du
+            groupe). """
+        if self.state == FILTER_FLUSHED:
+            raise FilterException("Filter must be reset")
+        if self.state == FILTER_PASS:
+            raise FilterException("Filter is in pass state and must be read")
+        if not self.filters:
+            return (len(buf)-start,FILTER_EMPTY,[buf[start:]])
+        i = start
+        n = len(buf)
+        while i < n:
+            k,x,outputs = self.filters[0].writeBlock(buf,i)
+            i += k
+            # les sorties d'un filtre sont accumulées dans un bytearray et
+            # transmises d'un bloc au filtre suivant
+            for f in self.filters[1:]:
+                buffer_out = bytearray()
+                for s in outputs:
+                    filterBlock(f,s,buffer_out)
+                outputs = [buffer_out]
+            for s in outputs:
+                self.buffer += s
+            if len(self.buffer) > MAX_SIZE_BUFFER:
+                raise FilterException("Filter is full")
+            for f in self.filters:
+                if f.state == FILTER_WAITING:
+                    self.state = FILTER_WAITING
+                    break
+            else:
+                # aucun filtre en attente : point de passage du groupe
+                s = self.buffer
+                self.buffer = bytearray()
+                self.state = FILTER_EMPTY
+                if self.stats != None:
+                    self.stats.messages += 1
+                if s:
+                    return (i-start,FILTER_EMPTY,[s])
+                return (i-start,FILTER_EMPTY,[])
+        return (i-start,self.state,[])
     def read(self):
         """ Lit le buffer résultat du groupe de filtres """
         AbstractFilterGroup.read(self)
-        return self.buffer
+        return str(self.buffer)
 
 class NullTerminalFilter(AbstractTerminalFilter):
     """ Filtre toujours passant et qui ne fait aucun traitement."""
@@ -156,9 +443,11 @@ class NullTerminalFilter(AbstractTerminalFilter):
         self.buffer += c
         self.state = FILTER_PASS
         return self.state
+    def skip(self,buf,start):
+        return len(buf)
     def read(self):
         AbstractTerminalFilter.read(self)
-        return self.buffer
+        return str(self.buffer)
 
 # manipulation des flux d'octets
 
@@ -181,47 +470,173 @@ class StdOutWriter(AbstractWriter):
         """ Ecrit le caractère c dans la sortie standard. """
         sys.stdout.write(c)
 
+""" Taille initiale (en octets) du tableau circulaire d'un FIFOBuffer. """
+FIFO_INITIAL_SIZE = 4096
+""" Durée maximale (en secondes) d'une attente d'un SynchronizedFIFOBuffer
+    plein avant de vérifier à nouveau son état. """
+FIFO_WAIT_SLICE = 1.0
+
 class FIFOBuffer(AbstractReader,AbstractWriter):
     """ Buffer de type FIFO permettant de lire et d'écrire des caractères
-        (octets), la capacité de ce buffer s'ajuste autoamtiquement. """
-    def __init__(self,s=""):
+        (octets), la capacité de ce buffer s'ajuste autoamtiquement.
+        Les caractères sont stockés dans un tableau circulaire (bytearray)
+        dont la taille double lorsqu'il est plein : une lecture ne recopie
+        que les caractères lus. highWater est le nombre de caractères
+        au-delà duquel le buffer est considéré plein (voir isFull()), None
+        pour un buffer non borné. """
+    def __init__(self,s="",highWater=None):
         """ Crée un nouveau buffer de caractères à l'aide d'une chaîne. Par
-            défaut, le buffer sera vide. """
-        self.buffer = s
+            défaut, le buffer sera vide et non borné. """
+        self.highWater = highWater
+        size = FIFO_INITIAL_SIZE
+        while size < len(s):
+            size <<= 1
+        self.buffer = bytearray(size)
+        # position du premier caractère et nombre de caractères de la file
+        self.start = 0
+        self.size = 0
+        self.write(s)
     def read(self,n):
         """ Lit une chaîne de caractères de la file d'au maximum la taille
             spécifiée. """
-        if n == 0:
+        n = min(n,self.size)
+        if n <= 0:
             return ""
-        s = self.buffer[:n]
-        self.buffer = self.buffer[n:]
+        end = self.start+n
+        if end <= len(self.buffer):
+            s = str(self.buffer[self.start:end])
+        else:
+            s = str(self.buffer[self.start:])+str(self.buffer[:end-len(self.buffer)])
+        self.size -= n
+        if self.size:
+            self.start = end % len(self.buffer)
+        else:
+            self.start = 0
         return s
     def write(self,c):
         """ Ajoute un caractère ou une chaîne dans la file. """
-        if c:
-            self.buffer += c
+        n = len(c)
+        if not n:
+            return
+        if self.size+n > len(self.buffer):
+            self.grow(self.size+n)
+        size = len(self.buffer)
+        end = (self.start+self.size) % size
+        # copie en deux morceaux si la fin du tableau est atteinte
+        k = min(n,size-end)
+        if k == n:
+            self.buffer[end:end+n] = c
+        else:
+            self.buffer[end:size] = c[:k]
+            self.buffer[:n-k] = c[k:]
+        self.size += n
+    def grow(self,n):
+        """ Agrandit le tableau circulaire pour qu'il puisse contenir n
+            caractères. Le contenu est recopié au début du nouveau
+            tableau. """
+        size = len(self.buffer)
+        while size < n:
+            size <<= 1
+        data = FIFOBuffer.getBuffer(self)
+        self.buffer = bytearray(size)
+        self.buffer[:len(data)] = data
+        self.start = 0
+    def isFull(self):
+        """ Retourne True si le nombre de caractères de la file a atteint
+            highWater. """
+        return self.highWater != None and self.size >= self.highWater
     def sizeOfData(self):
         """ Retourne le nombre de caractères (octets) dans le buffer. """
-        return len(self.buffer)
+        return self.size
     def getBuffer(self):
         """ Retourne le contenu actuel du buffer. """
-        return self.buffer
+        end = self.start+self.size
+        if end <= len(self.buffer):
+            return str(self.buffer[self.start:end])
+        return str(self.buffer[self.start:])+str(self.buffer[:end-len(self.buffer)])
 
 class SynchronizedFIFOBuffer(FIFOBuffer):
     """ Buffer fifo pouvant fonctionner de manière asynchrone avec l'utilisation
-        de threads. Les méthodes read et write sont protégées par mutex. """
-    def __init__(self,s=""):
-        FIFOBuffer.__init__(self,s)
+        de threads. Les méthodes read et write sont protégées par mutex.
+        Si highWater est donné, write() bloque le producteur tant que le
+        buffer est plein : la mémoire utilisée reste bornée quel que soit le
+        retard du consommateur. Un lecteur peut de même attendre l'arrivée
+        de données (voir read()). Les threads en attente ne sont réveillés
+        que lorsqu'un seuil est franchi (buffer vide puis non vide, plein
+        puis non plein). """
+    def __init__(self,s="",highWater=None):
         self.lock = threading.Lock()
-    def read(self,n):
+        # signalé lorsque le buffer repasse sous highWater
+        self.notFull = threading.Condition(self.lock)
+        # signalé lorsque des données arrivent dans un buffer vide
+        self.notEmpty = threading.Condition(self.lock)
+        # nombre de threads en attente de place et de données
+        self.writers = 0
+        self.readers = 0
+        FIFOBuffer.__init__(self,s,highWater)
+    def waitFor(self,condition,ready,timeout):
+        """ Attend (le verrou étant pris) que la fonction ready retourne
+            True, au plus timeout secondes (None : sans limite). L'attente
+            se fait par tranches de FIFO_WAIT_SLICE secondes pour rester
+            interruptible. Retourne le dernier résultat de ready(). """
+        if timeout != None:
+            end = time.time()+timeout
+        while not ready():
+            wait = FIFO_WAIT_SLICE
+            if timeout != None:
+                wait = min(wait,end-time.time())
+                if wait <= 0:
+                    return False
+            condition.wait(wait)
+        return True
+    def read(self,n,timeout=0):
+        """ Lit une chaîne de caractères de la file d'au maximum la taille
+            spécifiée. Si la file est vide, attend l'arrivée de données au
+            plus timeout secondes (None : sans limite). Par défaut la lecture
+            n'est pas bloquante : le PacketReader complète lui-même les
+            paquets manquants. """
         self.lock.acquire()
-        s = FIFOBuffer.read(self,n)
-        self.lock.release()
+        try:
+            if not self.size and timeout != 0:
+                self.readers += 1
+                try:
+                    self.waitFor(self.notEmpty,lambda: self.size > 0,timeout)
+                finally:
+                    self.readers -= 1
+            full = self.isFull()
+            s = FIFOBuffer.read(self,n)
+            if full and self.writers and not self.isFull():
+                self.notFull.notifyAll()
+        finally:
+            self.lock.release()
         return s
-    def write(self,c):
+    def write(self,c,timeout=None):
+        """ Ajoute un caractère ou une chaîne dans la file. Si la file est
+            pleine, attend qu'un lecteur la vide (au plus timeout secondes si
+            timeout n'est pas None). Retourne False si la file est toujours
+            pleine après le délai (rien n'est écrit), True sinon. """
+        return self.writeMany((c,),timeout)
+    def writeMany(self,chunks,timeout=None):
+        """ Ajoute plusieurs chaînes dans la file en ne prenant le verrou
+            qu'une fois (voir write()). Toutes les chaînes sont écrites dès
+            que la file n'est plus pleine. """
         self.lock.acquire()
-        FIFOBuffer.write(self,c)
-        self.lock.release()
+        try:
+            if self.isFull():
+                self.writers += 1
+                try:
+                    if not self.waitFor(self.notFull,lambda: not self.isFull(),timeout):
+                        return False
+                finally:
+                    self.writers -= 1
+            empty = not self.size
+            for c in chunks:
+                FIFOBuffer.write(self,c)
+            if empty and self.size and self.readers:
+                self.notEmpty.notifyAll()
+            return True
+        finally:
+            self.lock.release()
     def sizeOfData(self):
         self.lock.acquire()
         x = FIFOBuffer.sizeOfData(self)
@@ -253,6 +668,37 @@ PACKET_CHAR_MASK = 0x0ff
 PACKET_SIZE = 9
 PACKET_MASK = 0x1ff
 
+# Codage par blocs : une suite de paquets est manipulée sous forme d'un seul
+# entier (le premier paquet occupe les bits de poids fort). La conversion
+# passe par l'écriture binaire de cet entier (int(s,2) et bin()), chaque
+# caractère correspondant à 9 chiffres binaires : les boucles sont faites
+# par map(), str.join() et re.findall() et non octet par octet.
+
+# chiffres binaires du paquet de chaque caractère et caractère (ou chaîne
+# vide pour les paquets vides) de chaque paquet
+PACKET_DIGITS = dict((chr(c),"0"+"".join([str((c >> i) & 1) for i in range(7,-1,-1)])) for c in range(256))
+PACKET_CHARS = dict((v,k) for k,v in PACKET_DIGITS.iteritems())
+for c in range(PACKET_EMPTY,PACKET_MASK+1):
+    PACKET_CHARS["1"+PACKET_DIGITS[chr(c & PACKET_CHAR_MASK)][1:]] = ""
+EMPTY_PACKET_DIGITS = PACKET_DIGITS[chr(0)].replace("0","1",1)
+PACKET_SPLIT = re.compile("."*PACKET_SIZE)
+
+def encodePackets(s,n):
+    """ Retourne l'entier formé des n paquets codant les caractères de la
+        chaîne s (len(s) <= n), complétés par des paquets vides. """
+    if not n:
+        return 0
+    return int("".join(map(PACKET_DIGITS.__getitem__,s))+EMPTY_PACKET_DIGITS*(n-len(s)),2)
+
+def decodePackets(x,n):
+    """ Retourne la chaîne des caractères codés par les n paquets de l'entier
+        x (seuls ses n*PACKET_SIZE bits de poids faible sont lus), les
+        paquets vides étant ignorés. """
+    if not n:
+        return ""
+    bits = bin(x & ((1 << (n*PACKET_SIZE))-1))[2:].zfill(n*PACKET_SIZE)
+    return "".join(map(PACKET_CHARS.__getitem__,PACKET_SPLIT.findall(bits)))
+
 class PacketReader:
     """ Encapsule un caractère ASCII (8bits) dans un entier de 9 bits (paquet).
         Ceci permet d'insérer des codes particuliers :
@@ -267,12 +713,13 @@ class PacketReader:
             attaché ne peut fournir autant de caractères 8 bits, des
             paquets codant des caractères vides seront ajoutés. """
         buffer = self.reader.read(n)
-        result = []
-        for c in buffer:
-            result.append(ord(c))
-        for _ in range(n - len(result)):
-            result.append(PACKET_EMPTY)
+        result = map(ord,buffer)
+        result.extend([PACKET_EMPTY]*(n-len(result)))
         return result
+    def readPackets(self,n):
+        """ Lit n paquets sur le flux et les retourne sous forme d'un seul
+            entier (voir encodePackets()). """
+        return encodePackets(self.reader.read(n),n)
 
 class PacketWriter:
     """ Décode les paquets générés par un packet reader et écrit le flux de
@@ -283,11 +730,11 @@ class PacketWriter:
         self.writer = writer
     def write(self,p):
         """ Ecrit une chaîne de paquets dans le flux. """
-        buffer = ""
-        for c in p:
-            if not (c & PACKET_EMPTY):
-                buffer += chr(c)
-        self.writer.write(buffer)
+        self.writer.write("".join([chr(c) for c in p if not (c & PACKET_EMPTY)]))
+    def writePackets(self,x,n):
+        """ Ecrit dans le flux les n paquets de l'entier x (voir
+            decodePackets()). """
+        self.writer.write(decodePackets(x,n))
 
 # Classes pour la gestion de la couche "physique" binaire du flux stéganographié
 
@@ -314,15 +761,18 @@ class BinaryReader:
                 n -= self.remain
         # nombre de paquets de 9 bits à lire
         nb,r = divmod(n,PACKET_SIZE)
+        # les paquets complets et le dernier paquet incomplet éventuel sont
+        # lus d'un bloc
+        x = self.packetreader.readPackets(nb+(r > 0))
+        if r:
+            self.last = x & PACKET_MASK
+            x >>= PACKET_SIZE
         if nb:
-            packets = self.packetreader.read(nb)
-            for p in packets:
-                result <<= PACKET_SIZE
-                result |= p
-                n -= PACKET_SIZE
+            result <<= nb*PACKET_SIZE
+            result |= x
+            n -= nb*PACKET_SIZE
             self.remain = 0
         if r:
-            self.last = self.packetreader.read(1)[0]
             # traitment du dernier paquet incomplet (si c'est le cas)
             result <<= r
             result |= (self.last >> (PACKET_SIZE - r))
@@ -344,7 +794,6 @@ class BinaryWriter:
     def write(self,n,m):
         """ Ecrit m bits de données issus de l'entier n. (m correspond aux
             nombre de bits à partir du bit de poids faible). """
-        l = []
         r = PACKET_SIZE - self.remain
         if r > m:
             # on ne peut pas compléter un paquet entier mais on ajoute
@@ -353,16 +802,13 @@ class BinaryWriter:
             self.current |= n
             self.remain += m
             return
-        # on peut compléter un paquet entier
+        # on peut compléter un paquet entier, suivi éventuellement d'autres
+        # paquets entiers : ils sont écrits d'un bloc
         m -= r
-        self.current <<= r
-        self.current |= ((n >> m) & ((1 << r) - 1))
-        l.append(self.current)
-        self.remain = 0
-        while m >= PACKET_SIZE:
-            m -= PACKET_SIZE
-            l.append((n >> m) & PACKET_MASK)
-        self.packetwriter.write(l)
+        k,m = divmod(m,PACKET_SIZE)
+        nbits = r+k*PACKET_SIZE
+        x = (self.current << nbits) | ((n >> m) & ((1 << nbits) - 1))
+        self.packetwriter.writePackets(x,k+1)
         # calcul des bits restants
         self.remain = m
         self.current = n & ((1 << m) - 1)
@@ -374,60 +820,190 @@ class BinaryWriter:
         self.remain = 0
 
 
+""" Nombre de bits consommés au début d'un BitBuffer au-delà duquel les
+    octets correspondants sont effectivement supprimés. """
+BITBUFFER_COMPACT = 8192
+
+class BitBuffer:
+    """ File de bits stockée dans un bytearray : le premier bit de la file
+        est le bit de poids fort de son premier octet. L'ajout, la lecture
+        et la suppression de bits en tête de file coûtent un temps
+        proportionnel au nombre de bits manipulés, quelle que soit la taille
+        de la file. """
+    def __init__(self):
+        self.data = bytearray()
+        # positions (en bits dans data) du premier bit et du bit qui suit le
+        # dernier bit de la file
+        self.start = 0
+        self.end = 0
+    def __len__(self):
+        return self.end-self.start
+    def append(self,x,n):
+        """ Ajoute à la fin de la file les n bits de poids faible de
+            l'entier x (le bit de poids fort en premier). """
+        if n <= 0:
+            return
+        x &= (1 << n)-1
+        m = n
+        # le dernier octet partiellement utilisé est complété
+        r = self.end & 7
+        if r:
+            x |= (self.data[-1] >> (8-r)) << m
+            m += r
+            del self.data[-1]
+        pad = (-m) & 7
+        self.data += binascii.unhexlify("%0*x" % ((m+pad) >> 2,x << pad))
+        self.end += n
+    def get(self,pos,n):
+        """ Retourne sous forme d'entier les n bits de la file qui suivent
+            les pos premiers bits. """
+        if n <= 0:
+            return 0
+        p = self.start+pos
+        first = p >> 3
+        last = (p+n+7) >> 3
+        x = int(binascii.hexlify(self.data[first:last]),16)
+        return (x >> ((last << 3)-p-n)) & ((1 << n)-1)
+    def discard(self,n):
+        """ Supprime les n premiers bits de la file. """
+        self.start = min(self.start+n,self.end)
+        # les octets libérés en tête ne sont supprimés que lorsqu'ils
+        # représentent au moins la moitié du tableau (coût amorti constant)
+        if self.start >= BITBUFFER_COMPACT and 2*self.start >= self.end:
+            k = self.start >> 3
+            del self.data[:k]
+            self.start -= k << 3
+            self.end -= k << 3
+    def truncate(self,n):
+        """ Ne conserve que les n premiers bits de la file. """
+        self.end = min(self.end,self.start+n)
+        del self.data[(self.end+7) >> 3:]
+    def clear(self):
+        """ Vide la file. """
+        self.data = bytearray()
+        self.start = 0
+        self.end = 0
+
 class BinaryTransactionReader:
     """ Permet de stocker des transactions de flux binaires similaires aux
         transactions de bases de données. Il est possible de faire un commit()
         pour confirmer que le flux a été transmis ou un rollback pour
-        restaurer le flux en cas de problème. """
+        restaurer le flux en cas de problème. Des points de sauvegarde
+        (savepoint()) permettent d'annuler seulement la fin d'une
+        transaction. Les bits de la transaction sont stockés dans un
+        BitBuffer : une lecture ne coûte que le nombre de bits lus, quelle
+        que soit la taille de la transaction en cours. """
+    tracer = None
     def __init__(self,binaryreader):
         """ Initialise un nouvel objet à l'aide d'un binary reader."""
-        self.buffer = 0
-        self.nbuffer = 0
+        self.bits = BitBuffer()
         self.binaryreader = binaryreader
+        # nombre de bits lus depuis le début de la transaction
         self.pos = 0
+        # positions des points de sauvegarde (du plus ancien au plus récent)
+        self.savepoints = []
     def read(self,n):
-        if (self.pos + n) > self.nbuffer:
+        if (self.pos + n) > len(self.bits):
             # pas assez de données, on en redemande au binary reader
-            nb = self.pos + n - self.nbuffer
-            x = self.binaryreader.read(nb)
-            self.buffer <<= nb
-            self.buffer |= x
-            self.nbuffer = n + self.pos
-        result = ((1 << n) - 1) & (self.buffer >> (self.nbuffer - self.pos - n))
+            nb = self.pos + n - len(self.bits)
+            self.bits.append(self.binaryreader.read(nb),nb)
+        result = self.bits.get(self.pos,n)
         self.pos += n
         return result
+    def setTracer(self,tracer):
+        """ Installe le traceur, qui recevra les événements "commit",
+            "rollback" (nombre de bits concernés), "savepoint" et
+            "rollbackTo" (numéro et position du point de sauvegarde). """
+        self.tracer = tracer
+        setTracer(self.binaryreader,tracer)
     def commit(self):
-        self.buffer = 0
-        self.nbuffer = 0
+        """ Confirme les bits lus depuis le début de la transaction. Les bits
+            lus puis annulés par un rollback() et pas encore relus restent
+            disponibles pour la transaction suivante. """
+        if self.tracer != None:
+            self.tracer.trace(self,"commit",self.pos)
+        self.bits.discard(self.pos)
         self.pos = 0
+        self.savepoints = []
     def rollback(self):
+        """ Annule la transaction : les prochaines lectures retourneront de
+            nouveau les bits lus depuis le dernier commit(). """
+        if self.tracer != None:
+            self.tracer.trace(self,"rollback",self.pos)
         self.pos = 0
+        self.savepoints = []
+    def savepoint(self):
+        """ Crée un point de sauvegarde à la position courante de la
+            transaction et retourne son numéro (voir rollbackTo()). """
+        self.savepoints.append(self.pos)
+        if self.tracer != None:
+            self.tracer.trace(self,"savepoint",(len(self.savepoints)-1,self.pos))
+        return len(self.savepoints)-1
+    def rollbackTo(self,savepoint):
+        """ Annule les lectures faites depuis le point de sauvegarde donné.
+            Ce point est conservé, les points créés après lui sont
+            supprimés. """
+        self.pos = self.savepoints[savepoint]
+        del self.savepoints[savepoint+1:]
+        if self.tracer != None:
+            self.tracer.trace(self,"rollbackTo",(savepoint,self.pos))
+    def release(self,savepoint):
+        """ Supprime le point de sauvegarde donné et ceux créés après lui,
+            sans annuler de lecture. """
+        del self.savepoints[savepoint:]
 
 class BinaryTransactionWriter:
     """ Permet de stocker des transactions de flux binaire en écriture. Ceci
         permet de confirmer l'écriture d'un flux par un commit() ou d'annuler
-        l'écriture par un rollback. """
+        l'écriture par un rollback. Les points de sauvegarde fonctionnent
+        comme pour BinaryTransactionReader. """
+    tracer = None
     def __init__(self,binarywriter):
         """ Initialise un nouvel objet à l'aide d'un binary writer."""
-        self.buffer = 0
-        self.n = 0
+        self.bits = BitBuffer()
         self.binarywriter = binarywriter
+        self.savepoints = []
     def write(self,n,m):
-        x = n & ((1 << m) - 1)
-        self.buffer <<= m
-        self.buffer |= x
-        self.n += m
+        self.bits.append(n,m)
+    def setTracer(self,tracer):
+        """ Voir BinaryTransactionReader.setTracer(). """
+        self.tracer = tracer
+        setTracer(self.binarywriter,tracer)
     def commit(self):
-        self.binarywriter.write(self.buffer,self.n)
-        self.buffer = 0
-        self.n = 0
+        """ Ecrit d'un bloc les bits de la transaction dans le binary
+            writer. """
+        n = len(self.bits)
+        if self.tracer != None:
+            self.tracer.trace(self,"commit",n)
+        if n:
+            self.binarywriter.write(self.bits.get(0,n),n)
+        self.bits.clear()
+        self.savepoints = []
     def rollback(self):
-        self.buffer = 0
-        self.n = 0
+        if self.tracer != None:
+            self.tracer.trace(self,"rollback",len(self.bits))
+        self.bits.clear()
+        self.savepoints = []
+    def savepoint(self):
+        """ Voir BinaryTransactionReader.savepoint(). """
+        self.savepoints.append(len(self.bits))
+        if self.tracer != None:
+            self.tracer.trace(self,"savepoint",(len(self.savepoints)-1,len(self.bits)))
+        return len(self.savepoints)-1
+    def rollbackTo(self,savepoint):
+        """ Voir BinaryTransactionReader.rollbackTo(). """
+        self.bits.truncate(self.savepoints[savepoint])
+        del self.savepoints[savepoint+1:]
+        if self.tracer != None:
+            self.tracer.trace(self,"rollbackTo",(savepoint,len(self.bits)))
+    def release(self,savepoint):
+        """ Voir BinaryTransactionReader.release(). """
+        del self.savepoints[savepoint:]
 
 
 class BinaryAuthenticateReader:
     """ Permet d'envoyer le code d'authentification du flux """
+    tracer = None
     def __init__(self,binaryreader,password):
         """ Nouvelle instance construite avec un binary reader et un mot de
             passe qui sera envoyé pour l'authentification."""
@@ -462,10 +1038,19 @@ class BinaryAuthenticateReader:
         result <<= (n - self.ncurrentpassword)
         result |= x
         self.authenticated = True
+        if self.tracer != None:
+            self.tracer.trace(self,"authenticated")
         return result
+    def setTracer(self,tracer):
+        """ Installe le traceur, qui recevra les événements "authenticated"
+            (mot de passe entièrement envoyé) et "reset". """
+        self.tracer = tracer
+        setTracer(self.binaryreader,tracer)
     def reset(self):
         """ Remise à zéro, le mot de passe sera de nouveau inséré aux prochains
             appels de la méthode read(). """
+        if self.tracer != None:
+            self.tracer.trace(self,"reset")
         self.authenticated = False
         self.currentpassword = self.password
         self.ncurrentpassword = self.npassword
@@ -476,6 +1061,9 @@ class BinaryAuthenticateWriter:
     AUTHENTICATED = 0
     FAILED = 1
     WAITING = 2
+    # noms des états (utilisés par les traces)
+    STATES = ["AUTHENTICATED","FAILED","WAITING"]
+    tracer = None
     def __init__(self,binarywriter,password,callback=None,nofail=False):
         """ Nouvelle instance construite avec un binary writer et un mot de
             passe qui permettra d'authentifier le flux entrant.
@@ -513,12 +1101,12 @@ class BinaryAuthenticateWriter:
                     if self.nofail:
                         self.reset()
                     else:
-                        self.state = self.FAILED
+                        self.setState(self.FAILED)
                         if self.callback != None:
                             self.callback(False)
                     return
                 if m == self.ncurrentpassword:
-                    self.state = self.AUTHENTICATED
+                    self.setState(self.AUTHENTICATED)
                     if self.callback != None:
                         self.callback(True)
                     return
@@ -526,20 +1114,30 @@ class BinaryAuthenticateWriter:
                 self.currentpassword &= ((1 << self.ncurrentpassword) - 1)
                 return
             if (n >> (m - self.ncurrentpassword)) != self.currentpassword:
-                self.state = self.FAILED
+                self.setState(self.FAILED)
                 if self.nofail:
                     self.reset()
                 else:
-                    self.state = self.FAILED
+                    self.setState(self.FAILED)
                     if self.callback != None:
                         self.callback(False)
                 return
-            self.state = self.AUTHENTICATED
+            self.setState(self.AUTHENTICATED)
             if self.callback != None:
                 self.callback(True)
             self.binarywriter.write(n & ((1 << (m - self.ncurrentpassword)) - 1),m - self.ncurrentpassword)
+    def setState(self,state):
+        """ Change l'état de l'authentification. """
+        if self.tracer != None and state != self.state:
+            self.tracer.trace(self,"state",(self.STATES[self.state],self.STATES[state]))
+        self.state = state
+    def setTracer(self,tracer):
+        """ Installe le traceur, qui recevra les changements d'état de
+            l'authentification (événement "state"). """
+        self.tracer = tracer
+        setTracer(self.binarywriter,tracer)
     def reset(self):
-        self.state = self.WAITING
+        self.setState(self.WAITING)
         self.currentpassword = self.password
         self.ncurrentpassword = self.npassword
 
@@ -555,6 +1153,8 @@ class BinaryOnOffReader:
         self.binaryreader = binaryreader
         self.enable = False
         self.random = randomdata
+    def setTracer(self,tracer):
+        setTracer(self.binaryreader,tracer)
     def setEnable(self,b):
         self.enable = b
     def read(self,n):
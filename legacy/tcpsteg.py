@@ -4,6 +4,7 @@
 
 from customfilters import *
 
+import os
 import time
 import socket
 import threading
@@ -12,6 +13,12 @@ import select
 import signal
 import subprocess
 
+# nombre d'octets en attente d'être stéganographiés au-delà duquel la lecture
+# de l'entrée (stdin ou processus fils) est suspendue
+FIFO_HIGH_WATER = 65536
+# nombre maximal d'octets lus d'un coup sur l'entrée
+PIPE_READ_SIZE = 4096
+
 class SocketThread(threading.Thread):
     """ Une thread qui s'occupe des opérations I/O sur les deux sockets du
         client et du serveur. """
@@ -29,6 +36,11 @@ class SocketThread(threading.Thread):
         self.connectEvent = connectEvent
         self.sendEvent = sendEvent
         self.filterEvent = filterEvent
+        # en mode verbeux, les compteurs des filtres sont affichés à la fin
+        # de chaque connexion
+        if self.verb:
+            self.filterin.enableStats()
+            self.filterout.enableStats()
     def run(self):
         try:
             try:
@@ -75,19 +87,23 @@ class SocketThread(threading.Thread):
                                                     sockout.shutdown(socket.SHUT_WR)
                                             else:
                                                 try:
-                                                    fdata = ""
-                                                    for c in data:
-                                                        # filtre passant
-                                                        x = self.filterin.write(c)
-                                                        if x == FILTER_PASS:
-                                                            fdata = self.filterin.read()
+                                                    j = 0
+                                                    while j < len(data):
+                                                        # le filtre consomme le bloc jusqu'au
+                                                        # prochain point de passage
+                                                        n,x,outputs = self.filterin.writeBlock(data,j)
+                                                        j += n
+                                                        # filtre passant (il a été lu et remis à zéro)
+                                                        if x != FILTER_WAITING:
                                                             self.filterEvent(True)
-                                                            self.filterin.reset()
                                                             if not sockoutclosed:
-                                                                i = 0
-                                                                l = len(fdata)
-                                                                while i < l:
-                                                                    i += sockout.send(fdata[i:])
+                                                                # segments (chaînes ou bytearray) envoyés
+                                                                # sans être concaténés
+                                                                for fdata in outputs:
+                                                                    i = 0
+                                                                    l = len(fdata)
+                                                                    while i < l:
+                                                                        i += sockout.send(fdata[i:])
                                                                 # un bloc à été envoyé avec succès, on envoi donc un événement
                                                                 self.sendEvent(True)
                                                         # filtre en attente (on ne fait rien)
@@ -109,18 +125,18 @@ class SocketThread(threading.Thread):
                                                     sockin.shutdown(socket.SHUT_WR)
                                             else:
                                                 try:
-                                                    fdata = ""
-                                                    for c in data:
-                                                        x = self.filterout.write(c)
-                                                        if x == FILTER_PASS:
-                                                            fdata = self.filterout.read()
+                                                    j = 0
+                                                    while j < len(data):
+                                                        n,x,outputs = self.filterout.writeBlock(data,j)
+                                                        j += n
+                                                        if x != FILTER_WAITING:
                                                             self.filterEvent(False)
-                                                            self.filterout.reset()
                                                             if not sockinclosed:
-                                                                i = 0
-                                                                l = len(fdata)
-                                                                while i < l:
-                                                                    i += sockin.send(fdata[i:])
+                                                                for fdata in outputs:
+                                                                    i = 0
+                                                                    l = len(fdata)
+                                                                    while i < l:
+                                                                        i += sockin.send(fdata[i:])
                                                                 self.sendEvent(False)
                                                 except:
                                                     if not sockinclosed:
@@ -136,6 +152,9 @@ class SocketThread(threading.Thread):
                             if sockout != None:
                                 sockout.close()
                             self.connectEvent()
+                            if self.verb:
+                                printStats(self.filterin)
+                                printStats(self.filterout)
             except Exception, ex:
                     if self.verb : print >> sys.stderr, "Accept() failed : %s " % ex
         finally:
@@ -145,11 +164,43 @@ class SocketThread(threading.Thread):
     def stop(self):
         self.event.set()
 
+def printStats(filter):
+    """ Affiche sur la sortie d'erreur les compteurs d'activité (cumulés
+        depuis le lancement) de filter et des filtres qu'il contient. """
+    for name,stats in filter.snapshotStats():
+        print >> sys.stderr, "%s : in=%d out=%d messages=%d covert=%d bits waiting=%d bytes/%.3fs time=%.3fs resets=%d exceptions=%d" % (name,
+            stats["bytesIn"],stats["bytesOut"],stats["messages"],stats["covertBits"],
+            stats["waitingBytes"],stats["waitingTime"],stats["time"],stats["resets"],stats["exceptions"])
+
+def readInput(pipe):
+    """ Lit les octets disponibles (au plus PIPE_READ_SIZE) sur le tube pipe.
+        La lecture se fait directement sur le descripteur : elle retourne dès
+        que des données sont disponibles, sans attendre que le bloc soit
+        complet. Retourne une chaîne vide à la fin du flux ou si la lecture
+        a été interrompue (signal). """
+    try:
+        return os.read(pipe.fileno(),PIPE_READ_SIZE)
+    except OSError:
+        return ""
+
 # rattrapage des signaux
 def sigHandler(signum, frame):
     print >> sys.stderr, "\r\nCtrl-C : Exiting..."
 
-def client(bindhost,bindport,remotehost,remoteport,verb,command,password):
+def installTracer(filters):
+    """ Installe un RingBufferTracer sur les piles de filtres données. Les
+        derniers événements sont affichés sur la sortie d'erreur à la
+        réception du signal SIGUSR1 (s'il existe sur le système). """
+    tracer = RingBufferTracer()
+    for f in filters:
+        f.setTracer(tracer)
+    if hasattr(signal,"SIGUSR1"):
+        def dumpHandler(signum,frame):
+            tracer.dump(sys.stderr)
+        signal.signal(signal.SIGUSR1,dumpHandler)
+    return tracer
+
+def client(bindhost,bindport,remotehost,remoteport,verb,command,password,trace=False,fractional=False):
     if verb : print >> sys.stderr, "Starting TCPSteg client..."
     # redirection des signaux vers le handler
     signal.signal(signal.SIGINT,sigHandler)
@@ -161,8 +212,9 @@ def client(bindhost,bindport,remotehost,remoteport,verb,command,password):
             sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
             sock.bind((bindhost,bindport))
             sock.listen(1)
-            # préparation de la thread d'écoute
-            fifo = SynchronizedFIFOBuffer()
+            # préparation de la thread d'écoute (la file bloque le producteur
+            # lorsque le canal caché prend du retard)
+            fifo = SynchronizedFIFOBuffer(highWater=FIFO_HIGH_WATER)
             # ouverture du processus fils éventuel
             if command != None:
                 cmdline = command.split()
@@ -177,11 +229,11 @@ def client(bindhost,bindport,remotehost,remoteport,verb,command,password):
             # encodage des données
             transacin = BinaryTransactionReader(BinaryReader(PacketReader(fifo)))
             authentin = BinaryAuthenticateReader(transacin,password)
-            filterin = HTTPHeaderPermutFilterIn(authentin)
+            filterin = HTTPHeaderPermutFilterIn(authentin,fractional)
             # décodage des données
             transacout = BinaryTransactionWriter(BinaryWriter(PacketWriter(PipeWriter(pipein))))
             authentout = BinaryAuthenticateWriter(transacout,password,nofail=True)
-            filterout = SerialFilterGroup([HTTPDataExtractorFilter(HTMLTagsPermutFilterOut(authentout)),HTTPHeaderPermutFilterOut(authentout)])
+            filterout = HTTPFilterGroup([HTTPDataExtractorFilter(HTMLTagsPermutFilterOut(authentout,fractional)),HTTPHeaderPermutFilterOut(authentout,fractional)])
             # on définit une fonction qui s'occupe de toute remetre à zéro lorsque la
             # connexion TCP est coupée
             def globalReset():
@@ -203,14 +255,16 @@ def client(bindhost,bindport,remotehost,remoteport,verb,command,password):
             def commitWriteEvent(b):
                 if not b:
                     transacout.commit()
+            if trace:
+                installTracer([filterin,filterout])
             thread = SocketThread(sock,remotehost,remoteport,filterin,filterout,verb,globalReset,commitReadEvent,commitWriteEvent)
             if verb : print >> sys.stderr, "Starting listening thread..."
             thread.start()
             # boucle d'attente sur stdin
             while True:
-                # lecture caractère par caractère (non bufferisée) pour éviter
-                # les bloquages
-                data = pipeout.read(1)
+                # lecture par blocs non bufferisée : les octets sont transmis
+                # dès leur arrivée (un verrou par bloc et non par octet)
+                data = readInput(pipeout)
                 # si aucune donnée n'a été lue, la fonction read() a forcément
                 # été interrompue (pas un signal), dans ce cas on quitte la boucle
                 if not data:
@@ -230,7 +284,7 @@ def client(bindhost,bindport,remotehost,remoteport,verb,command,password):
             sock.close()
 
 
-def server(bindhost,bindport,remotehost,remoteport,verb,command,password):
+def server(bindhost,bindport,remotehost,remoteport,verb,command,password,trace=False,fractional=False):
     # REM : le code du serveur est quasi identique à celui du client. Cela vient
     # de la nature symétrique du tunnel. Les principaux changements sont les
     # filtres
@@ -245,7 +299,7 @@ def server(bindhost,bindport,remotehost,remoteport,verb,command,password):
             sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
             sock.bind((bindhost,bindport))
             sock.listen(1)
-            fifo = SynchronizedFIFOBuffer()
+            fifo = SynchronizedFIFOBuffer(highWater=FIFO_HIGH_WATER)
             if command != None:
                 cmdline = command.split()
                 process = subprocess.Popen(cmdline,stdout=subprocess.PIPE,stdin=subprocess.PIPE,stderr=subprocess.STDOUT)
@@ -260,11 +314,11 @@ def server(bindhost,bindport,remotehost,remoteport,verb,command,password):
             transacin = BinaryTransactionReader(BinaryReader(PacketReader(fifo)))
             authentin = BinaryAuthenticateReader(transacin,password)
             onoffin = BinaryOnOffReader(authentin)
-            filterin = SerialFilterGroup([HTTPDataExtractorFilter(HTMLTagsPermutFilterIn(onoffin)),HTTPHeaderPermutFilterIn(onoffin)])
+            filterin = HTTPFilterGroup([HTTPDataExtractorFilter(HTMLTagsPermutFilterIn(onoffin,fractional)),HTTPHeaderPermutFilterIn(onoffin,fractional)])
             # décodage des données
             transacout = BinaryTransactionWriter(BinaryWriter(PacketWriter(PipeWriter(pipein))))
             authentout = BinaryAuthenticateWriter(transacout,password,onoffin.setEnable)
-            filterout = SerialFilterGroup([HTTPHeaderPermutFilterOut(authentout),HTTPHeaderHostChanger(remotehost+":"+str(remoteport))])
+            filterout = HTTPFilterGroup([HTTPHeaderPermutFilterOut(authentout,fractional),HTTPHeaderHostChanger(remotehost+":"+str(remoteport))])
             def globalReset():
                 authentin.reset()
                 authentout.reset()
@@ -278,11 +332,13 @@ def server(bindhost,bindport,remotehost,remoteport,verb,command,password):
             def commitWriteEvent(b):
                 if b:
                     transacout.commit()
+            if trace:
+                installTracer([filterin,filterout])
             thread = SocketThread(sock,remotehost,remoteport,filterout,filterin,verb,globalReset,commitReadEvent,commitWriteEvent)
             if verb : print >> sys.stderr, "Starting listening thread..."
             thread.start()
             while True:
-                data = pipeout.read(1)
+                data = readInput(pipeout)
                 if not data:
                     break
                 fifo.write(data)
@@ -307,6 +363,8 @@ def printdoc():
     print "[-c <command>]"
     print "[-p <password>]"
     print "[-v]"
+    print "[-t]"
+    print "[-f]"
     print "Start the tcpsteg client or server";
     print ""
     print "bindhost : name of the interface on which tcpsteg will be bound,"
@@ -320,6 +378,10 @@ def printdoc():
     print "               Typical use : '-c /bin/sh' or '-c cmd.exe'"
     print "               WARNING : the child process will have the same rights than tcpsteg !"
     print "-v : verbose mode (on stderr)"
+    print "-t : trace filters, authentication and transactions; the last events"
+    print "     are printed on stderr when tcpsteg receives SIGUSR1"
+    print "-f : fractional-bit coding of permutations (more bits per header or tag);"
+    print "     must be given to both the client and the server"
     print ""
     print "Examples of use :"
     print "tcpteg client 127.0.0.1 7777 172.16.1.1 hello 8888"
@@ -340,7 +402,7 @@ if __name__=='__main__':
 
     # chargement des arguments facultatifs de la ligne de commande
     # switchs et arguments attendus
-    sw = [("-c",1),("-v",0)]
+    sw = [("-c",1),("-v",0),("-t",0),("-f",0)]
     args = {}
     i = 0
     l = []
@@ -396,6 +458,9 @@ if __name__=='__main__':
     else:
         verb = False
         
+    trace = args.has_key("-t")
+    fractional = args.has_key("-f")
+
     if args.has_key("-c"):
         command = args["-c"][0]
     else:
@@ -404,8 +469,8 @@ if __name__=='__main__':
     # démarrage
     if isserver:
         # server
-        server(bindhost,bindport,remotehost,remoteport,verb,command,password)
+        server(bindhost,bindport,remotehost,remoteport,verb,command,password,trace,fractional)
     else:
         # client
-        client(bindhost,bindport,remotehost,remoteport,verb,command,password)
+        client(bindhost,bindport,remotehost,remoteport,verb,command,password,trace,fractional)
         
\ No newline at end of file
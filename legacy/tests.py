@@ -0,0 +1,1020 @@
+﻿#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Tests du moteur d'expressions régulières et des filtres.
+
+Usage : python tests.py
+
+Chaque résultat est comparé à une référence indépendante : le module re de
+python (reconnaissance complète d'un préfixe), une recherche exhaustive ou
+un modèle simple (chaîne de caractères ou de bits). Les chaînes sont
+tirées par des générateurs aléatoires à graine fixe.
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import itertools
+import unittest
+import StringIO
+import re as stdre
+
+from streamfilters import *
+from customfilters import readRank, writeRank, permutationBits
+from customfilters import REGEXP_HTML_TAG, HTML_TAG_GROUPS, HTMLTagExtract
+from customfilters import HTTPHeaderPermutFilterIn, HTTPHeaderPermutFilterOut
+from customfilters import HTMLTagsPermutFilterIn, HTMLTagsPermutFilterOut
+from customfilters import HTTPDataExtractorFilter, HTTPHeaderHostChanger
+from customfilters import BODY_CACHE_SIZE
+from customfilters import HTTPMessageParser, AbstractHTTPListener, HTTPFilterGroup
+from customfilters import HTTP_WAITING, HTTP_HEADERS, HTTP_END, HTTP_ERROR
+import stepregexp as re
+import tools
+
+# expressions testées : toute chaîne qui peut encore être reconnue l'est
+# après au plus EXTENSION caractères de ALPHABET
+PATTERNS = ["(ab|a)*c", "a[bc]+y", "x?y(a|aa)", "(a|b)*ab", "[^a]b+",
+            "a.c", "(a|bc)+", "(a*b)?c", "[a-c]x?y"]
+ALPHABET = "abcxy"
+EXTENSION = 3
+
+# expressions à groupes : leurs positions sont comparées à celles du module re
+CAPTURE_PATTERNS = ["(a|ab)(c|bcx)(x*)", "(a*)(b|abc)", "((a)|b)+", "(ab|a)*c",
+                    "x?(y)(a|aa)", "(a|b)*(ab)", "([^a])(b+)", "a(.)c",
+                    "((ab)|(a))((c)|(bc))"]
+
+def fullMatch(regexp,s):
+    """ Retourne True si l'expression regexp reconnait toute la chaîne s
+        (module re). """
+    return stdre.match("(?:"+regexp+r")\Z",s,stdre.DOTALL) != None
+
+def expectedStatus(regexp,s,cache):
+    """ Résultat attendu de Pattern.next() après le dernier caractère de s :
+        ACCEPT si regexp reconnait s, PASS si une extension de s la
+        reconnait, FAIL sinon. """
+    if s not in cache:
+        if fullMatch(regexp,s):
+            cache[s] = re.ACCEPT
+        else:
+            cache[s] = re.FAIL
+            for n in range(1,EXTENSION+1):
+                if any(fullMatch(regexp,s+"".join(w))
+                       for w in itertools.product(ALPHABET,repeat=n)):
+                    cache[s] = re.PASS
+                    break
+    return cache[s]
+
+def allStrings(n):
+    """ Toutes les chaînes de ALPHABET de longueur 1 à n. """
+    for k in range(1,n+1):
+        for w in itertools.product(ALPHABET,repeat=k):
+            yield "".join(w)
+
+def randomString(rnd,n,alphabet=ALPHABET):
+    return "".join(rnd.choice(alphabet) for i in range(rnd.randint(0,n)))
+
+def run(p,s):
+    """ Donne les caractères de s un à un à l'expression compilée p et
+        retourne la liste des résultats de next() (jusqu'au premier FAIL). """
+    p.reset()
+    result = []
+    for c in s:
+        result.append(p.next(c))
+        if result[-1] == re.FAIL:
+            break
+    return result
+
+def searchAll(regexp,s):
+    """ Recherche exhaustive des reconnaissances de regexp dans s : la plus à
+        gauche d'abord, la plus longue pour un même début, sans chevauchement
+        ni chaîne vide. """
+    result = []
+    pos = 0
+    while pos < len(s):
+        found = None
+        for start in range(pos,len(s)):
+            for end in range(len(s),start,-1):
+                if fullMatch(regexp,s[start:end]):
+                    found = (start,end)
+                    break
+            if found:
+                break
+        if not found:
+            break
+        result.append(found)
+        pos = found[1]
+    return result
+
+class BitSource:
+    """ Source de bits aléatoires qui mémorise les bits fournis. """
+    def __init__(self,seed):
+        self.rnd = random.Random(seed)
+        self.bits = ""
+    def read(self,n):
+        x = self.rnd.getrandbits(n) if n else 0
+        self.bits += bin(x)[2:].zfill(n) if n else ""
+        return x
+
+class BitSink:
+    """ Destination de bits mémorisés dans une chaîne de '0' et de '1'. """
+    def __init__(self):
+        self.bits = ""
+    def write(self,x,n):
+        self.bits += bin(x & ((1 << n)-1))[2:].zfill(n) if n else ""
+
+class BitString:
+    """ Source de bits lus dans une chaîne de '0' et de '1'. """
+    def __init__(self,bits):
+        self.bits = bits
+        self.pos = 0
+    def read(self,n):
+        s = self.bits[self.pos:self.pos+n]
+        self.pos += n
+        return int(s,2) if s else 0
+
+class RankTest(unittest.TestCase):
+    def testUnrank(self):
+        """ unrank() énumère les permutations dans l'ordre lexicographique. """
+        for n in range(7):
+            l = ["h%d" % i for i in range(n)]
+            for x,perm in enumerate(itertools.permutations(l)):
+                self.assertEqual(tools.unrank(x,l),list(perm))
+                self.assertEqual(tools.rank(list(perm)),x)
+                self.assertEqual(tools.rank(list(perm),l),x)
+            self.assertEqual(tools.unrank(tools.fact(n),l),l)
+
+    def testRoundTrip(self):
+        """ rank(unrank(x)) == x pour de grandes listes. """
+        rnd = random.Random(1)
+        for i in range(200):
+            n = rnd.randint(0,60)
+            l = sorted("%03d" % k for k in range(n))
+            x = rnd.getrandbits(300) % tools.fact(n)
+            perm = tools.unrank(x,l)
+            self.assertEqual(sorted(perm),l)
+            self.assertEqual(tools.rank(perm),x)
+            self.assertEqual(tools.unrank(tools.rank(perm),l),perm)
+
+    def testPrefixCode(self):
+        """ Les codes de readRank()/writeRank() forment un code préfixe :
+            complet en mode fractionnaire, sur permutationBits(n) bits
+            sinon. """
+        for n in range(1,8):
+            count = tools.fact(n)
+            e = permutationBits(n)
+            for fractional in (False,True):
+                codes = []
+                for x in range(count if fractional else 1 << e):
+                    sink = BitSink()
+                    bits = writeRank(sink,x,n,fractional)
+                    self.assertEqual(bits,len(sink.bits))
+                    self.assertTrue(bits in (e,e+1))
+                    self.assertEqual(readRank(BitString(sink.bits+"0"),n,fractional),(x,bits))
+                    codes.append(sink.bits)
+                # un code préfixe d'un autre le précède directement dans
+                # l'ordre lexicographique
+                codes = sorted(codes)
+                for a,b in zip(codes,codes[1:]):
+                    self.assertFalse(b.startswith(a))
+                if fractional:
+                    self.assertEqual(sum(2.0**-len(c) for c in codes),1.0)
+
+    def testFractionalStream(self):
+        """ Les bits lus par readRank() sont réécrits à l'identique par
+            writeRank() à travers les couches paquet et binaire. """
+        rnd = random.Random(2)
+        data = "".join(chr(rnd.randrange(256)) for i in range(2000))
+        for fractional in (False,True):
+            reader = BinaryReader(PacketReader(FIFOBuffer(data)))
+            out = FIFOBuffer()
+            writer = BinaryWriter(PacketWriter(out))
+            total = 0
+            for i in range(1000):
+                n = rnd.randint(1,9)
+                x,bits = readRank(reader,n,fractional)
+                self.assertTrue(x < tools.fact(n))
+                self.assertEqual(writeRank(writer,x,n,fractional),bits)
+                total += bits
+            # complète le dernier paquet
+            r = -total % PACKET_SIZE
+            writer.write(reader.read(r),r)
+            total += r
+            self.assertEqual(out.getBuffer(),data[:total/PACKET_SIZE])
+
+class PatternTest(unittest.TestCase):
+    def testNext(self):
+        """ next() donne le résultat du module re pour chaque préfixe. """
+        for regexp in PATTERNS:
+            cache = {}
+            for eager in (False,True):
+                p = re.compile(regexp,eager)
+                for s in allStrings(4):
+                    got = run(p,s)
+                    for i,x in enumerate(got):
+                        self.assertEqual(x,expectedStatus(regexp,s[:i+1],cache),(regexp,s[:i+1],eager))
+
+    def testFeed(self):
+        """ feed() s'arrête au premier caractère qui donne ACCEPT ou FAIL,
+            comme next(). """
+        rnd = random.Random(3)
+        for regexp in PATTERNS:
+            for eager in (False,True):
+                p = re.compile(regexp,eager)
+                q = re.compile(regexp,eager)
+                for i in range(100):
+                    s = randomString(rnd,10)
+                    p.reset()
+                    steps = run(q,s)
+                    pos = 0
+                    while pos < len(s):
+                        state,end = p.feed(s,pos)
+                        self.assertTrue(end > pos)
+                        self.assertEqual(state,steps[end-1])
+                        self.assertEqual(state != re.PASS or end == len(s),True)
+                        if state == re.FAIL:
+                            break
+                        pos = end
+
+    def testSet(self):
+        """ matches() et status() d'un ensemble donnent les résultats de
+            chaque expression compilée seule. """
+        rnd = random.Random(4)
+        for eager in (False,True):
+            s = re.compileSet(PATTERNS,eager)
+            singles = [re.compile(regexp) for regexp in PATTERNS]
+            for i in range(300):
+                text = randomString(rnd,8)
+                s.reset()
+                for p in singles:
+                    p.reset()
+                status = [re.PASS]*len(PATTERNS)
+                for j,c in enumerate(text):
+                    x = s.next(c)
+                    status = [p.next(c) if status[k] != re.FAIL else re.FAIL
+                              for k,p in enumerate(singles)]
+                    self.assertEqual([s.status(k) for k in range(len(PATTERNS))],status)
+                    accepted = tuple(k for k,regexp in enumerate(PATTERNS)
+                                     if fullMatch(regexp,text[:j+1]))
+                    self.assertEqual(s.matches(),accepted)
+                    if accepted:
+                        self.assertEqual(x,re.ACCEPT)
+                    elif re.PASS in status:
+                        self.assertEqual(x,re.PASS)
+                    else:
+                        self.assertEqual(x,re.FAIL)
+                        break
+
+    def testBoundedCache(self):
+        """ Un automate borné vide son cache puis simule l'automate
+            non-déterministe sans changer les résultats. """
+        rnd = random.Random(5)
+        regexp = "(a|b)*a"+"(a|b)"*12
+        reference = re.compile(regexp)
+        p = re.compile(regexp,maxStates=50)
+        for i in range(20):
+            s = randomString(rnd,300,"ab")
+            self.assertEqual(run(p,s),run(reference,s))
+        self.assertTrue(p.automaton.flushes > 0)
+        self.assertTrue(p.automaton.fallback)
+        self.assertTrue(len(p.automaton.dstates) <= 50)
+        # seuls les automates bornés comptent les caractères
+        self.assertEqual(reference.automaton.bytes,0)
+        self.assertTrue(p.automaton.bytes > 0)
+        reference = re.compile("(ab|a)*c")
+        p = re.compile("(ab|a)*c",maxStates=3)
+        for s in allStrings(5):
+            self.assertEqual(run(p,s),run(reference,s))
+        self.assertTrue(p.automaton.flushes > 0)
+
+class SearchTest(unittest.TestCase):
+    def testSearch(self):
+        """ Les reconnaissances d'un Searcher sont celles d'une recherche
+            exhaustive, quel que soit le découpage du flux. """
+        rnd = random.Random(6)
+        for regexp in PATTERNS+["a+","a*","ab|a","a+b|a"]:
+            for maxStates in (None,4):
+                searcher = re.compileSearch(regexp,maxStates)
+                for i in range(100):
+                    s = randomString(rnd,25)
+                    searcher.reset()
+                    got = []
+                    pos = 0
+                    while pos < len(s):
+                        end = min(len(s),pos+rnd.randint(1,5))
+                        got += searcher.feed(s[:end],pos)
+                        pos = end
+                    got += searcher.flush()
+                    self.assertEqual(got,searchAll(regexp,s),(regexp,s))
+
+# messages HTTP traversant les filtres
+REQUEST = ("GET /index.html HTTP/1.1\r\nHost: www.example.com\r\n"
+           "User-Agent: Mozilla/5.0\r\nAccept: */*\r\nAccept-Language: fr\r\n"
+           "Connection: keep-alive\r\nCookie: a=b\r\n\r\n")
+BODY = ("<html lang='fr'><body class=\"x\" id='main' style='a'>"
+        "<a href=\"/x\" title='t' rel='nofollow' target='_blank'>x</a>"
+        "<img src='a.png' alt='b' width='3' height='4'/><p>texte</p></body></html>")
+RESPONSE = ("HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nServer: test\r\n"
+            "Content-Length: %d\r\n\r\n%s" % (len(BODY),BODY))
+SECRET = "".join(chr(random.Random(12).randrange(256)) for i in range(64))
+
+class StringSink(AbstractWriter):
+    """ Destination d'un flux d'octets mémorisés dans une chaîne. """
+    def __init__(self):
+        self.data = ""
+    def write(self,c):
+        self.data += c
+
+def secretReader(secret=SECRET):
+    return BinaryReader(PacketReader(FIFOBuffer(secret)))
+
+def pump(f,s):
+    """ Fait traverser s au filtre f caractère par caractère (write()) et
+        retourne la sortie. """
+    out = ""
+    for c in s:
+        if f.write(c) == FILTER_PASS:
+            out += f.read()
+            f.reset()
+    return out
+
+def pumpBlocks(f,s,rnd):
+    """ Fait traverser s au filtre f par blocs de taille aléatoire
+        (writeBlock()) et retourne la sortie. """
+    out = bytearray()
+    pos = 0
+    while pos < len(s):
+        end = min(len(s),pos+rnd.randint(1,80))
+        filterBlock(f,s[pos:end],out)
+        pos = end
+    return str(out)
+
+def randomTag(rnd):
+    """ Balise HTML aléatoire, avec ou sans attributs. """
+    def name():
+        return rnd.choice("abAZ_9")+randomString(rnd,4,"ab.-_0")
+    def space():
+        return rnd.choice(["",""," ","  ","\n","\t "])
+    tag = "<"+name()
+    for i in range(rnd.randint(0,4)):
+        quote = rnd.choice("\"'")
+        value = "".join(rnd.choice(["x"," ","=","/",">","&amp;","&#12;",
+                                    "'" if quote == '"' else '"'])
+                        for j in range(rnd.randint(0,5)))
+        tag += (space() or " ")+name()+space()+"="+space()+quote+value+quote
+    return tag+space()+rnd.choice(["","/"])+">"
+
+class CaptureTest(unittest.TestCase):
+    def testGroups(self):
+        """ La dernière occurrence de chaque groupe est celle que donne le
+            module re, avec next() comme avec feed(). """
+        for regexp in CAPTURE_PATTERNS:
+            p = re.compileCaptures(regexp)
+            q = stdre.compile("(?:"+regexp+r")\Z",stdre.DOTALL)
+            for s in allStrings(5):
+                m = q.match(s)
+                got = run(p,s)
+                if not m:
+                    self.assertEqual(p.groups(),None)
+                    continue
+                self.assertEqual(got[-1],re.ACCEPT)
+                g = p.groups()
+                self.assertEqual(g[0],[(0,len(s))])
+                for i in range(1,len(g)):
+                    self.assertEqual(g[i][-1] if g[i] else (-1,-1),m.span(i),(regexp,s,i))
+                # feed() s'arrête à chaque préfixe reconnu
+                p.reset()
+                pos = 0
+                while pos < len(s):
+                    x,pos = p.feed(s,pos)
+                self.assertEqual(x,re.ACCEPT)
+                self.assertEqual(p.groups(),g)
+
+    def testSelectedGroups(self):
+        """ Les groupes qui ne sont pas capturés restent vides. """
+        p = re.compileCaptures("(a+)(b+)(c+)",(2,))
+        run(p,"aabbbc")
+        self.assertEqual(p.groups(),[[(0,6)],[],[(2,5)],[]])
+
+    def testSaveLoad(self):
+        """ Un automate à marques enregistré puis rechargé relève les mêmes
+            positions. """
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory,"captures.dfa")
+            p = re.compileCaptures(CAPTURE_PATTERNS[0])
+            re.save(p,filename)
+            q = re.load(filename)
+            self.assertTrue(isinstance(q,re.CapturePattern))
+            self.assertEqual(re.loadSource(CAPTURE_PATTERNS[0],filename),None)
+            self.assertEqual(re.loadSource(CAPTURE_PATTERNS[0],filename,p.automaton.captured).source,CAPTURE_PATTERNS[0])
+            for s in allStrings(4):
+                self.assertEqual(run(q,s),run(p,s))
+                self.assertEqual(q.groups(),p.groups())
+        finally:
+            shutil.rmtree(directory)
+
+    def testHTMLTag(self):
+        """ HTMLTagExtract() découpe les balises comme
+            tools.XMLTagExtract(). """
+        rnd = random.Random(11)
+        p = re.compileCaptures(REGEXP_HTML_TAG,HTML_TAG_GROUPS)
+        for i in range(500):
+            tag = randomTag(rnd)
+            self.assertEqual(run(p,tag)[-1],re.ACCEPT,tag)
+            attribs,begin,end = HTMLTagExtract(p,tag)
+            if attribs:
+                self.assertEqual((attribs,begin,end),tools.XMLTagExtract(tag),tag)
+            else:
+                self.assertEqual(attribs,[])
+
+class SaveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testSaveLoad(self):
+        """ Un automate enregistré puis rechargé donne les mêmes résultats
+            que l'expression d'origine. """
+        filename = os.path.join(self.directory,"test.dfa")
+        for regexp in PATTERNS:
+            for eager in (False,True):
+                p = re.compile(regexp,eager)
+                re.save(p,filename)
+                q = re.load(filename)
+                self.assertEqual(q.automaton.source,regexp)
+                for s in allStrings(4):
+                    self.assertEqual(run(q,s),run(p,s))
+        s = re.compileSet(PATTERNS)
+        re.save(s,filename)
+        q = re.load(filename)
+        for text in allStrings(4):
+            run(s,text)
+            run(q,text)
+            self.assertEqual(q.matches(),s.matches())
+        self.assertEqual(os.listdir(self.directory),["test.dfa"])
+
+    def testInvalidFile(self):
+        """ Un fichier qui n'est pas un automate est refusé. """
+        filename = os.path.join(self.directory,"bad.dfa")
+        f = open(filename,"wb")
+        f.write("not an automaton")
+        f.close()
+        self.assertRaises(re.RegexpException,re.load,filename)
+        self.assertEqual(re.loadSource("a",filename),None)
+        # fichier tronqué au milieu de la table des transitions
+        re.save(re.compile(PATTERNS[0],True),filename)
+        f = open(filename,"rb")
+        data = f.read()
+        f.close()
+        f = open(filename,"wb")
+        f.write(data[:-3])
+        f.close()
+        self.assertRaises(re.RegexpException,re.load,filename)
+
+    def testShared(self):
+        """ compileShared() n'écrit le fichier que sur demande et ne recharge
+            que l'automate de la même expression. """
+        filename = os.path.join(self.directory,"shared.dfa")
+        regexp = "(ab|a)*c"
+        re.sharedAutomata.clear()
+        re.compileShared(regexp,True,filename=filename)
+        self.assertFalse(os.path.exists(filename))
+        re.sharedAutomata.clear()
+        p = re.compileShared(regexp,True,filename=filename,write=True)
+        self.assertTrue(os.path.exists(filename))
+        self.assertEqual(re.loadSource("a.c",filename),None)
+        re.sharedAutomata.clear()
+        q = re.compileShared(regexp,True,filename=filename)
+        for s in allStrings(4):
+            self.assertEqual(run(q,s),run(p,s))
+        re.sharedAutomata.clear()
+
+class FIFOBufferTest(unittest.TestCase):
+    def testWrapAround(self):
+        """ Le tableau circulaire donne les caractères de la file, dans
+            l'ordre, quels que soient les débordements et agrandissements. """
+        rnd = random.Random(7)
+        data = "".join(chr(rnd.randrange(256)) for i in range(2*FIFO_INITIAL_SIZE))
+        fifo = FIFOBuffer()
+        model = ""
+        for i in range(3000):
+            if rnd.random() < 0.5:
+                k = rnd.randrange(len(data))
+                s = data[k:k+rnd.randint(0,3*FIFO_INITIAL_SIZE/2)]
+                fifo.write(s)
+                model += s
+            else:
+                n = rnd.randint(0,len(model)+2)
+                self.assertEqual(fifo.read(n),model[:n])
+                model = model[n:]
+            self.assertEqual(fifo.sizeOfData(),len(model))
+            self.assertEqual(fifo.getBuffer(),model)
+        self.assertEqual(FIFOBuffer("abc").read(5),"abc")
+
+    def testHighWater(self):
+        fifo = FIFOBuffer("",4)
+        fifo.write("abc")
+        self.assertFalse(fifo.isFull())
+        fifo.write("d")
+        self.assertTrue(fifo.isFull())
+        fifo.read(1)
+        self.assertFalse(fifo.isFull())
+        self.assertTrue(FIFOBuffer("abcde",4).isFull())
+        self.assertFalse(FIFOBuffer("abcde").isFull())
+
+    def testGrowWrapped(self):
+        """ Un tableau plein dont le contenu fait le tour est agrandi sans
+            perdre l'ordre des caractères, une lecture ne le réduit pas. """
+        fifo = FIFOBuffer()
+        size = FIFO_INITIAL_SIZE
+        fifo.write("a"*(size-10))
+        self.assertEqual(fifo.read(size-20),"a"*(size-20))
+        fifo.write("b"*20)
+        self.assertEqual(fifo.start,size-20)
+        self.assertEqual(len(fifo.buffer),size)
+        fifo.write("c"*size)
+        self.assertEqual(len(fifo.buffer),2*size)
+        self.assertEqual(fifo.getBuffer(),"a"*10+"b"*20+"c"*size)
+        self.assertEqual(fifo.read(30),"a"*10+"b"*20)
+        self.assertEqual(len(fifo.buffer),2*size)
+        self.assertEqual(fifo.read(2*size),"c"*size)
+        self.assertEqual(fifo.start,0)
+
+def packetBits(packets):
+    """ Chaîne des bits (PACKET_SIZE par paquet) d'une liste de
+        paquets. """
+    return "".join(bin(p)[2:].zfill(PACKET_SIZE) for p in packets)
+
+class PacketTest(unittest.TestCase):
+    def testEncodeDecode(self):
+        """ encodePackets() et decodePackets() donnent le résultat du
+            codage paquet par paquet. """
+        rnd = random.Random(15)
+        for i in range(500):
+            s = "".join(chr(rnd.randrange(256)) for k in range(rnd.randint(0,20)))
+            n = len(s)+rnd.randint(0,3)
+            packets = map(ord,s)+[PACKET_EMPTY]*(n-len(s))
+            x = encodePackets(s,n)
+            self.assertEqual(x,int(packetBits(packets) or "0",2))
+            self.assertEqual(decodePackets(x,n),s)
+            # les bits au-delà des n paquets sont ignorés
+            self.assertEqual(decodePackets(x | (rnd.getrandbits(20) << (n*PACKET_SIZE)),n),s)
+            # paquets quelconques : les paquets vides sont ignorés
+            packets = [rnd.randrange(PACKET_MASK+1) for k in range(n)]
+            sink = StringSink()
+            PacketWriter(sink).write(packets)
+            self.assertEqual(decodePackets(int(packetBits(packets) or "0",2),n),sink.data)
+
+    def testReaderWriter(self):
+        """ readPackets() et writePackets() équivalent à read() et
+            write() sur les mêmes paquets. """
+        rnd = random.Random(16)
+        data = "".join(chr(rnd.randrange(256)) for i in range(200))
+        bulk = PacketReader(FIFOBuffer(data))
+        single = PacketReader(FIFOBuffer(data))
+        bulkSink = StringSink()
+        singleSink = StringSink()
+        total = 0
+        for i in range(40):
+            n = rnd.randint(0,12)
+            total += n
+            x = bulk.readPackets(n)
+            packets = single.read(n)
+            self.assertEqual(x,int(packetBits(packets) or "0",2))
+            PacketWriter(bulkSink).writePackets(x,n)
+            PacketWriter(singleSink).write(packets)
+        self.assertEqual(bulkSink.data,singleSink.data)
+        self.assertEqual(bulkSink.data,data[:total])
+
+    def testBinary(self):
+        """ BinaryReader et BinaryWriter lisent et écrivent les bits des
+            paquets dans l'ordre, quelle que soit la taille des lectures. """
+        rnd = random.Random(17)
+        data = "".join(chr(rnd.randrange(256)) for i in range(200))
+        bits = packetBits(map(ord,data)+[PACKET_EMPTY]*10)
+        reader = secretReader(data)
+        sink = StringSink()
+        writer = BinaryWriter(PacketWriter(sink))
+        pos = 0
+        while pos < len(bits)-40:
+            k = rnd.randint(0,40)
+            x = reader.read(k)
+            self.assertEqual(x,int(bits[pos:pos+k] or "0",2))
+            writer.write(x,k)
+            pos += k
+        # seuls les paquets complets sont écrits
+        self.assertEqual(sink.data,data[:pos/PACKET_SIZE])
+
+def later(delay,function,*args):
+    """ Appelle function(*args) dans un autre thread après delay
+        secondes. """
+    t = threading.Timer(delay,function,args)
+    t.start()
+    return t
+
+class SynchronizedFIFOBufferTest(unittest.TestCase):
+    def testReadTimeout(self):
+        """ Une lecture sur une file vide n'attend que si un délai est
+            donné. """
+        fifo = SynchronizedFIFOBuffer()
+        t = time.time()
+        self.assertEqual(fifo.read(5),"")
+        self.assertEqual(fifo.read(5,0.1),"")
+        self.assertTrue(time.time()-t >= 0.09)
+
+    def testBlockingRead(self):
+        """ Un lecteur en attente est réveillé par l'écriture suivante. """
+        fifo = SynchronizedFIFOBuffer()
+        t = later(0.05,fifo.write,"abc")
+        self.assertEqual(fifo.read(5,None),"abc")
+        t.join()
+        t = later(0.05,fifo.writeMany,["de","f"])
+        self.assertEqual(fifo.read(2,5.0),"de")
+        t.join()
+        self.assertEqual(fifo.read(5),"f")
+
+    def testBlockingWrite(self):
+        """ Une écriture dans une file pleine attend qu'un lecteur la vide
+            ou échoue sans rien écrire après son délai. """
+        fifo = SynchronizedFIFOBuffer("abcd",4)
+        t = time.time()
+        self.assertFalse(fifo.write("e",0.1))
+        self.assertFalse(fifo.writeMany(["e","f"],0.1))
+        self.assertTrue(time.time()-t >= 0.18)
+        self.assertEqual(fifo.getBuffer(),"abcd")
+        t = later(0.05,fifo.read,1)
+        self.assertTrue(fifo.write("e"))
+        t.join()
+        self.assertEqual(fifo.getBuffer(),"bcde")
+
+    def testWriteMany(self):
+        """ writeMany() écrit toutes les chaînes dans l'ordre dès que la
+            file n'est plus pleine, même si elles la font déborder. """
+        fifo = SynchronizedFIFOBuffer("",4)
+        self.assertTrue(fifo.writeMany(["ab","","cde","f"]))
+        self.assertEqual(fifo.getBuffer(),"abcdef")
+        self.assertTrue(fifo.isFull())
+        self.assertEqual(fifo.read(3),"abc")
+        self.assertFalse(fifo.isFull())
+        self.assertTrue(fifo.writeMany([],0))
+        self.assertEqual(fifo.sizeOfData(),3)
+
+class TransactionTest(unittest.TestCase):
+    def testReader(self):
+        """ Les lectures d'un BinaryTransactionReader suivent un modèle où
+            chaque point de sauvegarde est une position dans le flux. """
+        rnd = random.Random(8)
+        source = BitSource(9)
+        reader = BinaryTransactionReader(source)
+        base = 0
+        pos = 0
+        savepoints = []
+        for i in range(3000):
+            op = rnd.random()
+            if op < 0.6:
+                n = rnd.randint(0,40)
+                x = reader.read(n)
+                bits = source.bits[base+pos:base+pos+n]
+                self.assertEqual(x,int(bits,2) if bits else 0)
+                pos += n
+            elif op < 0.7:
+                reader.commit()
+                base += pos
+                pos = 0
+                savepoints = []
+            elif op < 0.75:
+                reader.rollback()
+                pos = 0
+                savepoints = []
+            elif op < 0.85:
+                savepoints.append(pos)
+                self.assertEqual(reader.savepoint(),len(savepoints)-1)
+            elif savepoints:
+                k = rnd.randrange(len(savepoints))
+                if op < 0.95:
+                    reader.rollbackTo(k)
+                    pos = savepoints[k]
+                    del savepoints[k+1:]
+                else:
+                    reader.release(k)
+                    del savepoints[k:]
+
+    def testWriter(self):
+        """ Seules les écritures validées d'un BinaryTransactionWriter
+            atteignent le flux. """
+        rnd = random.Random(10)
+        sink = BitSink()
+        writer = BinaryTransactionWriter(sink)
+        committed = ""
+        pending = ""
+        savepoints = []
+        for i in range(3000):
+            op = rnd.random()
+            if op < 0.6:
+                n = rnd.randint(0,40)
+                x = rnd.getrandbits(n+3)
+                writer.write(x,n)
+                pending += bin(x & ((1 << n)-1))[2:].zfill(n) if n else ""
+            elif op < 0.7:
+                writer.commit()
+                committed += pending
+                pending = ""
+                savepoints = []
+                self.assertEqual(sink.bits,committed)
+            elif op < 0.75:
+                writer.rollback()
+                pending = ""
+                savepoints = []
+            elif op < 0.85:
+                savepoints.append(len(pending))
+                self.assertEqual(writer.savepoint(),len(savepoints)-1)
+            elif savepoints:
+                k = rnd.randrange(len(savepoints))
+                if op < 0.95:
+                    writer.rollbackTo(k)
+                    pending = pending[:savepoints[k]]
+                    del savepoints[k+1:]
+                else:
+                    writer.release(k)
+                    del savepoints[k:]
+        writer.commit()
+        self.assertEqual(sink.bits,committed+pending)
+
+class BlockTest(unittest.TestCase):
+    # piles de filtres d'entrée (reader) et de sortie (writer)
+    def stacks(self):
+        return [(lambda r: HTTPHeaderPermutFilterIn(r),
+                 lambda w: HTTPHeaderPermutFilterOut(w)),
+                (lambda r: SerialFilterGroup([HTTPDataExtractorFilter(HTMLTagsPermutFilterIn(r)),
+                                              HTTPHeaderPermutFilterIn(r)]),
+                 lambda w: SerialFilterGroup([HTTPDataExtractorFilter(HTMLTagsPermutFilterOut(w)),
+                                              HTTPHeaderPermutFilterOut(w)]))]
+
+    def testWriteBlock(self):
+        """ writeBlock() produit la sortie de write() caractère par
+            caractère et lit les mêmes bits, quel que soit le découpage. """
+        rnd = random.Random(13)
+        data = "texte "+REQUEST*2+RESPONSE+"<p a='1' b='2'>"+RESPONSE*2+REQUEST
+        factories = [f for f,g in self.stacks()]
+        factories.append(lambda r: SerialFilterGroup([HTTPHeaderPermutFilterIn(r),
+                                                      HTTPHeaderHostChanger("remote:80")]))
+        for factory in factories:
+            for i in range(5):
+                fifo = FIFOBuffer(SECRET)
+                expected = pump(factory(BinaryReader(PacketReader(fifo))),data)
+                left = fifo.sizeOfData()
+                fifo = FIFOBuffer(SECRET)
+                got = pumpBlocks(factory(BinaryReader(PacketReader(fifo))),data,rnd)
+                self.assertEqual(got,expected)
+                self.assertEqual(fifo.sizeOfData(),left)
+
+    def testRoundTrip(self):
+        """ Les caractères cachés par une pile d'entrée sont retrouvés par la
+            pile de sortie correspondante, qui ne modifie pas le flux. """
+        rnd = random.Random(14)
+        for messages,(stackIn,stackOut) in zip([REQUEST,RESPONSE],self.stacks()):
+            fin = stackIn(secretReader())
+            sink = StringSink()
+            fout = stackOut(BinaryWriter(PacketWriter(sink)))
+            for i in range(20):
+                encoded = pumpBlocks(fin,messages,rnd)
+                self.assertEqual(pumpBlocks(fout,encoded,rnd),encoded)
+            self.assertTrue(len(sink.data) >= 20)
+            self.assertEqual(sink.data,SECRET[:len(sink.data)])
+
+class StatsTest(unittest.TestCase):
+    def testCounters(self):
+        """ Les compteurs relèvent les octets, les messages et les bits
+            cachés de chaque filtre d'une pile. """
+        rnd = random.Random(18)
+        group = SerialFilterGroup([HTTPHeaderPermutFilterIn(secretReader()),
+                                   HTTPHeaderHostChanger("remote:80")])
+        self.assertEqual(group.snapshotStats(),[])
+        group.enableStats()
+        data = "texte "+REQUEST*3
+        out = pumpBlocks(group,data,rnd)
+        stats = dict(group.snapshotStats())
+        self.assertEqual(sorted(stats),["SerialFilterGroup",
+                                        "SerialFilterGroup/0:HTTPHeaderPermutFilterIn",
+                                        "SerialFilterGroup/1:HTTPHeaderHostChanger"])
+        g = stats["SerialFilterGroup"]
+        self.assertEqual((g["bytesIn"],g["bytesOut"]),(len(data),len(out)))
+        f = stats["SerialFilterGroup/0:HTTPHeaderPermutFilterIn"]
+        self.assertEqual(f["bytesIn"],len(data))
+        self.assertEqual(f["messages"],3)
+        self.assertEqual(f["covertBits"],3*permutationBits(6))
+        self.assertEqual(stats["SerialFilterGroup/1:HTTPHeaderHostChanger"]["covertBits"],0)
+        self.assertEqual(sum(s["exceptions"]+s["resets"] for s in stats.values()),0)
+        # la copie ne suit pas les compteurs
+        f["messages"] = 0
+        self.assertEqual(dict(group.snapshotStats())["SerialFilterGroup/0:HTTPHeaderPermutFilterIn"]["messages"],3)
+        group.enableStats(False)
+        self.assertEqual(group.snapshotStats(),[])
+
+    def testWaiting(self):
+        """ Un message reçu en plusieurs blocs est compté en attente, un
+            message abandonné comme une remise à zéro et une erreur comme une
+            exception. """
+        f = HTTPHeaderPermutFilterIn(secretReader())
+        f.enableStats()
+        k = len(REQUEST)/2
+        self.assertEqual(f.writeBlock(REQUEST[:k])[:2],(k,FILTER_WAITING))
+        self.assertEqual(f.writeBlock(REQUEST,k)[:2],(len(REQUEST)-k,FILTER_EMPTY))
+        f.writeBlock(REQUEST[:k])
+        f.reset()
+        f.state = FILTER_PASS
+        self.assertRaises(FilterException,f.writeBlock,REQUEST)
+        stats = f.stats.snapshot()
+        self.assertEqual(stats["waitingBytes"],len(REQUEST)+k)
+        self.assertEqual(stats["messages"],1)
+        self.assertEqual(stats["resets"],1)
+        self.assertEqual(stats["exceptions"],1)
+        self.assertEqual(stats["bytesIn"],len(REQUEST)+k)
+
+class TracerTest(unittest.TestCase):
+    def testRingBuffer(self):
+        """ Le traceur ne garde que les derniers événements, dans l'ordre. """
+        tracer = RingBufferTracer(3)
+        for i in range(5):
+            tracer.trace(self,"event",i)
+        self.assertEqual([e[1:] for e in tracer.events()],[(self,"event",i) for i in (2,3,4)])
+        out = StringIO.StringIO()
+        tracer.dump(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0],"(2 events lost)")
+        self.assertEqual([l.split()[-1] for l in lines[1:]],["2","3","4"])
+        tracer.clear()
+        self.assertEqual(tracer.events(),[])
+
+    def testSetTracer(self):
+        """ setTracer() installe le traceur sur toute la pile sans changer sa
+            sortie, None le désinstalle. """
+        rnd = random.Random(19)
+        expected = pumpBlocks(SerialFilterGroup([HTTPHeaderPermutFilterIn(secretReader())]),REQUEST*2,rnd)
+        reader = BinaryTransactionReader(secretReader())
+        f = HTTPHeaderPermutFilterIn(reader)
+        group = SerialFilterGroup([f])
+        tracer = RingBufferTracer()
+        setTracer(group,tracer)
+        self.assertTrue(f.tracer is tracer and reader.tracer is tracer)
+        self.assertEqual(pumpBlocks(group,REQUEST*2,rnd),expected)
+        reader.commit()
+        events = [(source,event) for t,source,event,detail in tracer.events()]
+        for e in [(group,"block"),(f,"block"),(f,"read"),(reader,"commit")]:
+            self.assertTrue(e in events,e)
+        setTracer(group,None)
+        count = tracer.count
+        pumpBlocks(group,REQUEST,rnd)
+        reader.commit()
+        self.assertEqual(tracer.count,count)
+        # sans méthode setTracer(), l'objet est ignoré
+        setTracer(FIFOBuffer(),tracer)
+
+class BodyCacheTest(unittest.TestCase):
+    def testLRUCache(self):
+        """ Le cache supprime les entrées les moins récemment utilisées
+            jusqu'à être à moitié vide. """
+        cache = tools.LRUCache(4)
+        for key in "abcd":
+            cache.put(key,key.upper())
+        self.assertEqual(cache.get("a"),"A")
+        cache.put("e","E")
+        self.assertEqual(sorted(cache.entries),["a","e"])
+        self.assertEqual(cache.get("b"),None)
+        cache.put("a","X",2)
+        self.assertEqual((cache.get("a"),cache.size),("X",3))
+        cache.put("f","F",5)
+        self.assertEqual(cache.get("f","-"),"-")
+        self.assertEqual((cache.hits,cache.misses),(2,2))
+        cache.clear()
+        self.assertEqual((cache.entries,cache.size,cache.hits,cache.misses),({},0,0,0))
+
+    def testFilterBody(self):
+        """ filterBody() produit la sortie de filterBlock() et lit les mêmes
+            bits, que la structure du corps soit dans le cache ou non. """
+        bodies = [BODY,"<p a='1' b='2' c='3'>x</p>",BODY+"<br/>"]
+        # toutes les structures, deux au plus, aucune
+        for capacity in (BODY_CACHE_SIZE,600,0):
+            fifo = FIFOBuffer(SECRET*4)
+            cached = HTMLTagsPermutFilterIn(BinaryReader(PacketReader(fifo)))
+            cached.bodyCache = tools.LRUCache(capacity)
+            cached.enableStats()
+            fifo2 = FIFOBuffer(SECRET*4)
+            plain = HTMLTagsPermutFilterIn(BinaryReader(PacketReader(fifo2)))
+            plain.enableStats()
+            for i in range(15):
+                body = bodies[(0,1,0,2)[i % 4]]
+                out = bytearray()
+                expected = bytearray()
+                self.assertEqual(cached.filterBody(body,out),FILTER_EMPTY)
+                filterBlock(plain,body,expected)
+                self.assertEqual(out,expected)
+                self.assertEqual(fifo.sizeOfData(),fifo2.sizeOfData())
+            for counter in ("messages","covertBits","bytesIn","bytesOut"):
+                self.assertEqual(getattr(cached.stats,counter),getattr(plain.stats,counter))
+            self.assertTrue(cached.bodyCache.size <= capacity)
+            if capacity == BODY_CACHE_SIZE:
+                self.assertEqual(cached.bodyCache.misses,len(bodies))
+            elif capacity:
+                # les structures s'évincent mutuellement
+                self.assertTrue(cached.bodyCache.misses > len(bodies))
+                self.assertTrue(cached.bodyCache.hits > 0)
+            else:
+                self.assertEqual(cached.bodyCache.entries,{})
+        # un corps coupé au milieu d'une balise n'est pas mémorisé
+        f = HTMLTagsPermutFilterIn(secretReader())
+        f.filterBody(BODY[:20],bytearray())
+        self.assertEqual(f.bodyCache.entries,{})
+        self.assertEqual(f.state,FILTER_WAITING)
+
+# réponse dont le corps est découpé en chunks (corps "hello world")
+CHUNKED = ("HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\nServer: test\r\n\r\n"
+           "5\r\nhello\r\n6\r\n world\r\n0\r\n")
+
+class HTTPRecorder(AbstractHTTPListener):
+    """ Abonné qui relève le corps des messages analysés. """
+    def __init__(self):
+        self.body = ""
+        self.ended = False
+    def bodySegment(self,message,data):
+        self.body += str(data)
+    def messageEnd(self,message):
+        self.ended = True
+
+class HTTPParserTest(unittest.TestCase):
+    def parse(self,parser,s,rnd):
+        """ Analyse le début de s par blocs de taille aléatoire et retourne le
+            couple (nombre de caractères consommés, résultat). """
+        pos = 0
+        x = HTTP_WAITING
+        while pos < len(s) and x == HTTP_WAITING:
+            end = min(len(s),pos+rnd.randint(1,30))
+            n,x = parser.feed(s[:end],pos)
+            pos += n
+        return (pos,x)
+
+    def testMessages(self):
+        """ Le modèle du message ne dépend pas du découpage du flux. """
+        rnd = random.Random(21)
+        cases = [(REQUEST,False,HTTP_HEADERS,""),(RESPONSE,False,HTTP_HEADERS,""),
+                 (RESPONSE,True,HTTP_END,BODY),(CHUNKED,True,HTTP_END,"hello world"),
+                 (REQUEST,True,HTTP_HEADERS,"")]
+        for text,body,result,content in cases:
+            head = text[:text.index("\r\n\r\n")+4]
+            lines = head.split("\r\n")[:-2]
+            for i in range(20):
+                parser = HTTPMessageParser(body)
+                recorder = HTTPRecorder()
+                parser.subscribe(recorder)
+                n,x = self.parse(parser,text+"suite",rnd)
+                # sans analyse du corps, le message s'arrête aux entêtes
+                self.assertEqual((n,x),(len(text) if content else len(head),result))
+                m = parser.message
+                self.assertEqual(m.requestLine,lines[0]+"\r\n")
+                self.assertEqual(m.headers,[l+"\r\n" for l in lines[1:]])
+                self.assertEqual([head[k:].split("\r\n")[0] for k in m.offsets],lines[1:])
+                self.assertEqual(m.head(),head)
+                self.assertEqual(m.chunked,"Transfer-Encoding: chunked" in lines)
+                self.assertEqual(recorder.body,content)
+                self.assertEqual(recorder.ended,result == HTTP_END)
+                self.assertEqual(parser.feed("x"),(0,result))
+
+    def testErrors(self):
+        """ Un flux qui n'est pas un message HTTP ou dont les chunks sont
+            invalides donne HTTP_ERROR. """
+        rnd = random.Random(22)
+        head = CHUNKED[:CHUNKED.index("\r\n\r\n")+4]
+        for text in ["hello world","GET/index.html HTTP/1.1\r\n","HTTP/1.1 600 OK\r\n",
+                     head+"zz\r\nhello\r\n",head+"5\r\nhelloX\r\n",
+                     head+"5\r\nhello\rX"]:
+            parser = HTTPMessageParser(True)
+            self.assertEqual(self.parse(parser,text,rnd)[1],HTTP_ERROR,text)
+
+    def testGroup(self):
+        """ Un HTTPFilterGroup produit la sortie du SerialFilterGroup des
+            mêmes filtres et lit les mêmes bits. """
+        rnd = random.Random(23)
+        data = "texte "+REQUEST+RESPONSE+CHUNKED+"<p a='1' b='2'>"+RESPONSE+REQUEST*2
+        for group in (SerialFilterGroup,HTTPFilterGroup):
+            fifo = FIFOBuffer(SECRET*2)
+            r = BinaryReader(PacketReader(fifo))
+            f = group([HTTPDataExtractorFilter(HTMLTagsPermutFilterIn(r)),
+                       HTTPHeaderPermutFilterIn(r),HTTPHeaderHostChanger("remote:80")])
+            f.enableStats()
+            out = pumpBlocks(f,data,rnd)
+            bits = sum(s["covertBits"] for name,s in f.snapshotStats()[1:])
+            if group == SerialFilterGroup:
+                expected = (out,fifo.sizeOfData(),bits)
+            else:
+                self.assertEqual((out,fifo.sizeOfData(),bits),expected)
+        self.assertTrue("Host: remote:80\r\n" in out)
+        self.assertTrue(bits > 0)
+
+if __name__=='__main__':
+    unittest.main()
@@ -5,6 +5,8 @@
     Remerciements spéciaux à D. Kratsch pour les cours d'algo pour le tri
     fusion :)."""
 
+import bisect
+
 factCache = [1]
 
 def fact(i) :
@@ -20,53 +22,107 @@ def unrank(x,l):
     """ Calcule la xième permutation de la liste l en tenant compte de l'ordre
         lexicographique des permutations. x == 0 correspond à la première
         permutations, c'est à dire la liste triée en ordre lexicographique.
-        La liste l est supposée triée. """
-    m = []
+        La liste l est supposée triée, elle n'est pas modifiée.
+        Les chiffres de x en base factorielle (divisions entières exactes par
+        de petits entiers) donnent, pour chaque position, l'indice de
+        l'élément choisi parmi ceux qui restent. """
     n = len(l)
-    f = fact(n)
-    x = x % f
-    while l:
-        f /= n
-        q,r = divmod(x,f)
-        m.append(l.pop(q))
-        n -= 1
-        x = r
-    return m
+    x = x % fact(n)
+    # chiffres en base factorielle, du dernier au premier
+    digits = []
+    for k in xrange(1,n+1):
+        x,c = divmod(x,k)
+        digits.append(c)
+    digits.reverse()
+    # REM : list.pop() déplace les éléments suivants en C, ce qui reste plus
+    # rapide qu'un arbre de Fenwick en python pour les tailles rencontrées
+    # (entêtes, attributs), le coût étant dominé par les calculs sur x
+    remaining = list(l)
+    return [remaining.pop(c) for c in digits]
         
-def rank(l):
-    """ Fonction inverse de 'rank'. Cette fonction trouve à quelle indice
+def rank(l,ordered=None):
+    """ Fonction inverse de 'unrank'. Cette fonction trouve à quelle indice
         se situe la permutation donnée en paramètre. L'ordre lexicographique des
-        objets de la liste est utilisé pour retrouvé l'indice. """
+        objets de la liste est utilisé pour retrouvé l'indice. La liste l
+        n'est pas modifiée.
+        Le chiffre en base factorielle de chaque élément est son indice parmi
+        les éléments qui le suivent, triés : il est trouvé par dichotomie
+        (O(log n) comparaisons au lieu de O(n)), le rang est ensuite accumulé
+        par la méthode de Horner.
+        ordered peut donner les éléments de l déjà triés (la liste n'est pas
+        modifiée), ce qui évite de les trier à nouveau. """
     n = len(l)
     if n == 1 or n == 0:
         return 0 #une seule permutation possible !
-    # REM : ici, on doit effectuer un tri sur la liste car on ne dispose pas des
-    # indices absolus des éléments (on doit donc les comparer)
-    # On peut peut être réduire le temps d'exécution qui est de O(n*n) en
-    # utilisant un autre tri mais cela semble difficile (même avec un tri
-    # récursif de type tri-fusion puisqu'il faut tenir compte du cout de
-    # permutation pour calculer le rang)
-    m = [l.pop()]
+    if ordered == None:
+        remaining = sorted(l)
+    else:
+        remaining = list(ordered)
     r = 0
-    n = 1
-    # cout d'une permutation au départ
-    cost = 1
-    while l:
-        e = l.pop()
-        i = 0
-        while (i < len(m)) and (m[i] < e):
-            i += 1
-            r += cost
-        # élément en fin de liste
-        if i == len(m):
-            m.append(e)
-        # insertion
-        elif m[i] >= e:
-            m.insert(i,e)
-        n += 1
-        cost *= n
+    for e in l:
+        i = bisect.bisect_left(remaining,e)
+        del remaining[i]
+        r = r*n+i
+        n -= 1
     return r
 
+class LRUCache:
+    """ Cache borné dont les entrées les moins récemment utilisées sont
+        supprimées en premier. Chaque entrée a une taille (1 par défaut), la
+        somme des tailles ne dépasse pas capacity.
+        Une lecture ne coûte qu'un accès au dictionnaire : les entrées sont
+        datées à chaque utilisation et, lorsque le cache est plein, les
+        entrées les plus anciennes sont supprimées jusqu'à ce qu'il soit à
+        moitié vide (un tri pour plusieurs insertions). """
+    def __init__(self,capacity):
+        self.capacity = capacity
+        # clé -> [valeur,date de dernière utilisation,taille]
+        self.entries = {}
+        self.size = 0
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+    def get(self,key,default=None):
+        """ Retourne la valeur associée à key, ou default si elle n'est pas
+            dans le cache. """
+        e = self.entries.get(key)
+        if e == None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.clock += 1
+        e[1] = self.clock
+        return e[0]
+    def put(self,key,value,size=1):
+        """ Ajoute (ou remplace) la valeur associée à key. Une valeur plus
+            grande que le cache n'est pas conservée. """
+        e = self.entries.pop(key,None)
+        if e != None:
+            self.size -= e[2]
+        if size > self.capacity:
+            return
+        if self.size+size > self.capacity:
+            self.evict((self.capacity >> 1)-size)
+        self.clock += 1
+        self.entries[key] = [value,self.clock,size]
+        self.size += size
+    def evict(self,size):
+        """ Supprime les entrées les moins récemment utilisées jusqu'à ce que
+            la taille du cache ne dépasse plus size. """
+        old = sorted(self.entries.iteritems(),key=lambda item: item[1][1])
+        for key,e in old:
+            if self.size <= size:
+                break
+            del self.entries[key]
+            self.size -= e[2]
+    def clear(self):
+        """ Vide le cache et remet à zéro ses compteurs (hits, misses). """
+        self.entries = {}
+        self.size = 0
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+
 def intToBinaryList(n,m):
     """ Converti un entier n en sa représentation binaire sous forme de liste.
         le bit de poids faible se trouve en fin de liste. m précise le nombre